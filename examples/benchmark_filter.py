@@ -0,0 +1,68 @@
+""" Benchmarks the parallel filter of pepeye with an increasing number of threads.
+
+    Usage: python benchmark_filter.py PROFILE [SEARCH_TEXT] [--repeat N]
+
+    The rows of the profile are repeated N times to simulate a big (aggregated) profile.
+    Note that the search holds the GIL on a regular CPython build, so the threads only
+    scale on a free-threaded build (e.g. python3.13t).
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libpepeye.query import isGilEnabled, searchIndexPositions
+from libpepeye.statsstore import STORE_REGISTRY, SearchIndex
+
+
+def searchTime(index, searchText, workers, nRuns=5):
+    """ Returns the best time of nRuns searches of all chunks of the index.
+    """
+    bestTime = float('inf')
+    for _ in range(nRuns):
+        startTime = time.perf_counter()
+        nMatches = len(searchIndexPositions(index, searchText, workers=workers))
+        bestTime = min(bestTime, time.perf_counter() - startTime)
+    return bestTime, nMatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file_name', metavar='PROFILE', help='Python profiler pstats file')
+    parser.add_argument('search_text', metavar='SEARCH_TEXT', nargs='?', default='py',
+                        help='Text to search in the paths and function names (default: py)')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='Number of times the rows are repeated (default: 1)')
+    parser.add_argument('-t', '--max-threads', type=int, default=os.cpu_count() or 1,
+                        help='Maximum number of threads (default: the number of cores)')
+    args = parser.parse_args()
+
+    store = STORE_REGISTRY.acquire(args.file_name)
+    rows = store.rows * args.repeat
+    startTime = time.perf_counter()
+    index = SearchIndex(rows)
+    print("Indexed {} rows in {} chunks in {:.3f} s".format(
+        len(rows), index.nChunks, time.perf_counter() - startTime))
+
+    print("Python {}, GIL {}, {} cores".format(
+        sys.version.split()[0], "enabled" if isGilEnabled() else "disabled", os.cpu_count()))
+
+    print("{:>8s} {:>10s} {:>8s} {:>10s}".format("threads", "time (ms)", "speedup", "matches"))
+    workers = 1
+    singleTime = None
+    while workers <= args.max_threads:
+        duration, nMatches = searchTime(index, args.search_text.lower(), workers)
+        singleTime = singleTime or duration
+        print("{:8d} {:10.1f} {:8.2f} {:10d}".format(
+            workers, 1000 * duration, singleTime / duration, nMatches))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
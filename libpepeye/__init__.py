@@ -4,7 +4,17 @@
 # Define some function here that can be imported conveniently
 
 import logging
-from .mainwindow import browse
+
+from .api import Profile
+
+def browse(fileName = None, **kwargs):
+    """ Opens and executes a main window. See mainwindow.browse.
+
+        Qt is imported here, so that the rest of the package can be used without it.
+    """
+    from .mainwindow import browse as mainWindowBrowse
+    return mainWindowBrowse(fileName = fileName, **kwargs)
+
 
 def loggingBasicConfig(level = 'WARN'):
     """ Setup basic config logging. Useful for debugging to quickly setup a useful logger"""
@@ -0,0 +1,305 @@
+"""
+    Python API for the analysis of profiles in scripts and notebooks.
+
+    A Profile is a view on (a selection of) the rows of a StatsStore. It uses the same loader,
+    store registry, indexes and sort and filter functions as the main window, and doesn't
+    depend on Qt.
+
+    Example:
+
+        profile = Profile.load('my.prof')
+        for statRow in profile.filter('parser').top(10, 'time'):
+            print(statRow.functionName, statRow.time)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import itertools
+import logging
+import pstats
+
+from array import array
+
+from .query import (DIFF_SORT_KEYS, EDGE_FIELDS, ROW_FIELDS, TIE_BREAKER, diffRows,
+                    filterPositions, rankArray, sortKey, sortedPositions)
+from .statsstore import NUMERIC_ATTRIBUTES, STORE_REGISTRY, StatRow, StatsStore
+from .utils import check_class
+
+logger = logging.getLogger(__name__)
+
+
+# Statistics of a call from a caller to a callee.
+Edge = collections.namedtuple('Edge', EDGE_FIELDS)
+
+
+class Profile(object):
+    """ A selection of the rows of a profile, in a certain order.
+
+        The sort, filter and top methods return a new Profile that shares the store (and its
+        indexes) with this one. Only the row positions of the selection are stored per Profile.
+    """
+    def __init__(self, store, positions=None):
+        """ Constructor. Use Profile.load or Profile.fromStats to create a Profile.
+
+            :param store: the StatsStore with the rows.
+            :param positions: positions of the selected rows in the store, in the order of
+                this Profile. If None, all rows of the store are used (in the store's order).
+        """
+        check_class(store, StatsStore)
+        self.store = store
+        if positions is None:
+            positions = array('i', range(len(store)))
+        self._positions = positions
+        self._columns = {} # name -> array with the values of the selected rows
+        self._registered = False
+
+
+    @classmethod
+    def load(cls, fileName, lowMemory=False, compactTime=0.0, pathNormalizer=None):
+        """ Loads a pstats file. The data is shared with other Profiles of the same file.
+
+            Call close() when done to release the data.
+
+            :param lowMemory: if True, the callers are stored in compact arrays and the pstats
+                data is freed after loading (see StatsStore).
+            :param compactTime: if > 0, functions with a cumulative time less than this number
+                of seconds are collapsed into an "other" row per file (see compactStats).
+            :param pathNormalizer: if not None, a pathnormalizer.PathNormalizer that normalizes
+                the file paths. Functions of which the normalized keys are equal are merged.
+        """
+        profile = cls(STORE_REGISTRY.acquire(fileName, lowMemory=lowMemory,
+                                             compactTime=compactTime,
+                                             pathNormalizer=pathNormalizer))
+        profile._registered = True
+        return profile
+
+
+    @classmethod
+    def fromStats(cls, statsObject):
+        """ Creates a Profile from a pstats.Stats object (e.g. of a cProfile.Profile).
+        """
+        check_class(statsObject, pstats.Stats)
+        return cls(StatsStore(statsObject))
+
+
+    def close(self):
+        """ Releases the data if it was loaded with Profile.load.
+
+            Profiles that were derived from this one (e.g. by filter) must not be used anymore.
+        """
+        if self._registered:
+            STORE_REGISTRY.release(self.store)
+            self._registered = False
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+    def __repr__(self):
+        return "<{} {!r}: {} of {} rows>".format(type(self).__name__, self.store.fileName,
+                                                 len(self), len(self.store))
+
+
+    def __len__(self):
+        return len(self._positions)
+
+
+    def __iter__(self):
+        rows = self.store.rows
+        return (rows[pos] for pos in self._positions)
+
+
+    def __getitem__(self, idx):
+        """ Returns the StatRow at index idx of the selection.
+        """
+        return self.store.rows[self._positions[idx]]
+
+
+    @property
+    def rows(self):
+        """ List with the selected StatRows, in the order of this Profile.
+        """
+        return list(self)
+
+
+    @property
+    def positions(self):
+        """ Memoryview with the positions of the selected rows in the store.
+        """
+        return memoryview(self._positions)
+
+
+    @property
+    def columnNames(self):
+        """ The names of the numeric columns (see column).
+        """
+        return NUMERIC_ATTRIBUTES
+
+
+    def column(self, name):
+        """ Returns a read-only memoryview of doubles with the values of a numeric column for
+            the selected rows.
+
+            The memoryview can be converted to a NumPy array without copying the data, with
+            numpy.asarray(profile.column('cumTime')).
+
+            :param name: one of the columnNames, e.g. 'cumTime' or 'recursiveShare'.
+        """
+        values = self._columns.get(name)
+        if values is None:
+            storeValues = self.store.column(name)
+            if len(self._positions) == len(self.store) and self._isIdentity():
+                values = storeValues
+            else:
+                values = array('d', map(storeValues.__getitem__, self._positions))
+            self._columns[name] = values
+        return memoryview(values).toreadonly()
+
+
+    def _isIdentity(self):
+        """ Returns True if the positions are all rows of the store in the store's order.
+        """
+        return all(pos == idx for idx, pos in enumerate(self._positions))
+
+
+    def _derived(self, positions):
+        """ Returns a new Profile of the same store with other positions.
+        """
+        return Profile(self.store, positions=array('i', positions))
+
+
+    def sort(self, column='cumTime', descending=True):
+        """ Returns a new Profile with the rows sorted on a column.
+
+            :param column: a column name, see query.SORT_KEYS.
+        """
+        return self.top(len(self), column=column, descending=descending)
+
+
+    def top(self, n, column='cumTime', descending=True):
+        """ Returns a new Profile with the first n rows when sorted on a column.
+
+            The positions are sorted on the rank arrays of the store, like the main window does
+            (see query.sortedPositions). Rows with equal values are ordered by path, line number
+            and function name. Only the first n rows are sorted, which is faster than sort() for
+            small n.
+        """
+        sortKey(column) # Raises ValueError for unknown columns
+        store = self.store
+        positions = sortedPositions(list(self._positions), n,
+                                    [rankArray(store, column), rankArray(store, TIE_BREAKER)],
+                                    [descending, False])
+        return self._derived(positions[:n])
+
+
+    def filter(self, filterText):
+        """ Returns a new Profile with the rows that pass the filter text.
+
+            The syntax is the same as that of the filter in the main window: the words must occur
+            in the path or function name, and words such as 'total>=1' are conditions on a
+            column (see statsstore.parseFilterText).
+
+            The rows are searched in the store's SearchIndex, like the main window does (see
+            query.filterPositions). The order of this Profile is kept.
+        """
+        passed = filterPositions(self.store, filterText)
+        if passed is None:
+            return self._derived(self._positions)
+        if len(self._positions) == len(self.store) and self._isIdentity():
+            return self._derived(passed)
+        return self._derived(itertools.compress(
+            self._positions, map(set(passed).__contains__, self._positions)))
+
+
+    def find(self, function):
+        """ Returns the StatRow of a function.
+
+            :param function: a StatRow, a (file, line_nr, function) key or a function name.
+                Raises a KeyError if a name doesn't occur, or a ValueError if it's ambiguous.
+        """
+        if isinstance(function, StatRow):
+            return function
+        if isinstance(function, tuple):
+            statRow = self.store.findRow(function)
+            if statRow is None:
+                raise KeyError("Function not found: {!r}".format(function))
+            return statRow
+
+        matches = [statRow for statRow in self if statRow.functionName == function]
+        if not matches:
+            raise KeyError("Function not found: {!r}".format(function))
+        if len(matches) > 1:
+            raise ValueError("Function name {!r} is ambiguous, use a key: {}".format(
+                function, ", ".join(repr(statRow.key) for statRow in matches)))
+        return matches[0]
+
+
+    def callers(self, function):
+        """ Returns a list of (StatRow, Edge) tuples with the callers of a function, ordered by
+            the cumulative time of the calls.
+
+            :param function: see find.
+        """
+        pos = self.store.position(self.find(function).key)
+        return self._edgeList(self.store.callers(pos))
+
+
+    def callees(self, function):
+        """ Returns a list of (StatRow, Edge) tuples with the callees of a function, ordered by
+            the cumulative time of the calls.
+
+            :param function: see find.
+        """
+        pos = self.store.position(self.find(function).key)
+        return self._edgeList(self.store.callees(pos))
+
+
+    def _edgeList(self, posAndEdges):
+        rows = self.store.rows
+        result = [(rows[pos], Edge(*edge)) for pos, edge in posAndEdges]
+        result.sort(key=lambda rowAndEdge: rowAndEdge[1].cumTime, reverse=True)
+        return result
+
+
+    def diff(self, other, sort='deltaCumTime'):
+        """ Returns a list of query.RowDiffs with the differences from this (the base) profile
+            to the other profile. Largest (absolute) differences first.
+
+            Only the selected rows of both profiles are compared.
+
+            :param sort: one of 'deltaCumTime', 'deltaTime' or 'deltaNumCalls'.
+        """
+        check_class(other, Profile)
+        if sort not in DIFF_SORT_KEYS:
+            raise ValueError("Unknown sort {!r}. Must be one of: {}"
+                             .format(sort, ", ".join(DIFF_SORT_KEYS)))
+        result = diffRows(self, other)
+        result.sort(key=DIFF_SORT_KEYS[sort], reverse=True)
+        return result
+
+
+    def to_dataframe(self):
+        """ Returns the selected rows as a pandas DataFrame, indexed by position in the store.
+
+            Requires pandas, which is not a dependency of pepeye.
+        """
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError("Profile.to_dataframe requires pandas (pip install pandas)")
+
+        data = collections.OrderedDict()
+        for field in ROW_FIELDS:
+            if field in NUMERIC_ATTRIBUTES:
+                data[field] = self.column(field).tolist()
+            else:
+                data[field] = [getattr(statRow, field) for statRow in self]
+        return pandas.DataFrame(data, index=pandas.Index(self._positions.tolist(),
+                                                         name='position'))
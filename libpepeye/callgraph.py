@@ -0,0 +1,281 @@
+"""
+    Call graph functionality.
+
+    Prunes the caller graph of a StatsStore to the functions and calls that take at least a
+    fraction of the total time, lays out the remaining subgraph in layers and writes it in the
+    DOT (Graphviz) or SVG format. Doesn't depend on Qt, the CallGraphPane renders the same layout.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import bisect
+import collections
+import logging
+import operator
+
+from array import array
+from xml.sax.saxutils import escape as xmlEscape
+
+from .timing import TIMING
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_THRESHOLD = 0.01 # functions and calls below this fraction of the total time are pruned
+MAX_NODES = 200          # bounds the layout time and keeps huge graphs readable
+
+# Layout dimensions in pixels
+NODE_WIDTH = 200
+NODE_HEIGHT = 48
+H_SPACING = 24
+V_SPACING = 64
+MARGIN = 16
+
+MAX_LABEL_LENGTH = 30
+
+
+class CallGraph(object):
+    """ Caller graph of a store, indexed so that it can be pruned with any threshold.
+
+        The nodes are ordered by cumulative time and the edges by the time of the call. The
+        edge key is the minimum of its own time and that of both of its functions, so that the
+        nodes and edges that survive a threshold are a prefix of these orders. Pruning therefore
+        takes only a binary search plus one pass over the surviving edges, and changing the
+        threshold doesn't require visiting the complete graph again.
+    """
+    def __init__(self, store):
+        """ Constructor. Indexes the caller edges of the store in one pass.
+        """
+        self.store = store
+        rows = store.rows
+        self.totalTime = store.totalTime
+
+        with TIMING.span('indexCallGraph'):
+            cumTimes = array('d', (statRow.cumTime for statRow in rows))
+            nodeOrder = sorted(range(len(rows)), key=cumTimes.__getitem__, reverse=True)
+            self._nodeOrder = array('i', nodeOrder)
+            self._nodeKeys = array('d', (-cumTimes[pos] for pos in nodeOrder)) # ascending
+
+            edges = [(min(edge[3], cumTimes[callerPos], cumTimes[calleePos]),
+                      callerPos, calleePos, edge)
+                     for callerPos, calleePos, edge in store.iterEdges()
+                     if callerPos != calleePos]
+            edges.sort(key=operator.itemgetter(0), reverse=True)
+            self._edgeKeys = array('d', (-edgeKey for edgeKey, _, _, _ in edges)) # ascending
+            self._edges = [(callerPos, calleePos, edge) for _, callerPos, calleePos, edge in edges]
+
+
+    def minTime(self, threshold):
+        """ Returns the time that corresponds with a threshold fraction of the total time.
+        """
+        return threshold * self.totalTime
+
+
+    def prune(self, threshold=DEFAULT_THRESHOLD, maxNodes=MAX_NODES):
+        """ Returns the nodes and edges that take at least a fraction of the total time.
+
+            :param threshold: fraction of the total time.
+            :param maxNodes: at most this many nodes (with the highest cumulative time) are
+                returned.
+            :returns: (nodes, edges) tuple. Nodes is a list of row positions ordered by
+                cumulative time, edges a list of (caller position, callee position, edge) tuples.
+        """
+        negMinTime = -self.minTime(threshold)
+        nNodes = min(bisect.bisect_right(self._nodeKeys, negMinTime), maxNodes)
+        nodes = self._nodeOrder[:nNodes].tolist()
+        nodeSet = set(nodes)
+
+        nEdges = bisect.bisect_right(self._edgeKeys, negMinTime)
+        edges = [(callerPos, calleePos, edge)
+                 for callerPos, calleePos, edge in self._edges[:nEdges]
+                 if callerPos in nodeSet and calleePos in nodeSet]
+        return nodes, edges
+
+
+
+def layoutGraph(nodes, edges):
+    """ Lays out the graph in layers from the top (callers) to the bottom (callees).
+
+        Functions without (surviving) callers are put in the first layer, the others one layer
+        below the first caller that reaches them. Within a layer the functions are ordered by
+        the mean position of their callers in the layers above, to reduce edge crossings.
+        The time is linear in the size of the graph apart from sorting the layers.
+
+        :param nodes: list of row positions, ordered by cumulative time.
+        :param edges: list of (caller position, callee position, edge) tuples.
+        :returns: (coordinates, width, height) tuple. Coordinates is a dictionary that maps
+            the nodes to the (x, y) position of their top left corner.
+    """
+    callees = collections.defaultdict(list)
+    callers = collections.defaultdict(list)
+    for callerPos, calleePos, _edge in edges:
+        callees[callerPos].append(calleePos)
+        callers[calleePos].append(callerPos)
+
+    # Breadth first from the roots. Cycles that are not reachable from a root start at the top.
+    layerOf = {}
+    starts = [pos for pos in nodes if pos not in callers] + list(nodes)
+    for start in starts:
+        if start in layerOf:
+            continue
+        layerOf[start] = 0
+        queue = collections.deque([start])
+        while queue:
+            pos = queue.popleft()
+            for calleePos in callees[pos]:
+                if calleePos not in layerOf:
+                    layerOf[calleePos] = layerOf[pos] + 1
+                    queue.append(calleePos)
+
+    nLayers = max(layerOf.values()) + 1 if layerOf else 0
+    layers = [[] for _ in range(nLayers)]
+    for pos in nodes:
+        layers[layerOf[pos]].append(pos)
+
+    indexInLayer = {}
+    for layer in layers:
+        def barycenter(pos):
+            upper = [indexInLayer[callerPos] for callerPos in callers[pos]
+                     if callerPos in indexInLayer and layerOf[callerPos] < layerOf[pos]]
+            return sum(upper) / len(upper) if upper else 0.0
+
+        layer.sort(key=barycenter) # Stable, so ties stay ordered by cumulative time.
+        for idx, pos in enumerate(layer):
+            indexInLayer[pos] = idx
+
+    width = max([len(layer) for layer in layers] or [0]) * (NODE_WIDTH + H_SPACING) - H_SPACING
+    width = max(0, width) + 2 * MARGIN
+    height = max(0, nLayers * (NODE_HEIGHT + V_SPACING) - V_SPACING) + 2 * MARGIN
+
+    coordinates = {}
+    for layerNr, layer in enumerate(layers):
+        layerWidth = len(layer) * (NODE_WIDTH + H_SPACING) - H_SPACING
+        xOffset = (width - layerWidth) / 2
+        for idx, pos in enumerate(layer):
+            coordinates[pos] = (xOffset + idx * (NODE_WIDTH + H_SPACING),
+                                MARGIN + layerNr * (NODE_HEIGHT + V_SPACING))
+
+    return coordinates, width, height
+
+
+def edgeLine(coordinates, callerPos, calleePos):
+    """ Returns the (x1, y1, x2, y2) line of an edge between two laid out nodes.
+
+        The line goes from the bottom of the caller to the top of the callee, or the other way
+        around for calls to a function in a higher layer.
+    """
+    callerX, callerY = coordinates[callerPos]
+    calleeX, calleeY = coordinates[calleePos]
+    x1 = callerX + NODE_WIDTH / 2
+    x2 = calleeX + NODE_WIDTH / 2
+    if calleeY > callerY:
+        return x1, callerY + NODE_HEIGHT, x2, calleeY
+    else:
+        return x1, callerY, x2, calleeY + NODE_HEIGHT
+
+
+def heatColor(fraction):
+    """ Returns a color from white (0.0) to red (1.0) in the #rrggbb format.
+    """
+    fraction = max(0.0, min(1.0, fraction))
+    return '#{:02x}{:02x}{:02x}'.format(
+        255, int(round(255 - 155 * fraction)), int(round(255 - 215 * fraction)))
+
+
+def _elide(text, maxLength=MAX_LABEL_LENGTH):
+    """ Shortens the text to maxLength characters.
+    """
+    return text if len(text) <= maxLength else text[:maxLength - 1] + '\u2026'
+
+
+def nodeLabelLines(statRow, totalTime):
+    """ Returns the lines of the label of a function: name, location and cumulative time
+        with the self time between brackets, both as percentage of the total time.
+    """
+    totalTime = totalTime or 1.0
+    return [_elide(statRow.functionName),
+            _elide("{}:{}".format(statRow.fileName, statRow.lineNr)),
+            "{:.1f}% ({:.1f}%)".format(100 * statRow.cumTime / totalTime,
+                                       100 * statRow.time / totalTime)]
+
+
+def edgeLabel(edge, totalTime):
+    """ Returns the label of a call edge: time as percentage of the total time and
+        number of calls.
+    """
+    return "{:.1f}%  {}\u00d7".format(100 * edge[3] / (totalTime or 1.0), edge[0])
+
+
+def _dotString(text):
+    """ Returns the text as a quoted DOT string.
+    """
+    return '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+
+@TIMING.timed('writeDot')
+def writeDot(graph, fileObj, threshold=DEFAULT_THRESHOLD, maxNodes=MAX_NODES):
+    """ Writes the pruned call graph in the DOT format of Graphviz.
+    """
+    rows = graph.store.rows
+    totalTime = graph.totalTime or 1.0
+    nodes, edges = graph.prune(threshold, maxNodes)
+
+    fileObj.write("digraph pepeye {\n")
+    fileObj.write('  node [shape=box, style="filled,rounded", fontname=Arial, fontsize=10];\n')
+    fileObj.write("  edge [fontname=Arial, fontsize=9];\n")
+    for pos in nodes:
+        statRow = rows[pos]
+        fileObj.write("  {} [label={}, fillcolor={}, tooltip={}];\n".format(
+            pos, _dotString("\n".join(nodeLabelLines(statRow, totalTime))),
+            _dotString(heatColor(statRow.cumTime / totalTime)),
+            _dotString(statRow.filePath)))
+    for callerPos, calleePos, edge in edges:
+        fraction = edge[3] / totalTime
+        fileObj.write("  {} -> {} [label={}, color={}, penwidth={:.2f}];\n".format(
+            callerPos, calleePos, _dotString(edgeLabel(edge, totalTime)),
+            _dotString(heatColor(0.25 + 0.75 * fraction)), 1.0 + 4.0 * fraction))
+    fileObj.write("}\n")
+
+
+@TIMING.timed('writeSvg')
+def writeSvg(graph, fileObj, threshold=DEFAULT_THRESHOLD, maxNodes=MAX_NODES):
+    """ Writes the pruned call graph as an SVG image, laid out with layoutGraph.
+    """
+    rows = graph.store.rows
+    totalTime = graph.totalTime or 1.0
+    nodes, edges = graph.prune(threshold, maxNodes)
+    coordinates, width, height = layoutGraph(nodes, edges)
+
+    fileObj.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fileObj.write('<svg xmlns="http://www.w3.org/2000/svg" width="{0:.0f}" height="{1:.0f}" '
+                  'viewBox="0 0 {0:.0f} {1:.0f}" font-family="Arial" font-size="10">\n'
+                  .format(width, height))
+    fileObj.write('<defs><marker id="arrow" viewBox="0 0 10 10" refX="10" refY="5" '
+                  'markerWidth="6" markerHeight="6" orient="auto">'
+                  '<path d="M 0 0 L 10 5 L 0 10 z" fill="#808080"/></marker></defs>\n')
+
+    for callerPos, calleePos, edge in edges:
+        x1, y1, x2, y2 = edgeLine(coordinates, callerPos, calleePos)
+        fraction = edge[3] / totalTime
+        fileObj.write('<g><title>{}</title><line x1="{:.1f}" y1="{:.1f}" x2="{:.1f}" '
+                      'y2="{:.1f}" stroke="#808080" stroke-width="{:.2f}" '
+                      'marker-end="url(#arrow)"/><text x="{:.1f}" y="{:.1f}" '
+                      'fill="#606060">{}</text></g>\n'.format(
+                          xmlEscape(edgeLabel(edge, totalTime)), x1, y1, x2, y2,
+                          1.0 + 4.0 * fraction, (x1 + x2) / 2 + 4, (y1 + y2) / 2,
+                          xmlEscape(edgeLabel(edge, totalTime))))
+
+    for pos in nodes:
+        statRow = rows[pos]
+        x, y = coordinates[pos]
+        fileObj.write('<g><title>{}</title><rect x="{:.1f}" y="{:.1f}" width="{}" height="{}" '
+                      'rx="6" fill="{}" stroke="#404040"/>'.format(
+                          xmlEscape(statRow.filePath), x, y, NODE_WIDTH, NODE_HEIGHT,
+                          heatColor(statRow.cumTime / totalTime)))
+        for lineNr, line in enumerate(nodeLabelLines(statRow, totalTime)):
+            fileObj.write('<text x="{:.1f}" y="{:.1f}" text-anchor="middle">{}</text>'.format(
+                x + NODE_WIDTH / 2, y + 14 + 13 * lineNr, xmlEscape(line)))
+        fileObj.write('</g>\n')
+
+    fileObj.write('</svg>\n')
@@ -0,0 +1,313 @@
+"""
+    Call graph pane.
+
+    Renders the pruned and laid out call graph of callgraph.py in a QGraphicsView.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import math
+
+from .callgraph import (CallGraph, DEFAULT_THRESHOLD, MAX_NODES, NODE_WIDTH, NODE_HEIGHT,
+                        edgeLabel, edgeLine, heatColor, layoutGraph, nodeLabelLines,
+                        writeDot, writeSvg)
+from .qt import Qt, QtCore, QtGui, QtWidgets, QtSignal
+from .timing import TIMING
+from .version import DEBUGGING
+
+logger = logging.getLogger(__name__)
+
+
+ARROW_SIZE = 8
+LABEL_POINT_SIZE = 8
+
+
+def labelFont():
+    """ Returns the font of the node and edge labels.
+    """
+    font = QtGui.QFont()
+    font.setPointSizeF(LABEL_POINT_SIZE)
+    return font
+
+
+class _NodeItem(QtWidgets.QGraphicsRectItem):
+    """ Box with the label of a function. Keeps the row position of the function.
+    """
+    def __init__(self, pos, statRow, totalTime):
+        """ Constructor
+        """
+        super(_NodeItem, self).__init__(0, 0, NODE_WIDTH, NODE_HEIGHT)
+        self.rowPos = pos
+        self.setBrush(QtGui.QColor(heatColor(statRow.cumTime / (totalTime or 1.0))))
+        self.setPen(QtGui.QPen(QtGui.QColor('#404040')))
+        self.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable, True)
+        self.setToolTip(statRow.filePath)
+
+        font = labelFont()
+        fontMetrics = QtGui.QFontMetricsF(font)
+        lines = nodeLabelLines(statRow, totalTime)
+        lineHeight = fontMetrics.height()
+        top = (NODE_HEIGHT - len(lines) * lineHeight) / 2
+        for lineNr, line in enumerate(lines):
+            line = fontMetrics.elidedText(line, Qt.ElideRight, NODE_WIDTH - 8)
+            textItem = QtWidgets.QGraphicsSimpleTextItem(line, self)
+            textItem.setFont(font)
+            textItem.setPos((NODE_WIDTH - fontMetrics.width(line)) / 2, top + lineNr * lineHeight)
+
+
+    def paint(self, painter, option, widget=None):
+        """ Draws a thick border instead of the dashed selection rectangle.
+        """
+        option.state &= ~QtWidgets.QStyle.State_Selected
+        pen = QtGui.QPen(self.pen())
+        pen.setWidthF(3.0 if self.isSelected() else 1.0)
+        painter.setPen(pen)
+        painter.setBrush(self.brush())
+        painter.drawRoundedRect(self.rect(), 6, 6)
+
+
+
+class CallGraphPane(QtWidgets.QWidget):
+    """ Shows the call graph of a store, pruned with a threshold that the user can change.
+
+        The graph is indexed when it's first shown. Changing the threshold only prunes and
+        lays out the graph again; the boxes of functions that remain visible are reused.
+    """
+    sigFunctionActivated = QtSignal(int) # Emitted with the row position of a selected node
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(CallGraphPane, self).__init__(parent)
+        self._store = None
+        self._graph = None     # CallGraph, created when the pane is first shown.
+        self._nodeItems = {}   # row position -> _NodeItem
+        self._edgeItems = []
+        self._currentPos = None
+
+        self.thresholdSpinBox = QtWidgets.QDoubleSpinBox()
+        self.thresholdSpinBox.setRange(0.0, 100.0)
+        self.thresholdSpinBox.setDecimals(2)
+        self.thresholdSpinBox.setSingleStep(0.5)
+        self.thresholdSpinBox.setSuffix(" %")
+        self.thresholdSpinBox.setValue(100 * DEFAULT_THRESHOLD)
+        self.thresholdSpinBox.setToolTip(
+            "Functions and calls that take less than this percentage of the total time "
+            "are not shown")
+        self.thresholdSpinBox.valueChanged.connect(self._onThresholdChanged)
+
+        self.infoLabel = QtWidgets.QLabel("")
+
+        self.exportButton = QtWidgets.QToolButton()
+        self.exportButton.setText("Export")
+        self.exportButton.setPopupMode(QtWidgets.QToolButton.InstantPopup)
+        exportMenu = QtWidgets.QMenu(self.exportButton)
+        exportMenu.addAction("DOT (Graphviz)...", lambda: self.exportGraph('dot'))
+        exportMenu.addAction("SVG...", lambda: self.exportGraph('svg'))
+        self.exportButton.setMenu(exportMenu)
+
+        toolLayout = QtWidgets.QHBoxLayout()
+        toolLayout.addWidget(QtWidgets.QLabel("Threshold:"))
+        toolLayout.addWidget(self.thresholdSpinBox)
+        toolLayout.addWidget(self.infoLabel)
+        toolLayout.addStretch()
+        toolLayout.addWidget(self.exportButton)
+
+        self.scene = QtWidgets.QGraphicsScene(self)
+        self.scene.selectionChanged.connect(self._onSelectionChanged)
+        self.graphicsView = QtWidgets.QGraphicsView(self.scene)
+        self.graphicsView.setRenderHint(QtGui.QPainter.Antialiasing)
+        self.graphicsView.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(toolLayout)
+        layout.addWidget(self.graphicsView)
+        self.setLayout(layout)
+
+
+    @property
+    def threshold(self):
+        """ The pruning threshold as fraction of the total time.
+        """
+        return self.thresholdSpinBox.value() / 100
+
+
+    def setStore(self, store):
+        """ Sets the store of which the call graph is shown. Use None to clear the pane.
+
+            The graph is only indexed and drawn when the pane is visible.
+        """
+        self._store = store
+        self._graph = None
+        self._clearItems()
+        self.infoLabel.setText("")
+        if store is not None and self.isVisible():
+            self.updateGraph()
+
+
+    def showEvent(self, event):
+        """ Draws the graph when the pane is shown for the first time after setStore.
+        """
+        super(CallGraphPane, self).showEvent(event)
+        if self._store is not None and self._graph is None:
+            self.updateGraph()
+
+
+    def _clearItems(self):
+        """ Removes all items from the scene.
+        """
+        self.scene.blockSignals(True)
+        try:
+            self.scene.clear()
+        finally:
+            self.scene.blockSignals(False)
+        self._nodeItems = {}
+        self._edgeItems = []
+
+
+    def _callGraph(self):
+        """ Returns the CallGraph of the store. Indexes it when first needed.
+        """
+        if self._graph is None:
+            self._graph = CallGraph(self._store)
+        return self._graph
+
+
+    def _onThresholdChanged(self, _value):
+        """ Prunes the graph again with the new threshold.
+        """
+        self.updateGraph()
+
+
+    @TIMING.timed('updateCallGraph')
+    def updateGraph(self):
+        """ Prunes the graph with the current threshold, lays it out and updates the scene.
+        """
+        if self._store is None:
+            return
+
+        graph = self._callGraph()
+        nodes, edges = graph.prune(self.threshold)
+        with TIMING.span('layoutCallGraph', nNodes=len(nodes), nEdges=len(edges)):
+            coordinates, width, height = layoutGraph(nodes, edges)
+
+        self.scene.blockSignals(True)
+        try:
+            for item in self._edgeItems:
+                self.scene.removeItem(item)
+            self._edgeItems = []
+
+            for pos in list(self._nodeItems):
+                if pos not in coordinates:
+                    self.scene.removeItem(self._nodeItems.pop(pos))
+
+            rows = self._store.rows
+            for pos in nodes:
+                item = self._nodeItems.get(pos)
+                if item is None:
+                    item = _NodeItem(pos, rows[pos], graph.totalTime)
+                    self._nodeItems[pos] = item
+                    self.scene.addItem(item)
+                item.setPos(*coordinates[pos])
+                item.setSelected(pos == self._currentPos)
+
+            for callerPos, calleePos, edge in edges:
+                item = self._createEdgeItem(edgeLine(coordinates, callerPos, calleePos),
+                                            edge, graph.totalTime)
+                self.scene.addItem(item)
+                self._edgeItems.append(item)
+        finally:
+            self.scene.blockSignals(False)
+
+        self.scene.setSceneRect(0, 0, width, height)
+        nPruned = max(0, len(rows) - len(nodes))
+        self.infoLabel.setText("{} functions and {} calls shown, {} functions pruned{}".format(
+            len(nodes), len(edges), nPruned,
+            " (at most {} are shown)".format(MAX_NODES) if len(nodes) == MAX_NODES else ""))
+
+
+    @staticmethod
+    def _createEdgeItem(line, edge, totalTime):
+        """ Creates a path item with an arrow from the caller to the callee.
+        """
+        x1, y1, x2, y2 = line
+        angle = math.atan2(y2 - y1, x2 - x1)
+        path = QtGui.QPainterPath(QtCore.QPointF(x1, y1))
+        path.lineTo(x2, y2)
+        for side in (-1, 1):
+            path.moveTo(x2, y2)
+            path.lineTo(x2 - ARROW_SIZE * math.cos(angle + side * math.pi / 6),
+                        y2 - ARROW_SIZE * math.sin(angle + side * math.pi / 6))
+
+        fraction = edge[3] / (totalTime or 1.0)
+        pen = QtGui.QPen(QtGui.QColor('#808080'))
+        pen.setWidthF(1.0 + 4.0 * fraction)
+        item = QtWidgets.QGraphicsPathItem(path)
+        item.setPen(pen)
+        item.setZValue(-1) # Below the nodes
+
+        label = edgeLabel(edge, totalTime)
+        item.setToolTip(label)
+        textItem = QtWidgets.QGraphicsSimpleTextItem(label, item)
+        textItem.setFont(labelFont())
+        textItem.setBrush(QtGui.QColor('#606060'))
+        textItem.setPos((x1 + x2) / 2 + 4, (y1 + y2) / 2 - 6)
+        return item
+
+
+    def setCurrentStatRow(self, statRow):
+        """ Selects the node of the function (if it's shown) and makes it visible.
+        """
+        if self._store is None or statRow is None:
+            self._currentPos = None
+        else:
+            self._currentPos = self._store.position(statRow.key)
+
+        self.scene.blockSignals(True) # Prevents emitting sigFunctionActivated
+        try:
+            self.scene.clearSelection()
+            item = self._nodeItems.get(self._currentPos)
+            if item is not None:
+                item.setSelected(True)
+                self.graphicsView.ensureVisible(item)
+        finally:
+            self.scene.blockSignals(False)
+
+
+    def _onSelectionChanged(self):
+        """ Emits sigFunctionActivated when the user selects a node.
+        """
+        items = self.scene.selectedItems()
+        if items:
+            self._currentPos = items[0].rowPos
+            self.sigFunctionActivated.emit(items[0].rowPos)
+
+
+    def exportGraph(self, formatName):
+        """ Lets the user select a file and writes the graph, as currently pruned, to it.
+
+            :param formatName: 'dot' or 'svg'
+        """
+        if self._store is None:
+            logger.warning("No call graph to export.")
+            return
+
+        writer, description = {'dot': (writeDot, "DOT files (*.dot)"),
+                               'svg': (writeSvg, "SVG files (*.svg)")}[formatName]
+        fileName = QtWidgets.QFileDialog.getSaveFileName(self,
+            caption = "Export call graph", directory = 'callgraph.{}'.format(formatName),
+            filter='{};;All files (*)'.format(description))[0]
+
+        if fileName:
+            try:
+                with open(fileName, 'w', encoding='utf-8') as fileObj:
+                    writer(self._callGraph(), fileObj, threshold=self.threshold)
+            except Exception as ex:
+                if DEBUGGING:
+                    raise
+                else:
+                    logger.error("Error exporting call graph: %s", ex)
+                    QtWidgets.QMessageBox.warning(self, "Error exporting call graph", str(ex))
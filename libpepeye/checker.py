@@ -0,0 +1,411 @@
+"""
+    Performance budget rules that are checked against a profile, e.g. in continuous integration.
+
+    A rules file has one rule per line. Empty lines and text after a '#' are ignored. The rules
+    are of the form:
+
+        cumTime of pkg.module:func <= 0.5s      # a metric of a function is within a limit
+        ncalls of pkg.module:func grew <= 10%   # growth relative to the baseline profile
+        no new function above 2% of total       # functions that are not in the baseline
+
+    The metrics are the numeric StatRow attributes (e.g. numCalls, time, cumTime, totalPercent),
+    the names of the filter conditions (e.g. calls, cumtime, total) or the pstats column names
+    (ncalls, tottime, cumtime). Time limits are in seconds, unless a unit (s, ms, us or µs) is
+    given. The operators are <, <=, > and >= (or ≤ and ≥).
+
+    A function is given as [LOCATION:]NAME, where LOCATION is a dotted module name (pkg.module)
+    or the end of a file path (pkg/module.py). If it's omitted the function can be in any file.
+    The NAME can be put between double quotes, which is needed if it contains a colon or looks
+    like the end of the rule, e.g.: cumTime of "<built-in method builtins.sorted>" <= 0.1s
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import itertools
+import logging
+import operator
+import re
+import time
+import xml.etree.ElementTree as ET
+
+from .statsstore import FILTER_ATTRIBUTES, NUMERIC_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+
+# Statuses of a CheckResult
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+
+# Lower case metric name -> StatRow attribute
+METRICS = collections.OrderedDict(
+    [(attr.lower(), attr) for attr in NUMERIC_ATTRIBUTES if attr != 'lineNr'] +
+    list(FILTER_ATTRIBUTES.items()) +
+    [('ncalls', 'numCalls'), ('tottime', 'time')])
+
+TIME_METRICS = ('time', 'timePerCall', 'cumTime', 'cumTimePerCall')
+PERCENT_METRICS = ('recursiveShare', 'parentShare', 'totalPercent')
+
+# Metrics of which the values of several functions can be added.
+ADDITIVE_METRICS = ('numCalls', 'numPrimCalls', 'time', 'cumTime', 'totalPercent')
+
+TIME_UNITS = {'s': 1.0, 'ms': 1e-3, 'us': 1e-6, 'µs': 1e-6}
+
+OPERATORS = {'<': operator.lt, '<=': operator.le, '≤': operator.le,
+             '>': operator.gt, '>=': operator.ge, '≥': operator.ge}
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_OPERATOR = r'<=|>=|<|>|≤|≥'
+
+# A function with a quoted name, or anything up to the operator (so names can have spaces).
+_FUNCTION = r'[^\s"]*"[^"]+"|\S.*?'
+
+_THRESHOLD_REGEXP = re.compile(
+    r'^(?P<metric>\w+)\s+of\s+(?P<function>{})\s*(?P<op>{})\s*(?P<value>{})\s*'
+    r'(?P<unit>s|ms|us|µs|%)?$'.format(_FUNCTION, _OPERATOR, _NUMBER))
+
+_GROWTH_REGEXP = re.compile(
+    r'^(?P<metric>\w+)\s+of\s+(?P<function>{})\s+grew\s*(?P<op>{})\s*(?P<value>{})\s*%$'
+    .format(_FUNCTION, _OPERATOR, _NUMBER))
+
+_QUOTED_FUNCTION_REGEXP = re.compile(r'^(?:(?P<location>[^"]*):)?"(?P<name>[^"]+)"$')
+
+_NEW_FUNCTION_REGEXP = re.compile(
+    r'^no\s+new\s+functions?\s+above\s+(?P<value>{})\s*%\s+of\s+total$'.format(_NUMBER),
+    re.IGNORECASE)
+
+
+
+class RuleError(ValueError):
+    """ Raised when a rule can't be parsed or evaluated.
+    """
+    pass
+
+
+
+class FunctionSpec(object):
+    """ Identifies functions by name and, optionally, by module or file path.
+    """
+    def __init__(self, text):
+        """ Constructor
+
+            :param text: [LOCATION:]NAME, see the module docstring.
+        """
+        self.text = text
+        match = _QUOTED_FUNCTION_REGEXP.match(text)
+        if match:
+            location, self.functionName = match.group('location') or '', match.group('name')
+        else:
+            location, _sep, self.functionName = text.rpartition(':')
+        if not self.functionName:
+            raise RuleError("No function name in {!r}".format(text))
+
+        if not location:
+            self.pathSuffixes = ()
+        elif '/' in location or '\\' in location or location.endswith('.py'):
+            self.pathSuffixes = (location.replace('\\', '/'), )
+        else:
+            modulePath = location.replace('.', '/')
+            self.pathSuffixes = (modulePath + '.py', modulePath + '/__init__.py')
+
+
+    def matches(self, statRow):
+        """ Returns True if the StatRow is one of the functions.
+        """
+        if statRow.functionName != self.functionName:
+            return False
+        if not self.pathSuffixes:
+            return True
+        filePath = statRow.filePath.replace('\\', '/')
+        return any(filePath == suffix or filePath.endswith('/' + suffix)
+                   for suffix in self.pathSuffixes)
+
+
+    def findRows(self, store):
+        """ Returns a list with the StatRows of the store that are one of the functions.
+        """
+        return [statRow for statRow in store.rowsForFunction(self.functionName)
+                if self.matches(statRow)]
+
+
+
+class Rule(object):
+    """ Abstract base class of the rules.
+    """
+    requiresBaseline = False
+
+    def __init__(self, text, lineNr=None):
+        """ Constructor
+
+            :param text: the text of the rule in the rules file.
+            :param lineNr: the line number in the rules file (if any).
+        """
+        self.text = text
+        self.lineNr = lineNr
+
+    def __repr__(self):
+        return "<{} {!r}>".format(type(self).__name__, self.text)
+
+    def evaluate(self, store, baselineStore=None):
+        """ Evaluates the rule. Returns a (passed, message) tuple.
+
+            Raises a RuleError if the rule can't be evaluated, e.g. if the function doesn't
+            occur in the profile.
+        """
+        raise NotImplementedError()
+
+
+
+class MetricRule(Rule):
+    """ Base class of the rules that compare a metric of a function with a limit.
+    """
+    def __init__(self, text, metric, function, op, value, lineNr=None):
+        """ Constructor
+
+            :param metric: metric name, see METRICS.
+            :param function: function specification, see FunctionSpec.
+            :param op: comparison operator, see OPERATORS.
+            :param value: the limit.
+        """
+        super(MetricRule, self).__init__(text, lineNr=lineNr)
+        try:
+            self.attr = METRICS[metric.lower()]
+        except KeyError:
+            raise RuleError("Unknown metric {!r}. Must be one of: {}"
+                            .format(metric, ", ".join(METRICS)))
+        self.functionSpec = FunctionSpec(function)
+        self.opText = op
+        self.op = OPERATORS[op]
+        self.value = value
+
+
+    def _findRows(self, store, profileName):
+        statRows = self.functionSpec.findRows(store)
+        if not statRows:
+            raise RuleError("Function {!r} not found in the {} profile"
+                            .format(self.functionSpec.text, profileName))
+        return statRows
+
+
+    def _formatValue(self, value):
+        if self.attr in TIME_METRICS:
+            return "{:.6g} s".format(value)
+        elif self.attr in PERCENT_METRICS:
+            return "{:.4g}%".format(value)
+        else:
+            return "{:.6g}".format(value)
+
+
+
+class ThresholdRule(MetricRule):
+    """ The metric of the function must be within a limit, e.g.: cumTime of pkg.mod:func <= 2ms
+
+        If there are several functions with the name, each of them must be within the limit.
+    """
+    def evaluate(self, store, baselineStore=None):
+        """ Evaluates the rule. Returns a (passed, message) tuple.
+        """
+        statRows = self._findRows(store, 'candidate')
+        failures = [statRow for statRow in statRows
+                    if not self.op(getattr(statRow, self.attr), self.value)]
+        reportedRows = failures or statRows
+        message = "; ".join(
+            "{} of {}:{} {} is {}".format(self.attr, statRow.filePath, statRow.lineNr,
+                                          statRow.functionName,
+                                          self._formatValue(getattr(statRow, self.attr)))
+            for statRow in reportedRows)
+        message += " (limit {} {})".format(self.opText, self._formatValue(self.value))
+        return not failures, message
+
+
+
+class GrowthRule(MetricRule):
+    """ The growth of the metric of a function, as a percentage of its value in the baseline
+        profile, must be within a limit, e.g.: ncalls of pkg.mod:func grew <= 10%
+
+        If there are several functions with the name, the values of additive metrics (e.g.
+        numCalls or cumTime) are summed. For other metrics the function must be unique.
+    """
+    requiresBaseline = True
+
+    def _total(self, store, profileName):
+        statRows = self._findRows(store, profileName)
+        if len(statRows) > 1 and self.attr not in ADDITIVE_METRICS:
+            raise RuleError("Function {!r} is ambiguous in the {} profile, use a module or path"
+                            .format(self.functionSpec.text, profileName))
+        return sum(getattr(statRow, self.attr) for statRow in statRows)
+
+
+    def evaluate(self, store, baselineStore=None):
+        """ Evaluates the rule. Returns a (passed, message) tuple.
+        """
+        baselineValue = self._total(baselineStore, 'baseline')
+        value = self._total(store, 'candidate')
+        if baselineValue:
+            growth = 100.0 * (value - baselineValue) / baselineValue
+        else:
+            growth = 0.0 if value == baselineValue else float('inf')
+
+        message = "{} of {} grew {:+.2f}% from {} to {} (limit {} {:g}%)".format(
+            self.attr, self.functionSpec.text, growth, self._formatValue(baselineValue),
+            self._formatValue(value), self.opText, self.value)
+        return self.op(growth, self.value), message
+
+
+
+class NewFunctionRule(Rule):
+    """ Functions that are not in the baseline profile must not take more than a percentage of
+        the total time, e.g.: no new function above 2% of total
+
+        Functions are matched by path and name, so that functions that only moved to another
+        line are not new.
+    """
+    requiresBaseline = True
+
+    def __init__(self, text, percentage, lineNr=None):
+        """ Constructor
+
+            :param percentage: the maximum totalPercent of a new function.
+        """
+        super(NewFunctionRule, self).__init__(text, lineNr=lineNr)
+        self.percentage = percentage
+
+
+    def evaluate(self, store, baselineStore=None):
+        """ Evaluates the rule. Returns a (passed, message) tuple.
+        """
+        candidates = itertools.compress(
+            store.rows, map(self.percentage.__lt__, store.column('totalPercent')))
+        newRows = [statRow for statRow in candidates
+                   if not any(baselineRow.filePath == statRow.filePath for baselineRow
+                              in baselineStore.rowsForFunction(statRow.functionName))]
+        newRows.sort(key=operator.attrgetter('totalPercent'), reverse=True)
+
+        if not newRows:
+            return True, "No new functions above {:g}% of the total time".format(self.percentage)
+        return False, "{} new function(s) above {:g}% of the total time: {}".format(
+            len(newRows), self.percentage, "; ".join(
+                "{}:{} {} ({:.2f}%)".format(statRow.filePath, statRow.lineNr,
+                                            statRow.functionName, statRow.totalPercent)
+                for statRow in newRows))
+
+
+
+def parseRule(text, lineNr=None):
+    """ Parses the text of a rule. Returns a Rule. Raises a RuleError if the text is invalid.
+    """
+    match = _NEW_FUNCTION_REGEXP.match(text)
+    if match:
+        return NewFunctionRule(text, float(match.group('value')), lineNr=lineNr)
+
+    match = _GROWTH_REGEXP.match(text)
+    if match:
+        return GrowthRule(text, match.group('metric'), match.group('function'),
+                          match.group('op'), float(match.group('value')), lineNr=lineNr)
+
+    match = _THRESHOLD_REGEXP.match(text)
+    if match:
+        rule = ThresholdRule(text, match.group('metric'), match.group('function'),
+                             match.group('op'), float(match.group('value')), lineNr=lineNr)
+        unit = match.group('unit')
+        if unit in TIME_UNITS:
+            if rule.attr not in TIME_METRICS:
+                raise RuleError("Time unit {!r} used for {}".format(unit, rule.attr))
+            rule.value *= TIME_UNITS[unit]
+        elif unit == '%' and rule.attr not in PERCENT_METRICS:
+            raise RuleError("Percentage used for {}".format(rule.attr))
+        return rule
+
+    raise RuleError("Invalid rule: {!r}".format(text))
+
+
+def parseRules(lines):
+    """ Parses the lines of a rules file. Returns a list of Rules.
+
+        Raises a RuleError with the line number if a line is invalid.
+    """
+    rules = []
+    for lineNr, line in enumerate(lines, 1):
+        text = line.split('#', 1)[0].strip()
+        if not text:
+            continue
+        try:
+            rules.append(parseRule(text, lineNr=lineNr))
+        except RuleError as ex:
+            raise RuleError("Line {}: {}".format(lineNr, ex))
+    return rules
+
+
+def readRulesFile(fileName):
+    """ Reads and parses a rules file. Returns a list of Rules.
+    """
+    with open(fileName, encoding='utf-8') as file:
+        return parseRules(file)
+
+
+
+class CheckResult(object):
+    """ Result of evaluating a rule.
+    """
+    __slots__ = ('rule', 'status', 'message', 'duration')
+
+    def __init__(self, rule, status, message, duration):
+        """ Constructor
+
+            :param status: PASSED, FAILED or ERROR (the rule couldn't be evaluated).
+            :param duration: the evaluation time in seconds.
+        """
+        self.rule = rule
+        self.status = status
+        self.message = message
+        self.duration = duration
+
+
+def checkRules(rules, store, baselineStore=None):
+    """ Evaluates the rules against the store. Returns a list with a CheckResult per rule.
+
+        Rules that compare with a baseline result in an ERROR if baselineStore is None.
+    """
+    results = []
+    for rule in rules:
+        startTime = time.perf_counter()
+        try:
+            if rule.requiresBaseline and baselineStore is None:
+                raise RuleError("Rule requires a baseline profile")
+            passed, message = rule.evaluate(store, baselineStore)
+            status = PASSED if passed else FAILED
+        except RuleError as ex:
+            status, message = ERROR, str(ex)
+        results.append(CheckResult(rule, status, message, time.perf_counter() - startTime))
+    return results
+
+
+def writeJUnitReport(results, fileName, suiteName='pepeye check'):
+    """ Writes the CheckResults as a JUnit XML report, with a test case per rule.
+    """
+    nFailures = sum(result.status == FAILED for result in results)
+    nErrors = sum(result.status == ERROR for result in results)
+    totalTime = "{:.6f}".format(sum(result.duration for result in results))
+
+    root = ET.Element('testsuites', name=suiteName, tests=str(len(results)),
+                      failures=str(nFailures), errors=str(nErrors), time=totalTime)
+    suite = ET.SubElement(root, 'testsuite', name=suiteName, tests=str(len(results)),
+                          failures=str(nFailures), errors=str(nErrors), skipped='0',
+                          time=totalTime)
+    for result in results:
+        rule = result.rule
+        testCase = ET.SubElement(suite, 'testcase', classname=type(rule).__name__,
+                                 name=rule.text, time="{:.6f}".format(result.duration))
+        if rule.lineNr is not None:
+            testCase.set('line', str(rule.lineNr))
+        if result.status == PASSED:
+            ET.SubElement(testCase, 'system-out').text = result.message
+        else:
+            tag = 'failure' if result.status == FAILED else 'error'
+            element = ET.SubElement(testCase, tag, message=result.message, type=tag)
+            element.text = result.message
+
+    ET.ElementTree(root).write(fileName, encoding='utf-8', xml_declaration=True)
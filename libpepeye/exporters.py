@@ -0,0 +1,239 @@
+"""
+    Exporters to the file formats of other profile tools.
+
+    The exporters are built from the caller graph of a StatsStore and write their output as a
+    stream, so that large profiles don't need large intermediate strings or dictionaries.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import json
+import logging
+import os
+import sys
+
+from array import array
+
+from .callgraph import CallGraph, DEFAULT_THRESHOLD, writeDot, writeSvg
+from .timing import TIMING
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MIN_FRACTION = 1e-4 # stacks with less than this fraction of the total time are pruned
+MAX_STACK_DEPTH = 256
+
+
+def iterStacks(store, minFraction=DEFAULT_MIN_FRACTION, maxDepth=MAX_STACK_DEPTH):
+    """ Generator that reconstructs call stacks from the caller graph of the store.
+
+        pstats files only contain caller edges, not complete stacks. The stacks are estimated by
+        walking from the roots (see StatsStore.rootWeights) to their callees, dividing the time
+        of a function over its callees in proportion to the cumulative time of each call edge.
+        Recursive calls (callees that are already on the stack) are not followed.
+
+        Yields (stack, selfTime) tuples where stack is a list of row positions from the root to
+        the leaf. The list is reused between iterations so it must be copied if it's kept.
+
+        :param minFraction: stacks with less than this fraction of the total time are pruned.
+            This bounds the number of stacks for large, highly connected graphs.
+        :param maxDepth: stacks are not followed deeper than this.
+    """
+    rows = store.rows
+    roots = store.rootWeights()
+    totalTime = sum(weight for _pos, weight in roots)
+    minWeight = totalTime * minFraction
+
+    def children(pos, weight):
+        """ Yields (callee position, weight) for the callees of pos.
+        """
+        cumTime = rows[pos].cumTime
+        if cumTime <= 0:
+            return
+        for calleePos, edge in store.callees(pos):
+            yield calleePos, weight * min(1.0, edge[3] / cumTime)
+
+    def selfTime(pos, weight):
+        """ Returns the part of the self time of pos that belongs to a stack with this weight.
+        """
+        cumTime = rows[pos].cumTime
+        return rows[pos].time * weight / cumTime if cumTime > 0 else 0.0
+
+    for root, rootWeight in roots:
+        if rootWeight < minWeight:
+            continue
+
+        path = [root]
+        onPath = {root}
+        iterators = [children(root, rootWeight)]
+        rootSelfTime = selfTime(root, rootWeight)
+        if rootSelfTime > 0:
+            yield path, rootSelfTime
+
+        while iterators:
+            for childPos, weight in iterators[-1]:
+                if weight < minWeight or childPos in onPath or len(path) >= maxDepth:
+                    continue
+                path.append(childPos)
+                onPath.add(childPos)
+                iterators.append(children(childPos, weight))
+                childSelfTime = selfTime(childPos, weight)
+                if childSelfTime > 0:
+                    yield path, childSelfTime
+                break
+            else:
+                iterators.pop()
+                onPath.discard(path.pop())
+
+
+
+def frameName(statRow):
+    """ Returns the name of a function as used in the stack based formats.
+    """
+    return "{} ({}:{})".format(statRow.functionName, statRow.fileName, statRow.lineNr)
+
+
+@TIMING.timed('writeCollapsedStacks')
+def writeCollapsedStacks(store, fileObj, minFraction=DEFAULT_MIN_FRACTION):
+    """ Writes the stacks in the collapsed stack format of flamegraph.pl.
+
+        Each line consists of the semicolon separated stack, followed by the self time in
+        microseconds.
+    """
+    names = [frameName(statRow).replace(';', ':') for statRow in store.rows]
+    for stack, selfTime in iterStacks(store, minFraction=minFraction):
+        microSeconds = int(round(selfTime * 1e6))
+        if microSeconds > 0:
+            fileObj.write("{} {}\n".format(";".join([names[pos] for pos in stack]),
+                                           microSeconds))
+
+
+@TIMING.timed('writeSpeedscope')
+def writeSpeedscope(store, fileObj, name='pepeye export', minFraction=DEFAULT_MIN_FRACTION):
+    """ Writes the stacks as a sampled profile in the speedscope JSON format.
+
+        See https://www.speedscope.app/file-format-schema.json. The frames are the rows of the
+        store and the samples are written while the stacks are reconstructed. Only the weights
+        are buffered (in a compact array) because they follow the samples in the file.
+    """
+    fileObj.write('{"$schema": "https://www.speedscope.app/file-format-schema.json", ')
+    fileObj.write('"exporter": "pepeye", "name": {}, '.format(json.dumps(name)))
+    fileObj.write('"activeProfileIndex": 0, "shared": {"frames": [')
+    for pos, statRow in enumerate(store.rows):
+        if pos:
+            fileObj.write(', ')
+        fileObj.write(json.dumps({'name': statRow.functionName, 'file': statRow.filePath,
+                                  'line': statRow.lineNr}))
+    fileObj.write(']}, "profiles": [{"type": "sampled", ')
+    fileObj.write('"name": {}, "unit": "seconds", "startValue": 0, '.format(json.dumps(name)))
+
+    weights = array('d')
+    fileObj.write('"samples": [')
+    for stack, selfTime in iterStacks(store, minFraction=minFraction):
+        if weights:
+            fileObj.write(', ')
+        fileObj.write('[{}]'.format(', '.join([str(pos) for pos in stack])))
+        weights.append(selfTime)
+
+    fileObj.write('], "weights": [')
+    for idx in range(0, len(weights), 1000):
+        if idx:
+            fileObj.write(', ')
+        fileObj.write(', '.join([repr(weight) for weight in weights[idx:idx + 1000]]))
+    fileObj.write('], "endValue": {}}}]}}\n'.format(repr(sum(weights))))
+
+
+@TIMING.timed('writeCallgrind')
+def writeCallgrind(store, fileObj):
+    """ Writes the caller graph in the callgrind format (e.g. for KCachegrind).
+
+        The costs are in microseconds. Files and functions are written with name compression.
+        The calls are listed per callee, which the format allows because the costs of repeated
+        function blocks are summed.
+    """
+    rows = store.rows
+    fileIds = {}                          # file path -> id
+    functionDefined = bytearray(len(rows)) # 1 if the function's name has been written
+
+    def fileSpec(statRow):
+        fileId = fileIds.get(statRow.filePath)
+        if fileId is None:
+            fileId = fileIds[statRow.filePath] = len(fileIds) + 1
+            return "({}) {}".format(fileId, statRow.filePath)
+        return "({})".format(fileId)
+
+    def functionSpec(pos):
+        if functionDefined[pos]:
+            return "({})".format(pos + 1)
+        functionDefined[pos] = 1
+        return "({}) {}".format(pos + 1, rows[pos].functionName)
+
+    fileObj.write("# callgrind format\nversion: 1\ncreator: pepeye\n")
+    fileObj.write("positions: line\nevents: us\n\n")
+
+    for pos, statRow in enumerate(rows):
+        fileObj.write("fl={}\nfn={}\n".format(fileSpec(statRow), functionSpec(pos)))
+        fileObj.write("{} {}\n\n".format(statRow.lineNr, int(round(statRow.time * 1e6))))
+
+        for callerPos, (numCalls, _numPrimCalls, _time, cumTime) in store.callers(pos):
+            caller = rows[callerPos]
+            fileObj.write("fl={}\nfn={}\n".format(fileSpec(caller), functionSpec(callerPos)))
+            fileObj.write("cfi={}\ncfn={}\n".format(fileSpec(statRow), functionSpec(pos)))
+            fileObj.write("calls={} {}\n{} {}\n\n".format(
+                numCalls, statRow.lineNr, caller.lineNr, int(round(cumTime * 1e6))))
+
+
+def writeCallGraphDot(store, fileObj, threshold=DEFAULT_THRESHOLD):
+    """ Writes the call graph in the DOT format. Functions and calls that take less than the
+        threshold fraction of the total time are pruned.
+    """
+    writeDot(CallGraph(store), fileObj, threshold=threshold)
+
+
+def writeCallGraphSvg(store, fileObj, threshold=DEFAULT_THRESHOLD):
+    """ Writes the call graph as an SVG image. Functions and calls that take less than the
+        threshold fraction of the total time are pruned.
+    """
+    writeSvg(CallGraph(store), fileObj, threshold=threshold)
+
+
+# Formats of which the writer accepts a pruning threshold
+GRAPH_FORMATS = ('dot', 'svg')
+
+# Format name -> (description, default file extension, writer function)
+EXPORT_FORMATS = collections.OrderedDict([
+    ('collapsed', ("Collapsed stacks (flamegraph.pl)", '.folded', writeCollapsedStacks)),
+    ('speedscope', ("Speedscope JSON", '.speedscope.json', writeSpeedscope)),
+    ('callgrind', ("Callgrind (KCachegrind)", '.callgrind', writeCallgrind)),
+    ('dot', ("Call graph DOT (Graphviz)", '.dot', writeCallGraphDot)),
+    ('svg', ("Call graph SVG", '.svg', writeCallGraphSvg)),
+])
+
+
+def exportStore(store, formatName, fileName, **options):
+    """ Exports the store to a file in one of the EXPORT_FORMATS.
+
+        :param fileName: output file name. Use '-' to write to standard output.
+        :param options: extra keyword arguments for the writer (e.g. the threshold of the
+            GRAPH_FORMATS).
+    """
+    if formatName not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format {!r}. Must be one of: {}"
+                         .format(formatName, ", ".join(EXPORT_FORMATS)))
+
+    _description, _extension, writer = EXPORT_FORMATS[formatName]
+    logger.info("Exporting {} format to: {}".format(formatName, fileName))
+    if fileName == '-':
+        writer(store, sys.stdout, **options)
+    else:
+        with open(fileName, 'w', encoding='utf-8') as fileObj:
+            writer(store, fileObj, **options)
+
+
+def defaultExportFileName(profileFileName, formatName):
+    """ Returns the profile file name with the default extension of the export format.
+    """
+    _description, extension, _writer = EXPORT_FORMATS[formatName]
+    return os.path.splitext(profileFileName)[0] + extension
@@ -0,0 +1,258 @@
+"""
+    Fuzzy matching of function and file names with a trigram index.
+
+    This is the Qt-free part of the quick-open palette (see quickopen.py). The names are split
+    into trigrams once per store. A search looks up the trigrams of the query, so that only the
+    names that share enough of them are scored. Searches are done in time slices, so that the
+    palette stays responsive while typing in a huge profile.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+# A name must contain at least this fraction of the trigrams of the query to match.
+MIN_TRIGRAM_SHARE = 1 / 3
+
+# Score bonuses of a name that contains the query, starts with it or is equal to it.
+SUBSTRING_BONUS = 1.0
+PREFIX_BONUS = 0.5
+EXACT_BONUS = 1.0
+
+# Weight of the cumulative time in the rank of a row, see FuzzySearch.
+CUM_TIME_WEIGHT = 0.5
+
+# Factor of the score of a row that is matched by its file name instead of its function name.
+FILE_MATCH_FACTOR = 0.8
+
+# Number of candidate names that are scored between two checks of the time budget.
+BATCH_SIZE = 128
+
+
+def paddedText(text):
+    """ Returns the text padded with two spaces at the start and one at the end, so that the
+        first characters and the end of a name have trigrams of their own.
+    """
+    return '  ' + text + ' '
+
+
+def trigrams(text):
+    """ Returns the set of trigrams (substrings of three characters) of the text.
+    """
+    return set(map(''.join, zip(text, text[1:], text[2:])))
+
+
+def trigramsOfQuery(query):
+    """ Returns the trigrams of a query.
+
+        A query of less than three characters has no trigrams of its own. It is padded at the
+        start, so that it matches the names that start with it.
+    """
+    return trigrams(query) if len(query) >= 3 else trigrams('  ' + query)
+
+
+
+class TrigramIndex(object):
+    """ Trigram index of the distinct (lower case) function names and file names of rows.
+
+        The rows of a name are stored in one array, like the compacted callers of a StatsStore:
+        the positions of the rows of name i are rowPositions[starts[i]:starts[i + 1]].
+    """
+    def __init__(self, rows, cumTimes):
+        """ Constructor
+
+            :param rows: the StatRows. Their positions in this sequence are the results.
+            :param cumTimes: per row the cumulative time (e.g. StatsStore.column('cumTime')).
+                Used to rank the results.
+        """
+        self.cumTimes = cumTimes
+        self.maxCumTime = max(cumTimes, default=0.0)
+
+        nameIds = {} # lower case name -> name id
+        nameIdsOfRows = array('i') # per row the id of its function name and of its file name
+        for statRow in rows:
+            nameIdsOfRows.append(nameIds.setdefault(statRow.lcFunctionName, len(nameIds)))
+            nameIdsOfRows.append(nameIds.setdefault(statRow.lcFileName, len(nameIds)))
+
+        self.names = list(nameIds)
+        self._paddedNames = list(map(paddedText, self.names))
+        self._isFileName = array('b', [0]) * len(self.names)
+        for nameId in itertools.islice(nameIdsOfRows, 1, None, 2):
+            self._isFileName[nameId] = 1
+
+        # Rows grouped by name id. Element i of nameIdsOfRows belongs to the row at i // 2.
+        order = sorted(range(len(nameIdsOfRows)), key=nameIdsOfRows.__getitem__)
+        self._rowPositions = array('i', (idx >> 1 for idx in order))
+        counts = collections.Counter(nameIdsOfRows)
+        self._starts = array('i', itertools.accumulate(
+            (counts[nameId] for nameId in range(len(self.names))), initial=0))
+
+        postings = collections.defaultdict(list)
+        self._nTrigrams = array('i') # per name the number of distinct trigrams of its padded text
+        for nameId, padded in enumerate(self._paddedNames):
+            nameTrigrams = trigrams(padded)
+            self._nTrigrams.append(len(nameTrigrams))
+            for trigram in nameTrigrams:
+                postings[trigram].append(nameId)
+        # trigram -> array with the ids of the names that contain it
+        self._postings = {trigram: array('i', nameIds) for trigram, nameIds in postings.items()}
+
+
+    def __len__(self):
+        """ Returns the number of distinct names.
+        """
+        return len(self.names)
+
+
+    def isFileName(self, nameId):
+        """ Returns True if the name is a file name (it can be a function name as well).
+        """
+        return bool(self._isFileName[nameId])
+
+
+    def rowPositions(self, nameId):
+        """ Returns an array with the positions of the rows with the function or file name.
+        """
+        return self._rowPositions[self._starts[nameId]:self._starts[nameId + 1]]
+
+
+    def candidates(self, queryTrigrams, minShared):
+        """ Returns an iterator over the ids of the names that can share at least minShared of
+            the query trigrams. A name id can occur more than once.
+
+            A name that shares minShared of the n trigrams is in at least one of the posting
+            lists of any n - minShared + 1 of them, so only the shortest lists are read.
+        """
+        postings = sorted((self._postings.get(trigram, ()) for trigram in queryTrigrams),
+                          key=len)
+        return itertools.chain.from_iterable(postings[:len(postings) - minShared + 1])
+
+
+    def nameScore(self, nameId, query, queryTrigrams, minShared):
+        """ Returns the match score of a name, or None if it shares less than minShared of the
+            query trigrams.
+
+            The score is the Jaccard similarity of the trigram sets of the query and the padded
+            name, plus bonuses if the name contains the query, starts with it or is equal to it.
+        """
+        padded = self._paddedNames[nameId]
+        nShared = sum(trigram in padded for trigram in queryTrigrams)
+        if nShared < minShared:
+            return None
+
+        name = self.names[nameId]
+        score = nShared / (len(queryTrigrams) + self._nTrigrams[nameId] - nShared)
+        if query in name:
+            score += SUBSTRING_BONUS
+            if name.startswith(query):
+                score += PREFIX_BONUS
+                if name == query:
+                    score += EXACT_BONUS
+        return score
+
+
+
+class FuzzySearch(object):
+    """ Incremental search for the rows of which the function or file name matches a query.
+
+        The rows are ranked by the match score of the name, weighted by their cumulative time:
+        score * (1 + CUM_TIME_WEIGHT * cumTime / the largest cumTime). So a hot function ranks
+        higher than a cold one with the same name score, but an exact name match still beats a
+        partial one.
+
+        Call advance() until it returns True. The results are available after every call.
+    """
+    def __init__(self, index, query, maxResults=50):
+        """ Constructor
+
+            :param index: the TrigramIndex of the rows.
+            :param query: the text to search for. Case insensitive.
+            :param maxResults: the number of results that is kept.
+        """
+        self.query = query.strip().lower()
+        self.maxResults = maxResults
+        self._index = index
+        self._timeFactor = (CUM_TIME_WEIGHT / index.maxCumTime if index.maxCumTime > 0
+                            else 0.0)
+        self._heap = []  # (row score, position) tuples of the best rows, smallest first.
+        self._steps = self._search()
+        self.done = not self.query
+
+
+    def _search(self):
+        """ Generator that scores the candidate names and yields after every batch.
+        """
+        query = self.query
+        queryTrigrams = trigramsOfQuery(query)
+        minShared = max(1, int(len(queryTrigrams) * MIN_TRIGRAM_SHARE + 0.5))
+        index = self._index
+        nameScore = index.nameScore
+        seen = set()
+        candidates = index.candidates(queryTrigrams, minShared)
+        while True:
+            batch = [nameId for nameId in itertools.islice(candidates, BATCH_SIZE)
+                     if nameId not in seen]
+            if not batch:
+                return
+            seen.update(batch)
+            for nameId in batch:
+                score = nameScore(nameId, query, queryTrigrams, minShared)
+                if score is not None:
+                    if index.isFileName(nameId) and index.names[nameId] != query:
+                        score *= FILE_MATCH_FACTOR
+                    self._addRows(index.rowPositions(nameId), score)
+            yield
+
+
+    def _addRows(self, positions, score):
+        """ Adds the rows with their score, weighted by their cumulative time, to the heap.
+        """
+        heap = self._heap
+        cumTimes = self._index.cumTimes
+        timeFactor = self._timeFactor
+        # Rows can be in the heap twice (matched by function name and by file name).
+        maxHeapSize = 2 * self.maxResults
+        for pos in positions:
+            item = (score * (1.0 + cumTimes[pos] * timeFactor), pos)
+            if len(heap) < maxHeapSize:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+
+    def advance(self, budget=0.002):
+        """ Continues the search for at most about budget seconds. Returns True when done.
+        """
+        if self.done:
+            return True
+        deadline = time.perf_counter() + budget
+        for _ in self._steps:
+            if time.perf_counter() >= deadline:
+                return False
+        self.done = True
+        return True
+
+
+    def results(self):
+        """ Returns a list with the (score, position) tuples of the best rows found so far,
+            best first.
+        """
+        results = []
+        seen = set()
+        for score, pos in sorted(self._heap, reverse=True):
+            if pos not in seen:
+                seen.add(pos)
+                results.append((score, pos))
+                if len(results) == self.maxResults:
+                    break
+        return results
@@ -12,19 +12,40 @@ import pstats
 import sys
 
 from .version import PROGRAM_NAME, PROGRAM_VERSION, PROGRAM_URL, DEBUGGING
-from .qt import Qt, QtCore, QtGui, QtWidgets, APPLICATION_INSTANCE
-
+from .qt import Qt, QtCore, QtGui, QtWidgets, QtSignal, APPLICATION_INSTANCE
+
+from .callgraphview import CallGraphPane
+from .exporters import EXPORT_FORMATS, defaultExportFileName, exportStore
+from .pathdialog import PathNormalizationDialog
+from .pathnormalizer import PathNormalizer, parsePrefixRule
+from .query import isGilEnabled
+from .quickopen import QuickOpenDialog
+from .session import SessionStore
+from .snapshots import SnapshotSeries, METRIC_CUM_TIME
+from .sourcepane import SourcePane
+from .statsstore import FILTER_ATTRIBUTES, STORE_REGISTRY
 from .statstablemodel import StatsTableModel
 from .statstableview import StatsTableView
+from .timing import TIMING, formatSpanBreakdown
 
 
 logger = logging.getLogger(__name__)
 
 
 
-def createBrowser(fileName = None, selfProfFile=None, **kwargs):
+def createBrowser(fileName = None, selfProfFile=None, timing=False, seriesFileNames=None,
+                  sortColumns=None, **kwargs):
     """ Opens an MainWindow window
+
+        :param timing: If True, timing spans of pepeye itself are recorded from the start.
+        :param seriesFileNames: If given, these files are opened as a snapshot series (and
+            fileName is ignored).
+        :param sortColumns: If given, a list of (column name, descending) tuples on which the
+            rows are sorted after opening (see query.parseSortSpec).
     """
+    if timing:
+        TIMING.setEnabled(True)
+
     # Assumes qt.getQApplicationInstance() has been executed.
     browser = MainWindow(**kwargs)
     browser.show()
@@ -40,9 +61,14 @@ def createBrowser(fileName = None, selfProfFile=None, **kwargs):
         profiler = cProfile.Profile()
         profiler.enable()
 
-    if fileName is not None:
+    if seriesFileNames:
+        browser.openSnapshotSeries(seriesFileNames)
+    elif fileName is not None:
         browser.openStatsFile(fileName)
 
+    if sortColumns:
+        browser.sortOnColumns(sortColumns)
+
     if selfProfFile:
         logger.info("Saving profiling information to {}".format(selfProfFile))
         profStats = pstats.Stats(profiler)
@@ -81,18 +107,45 @@ class MainWindow(QtWidgets.QMainWindow):
     """ pepyeye main application window.
     """
     _nInstances = 0
+    FILTER_WORKER_CHOICES = (1, 2, 4, 8)
+
+    # Emitted with the latency breakdown of a finished root span, possibly by another thread.
+    sigTimingBreakdown = QtSignal(str)
+
+    _openWindows = [] # Keeps references to the windows so they are not garbage collected.
     
-    def __init__(self, reset = False):
+    def __init__(self, reset = False, topK = None, lowMemory = None, compactTime = None,
+                 pathNormalizer = None):
         """ Constructor
             :param reset: If true the persistent settings, such as column widths, are reset. 
+            :param topK: If set, only the first topK rows are sorted at first. The next rows
+                are sorted in pages when the user scrolls down.
+            :param lowMemory: If True, files are loaded in low-memory mode (see
+                StatsStore._compactCallers). If None, the persistent setting is used.
+            :param compactTime: If > 0, functions with a Σ time less than this number of
+                seconds are collapsed into an "other" row per file when loading (see
+                statsstore.compactStats). If None, the persistent setting is used.
+            :param pathNormalizer: PathNormalizer for the file paths when loading (see
+                statsstore.normalizeStats). If None, the persistent setting is used.
         """
         super(MainWindow, self).__init__()
 
         MainWindow._nInstances += 1
         self._InstanceNr = self._nInstances        
+        MainWindow._openWindows.append(self)
         
+        self._fileName = None
+        self._sessionStore = SessionStore()
+        self._compactTime = 0.0 # Read from the settings in _readViewSettings.
+        self._pathNormalizer = PathNormalizer() # Idem
+
+        # The settings that are written to the persistent store when the window closes. These
+        # are only changed from the menus, the overrides of the command line are not stored.
+        self._storedSettings = {}
+        self._quickOpenDialog = None # Created when first needed, see showQuickOpen.
+
         # Model
-        self._statsTableModel = StatsTableModel(parent=self)
+        self._statsTableModel = StatsTableModel(parent=self, topK=topK)
 
         # Views
         self.__setupActions()
@@ -105,7 +158,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.filterLineEdit.textChanged.connect(self._statsTableModel.filterRows)
         self._statsTableModel.modelReset.connect(self.updateOccursLabel)
 
+        TIMING.addListener(self._onTimingSpanFinished)
+
         self._readViewSettings(reset=reset)
+        if lowMemory is not None:
+            self.lowMemoryAction.setChecked(lowMemory)
+        if compactTime is not None:
+            self._compactTime = compactTime
+        if pathNormalizer is not None:
+            self._pathNormalizer = pathNormalizer
             
         logger.debug("MainWindow constructor finished")
      
@@ -113,7 +174,40 @@ class MainWindow(QtWidgets.QMainWindow):
     def __setupActions(self):
         """ Creates the main window actions.
         """
-        pass
+        self.recordTimingAction = QtWidgets.QAction("&Record Timing Spans", self)
+        self.recordTimingAction.setCheckable(True)
+        self.recordTimingAction.setChecked(TIMING.enabled)
+        self.recordTimingAction.setToolTip("Records how long pepeye takes to load, sort and paint")
+        self.recordTimingAction.toggled.connect(self.setTimingEnabled)
+
+        self.fastPaintAction = QtWidgets.QAction("&Fast Table Painting", self)
+        self.fastPaintAction.setCheckable(True)
+        self.fastPaintAction.setChecked(True)
+        self.fastPaintAction.setToolTip("Paints the table rows from the model columns instead "
+                                        "of calling data() per cell")
+        self.fastPaintAction.toggled.connect(
+            lambda checked: self.tableView.setFastPaintEnabled(checked))
+
+        # The number of threads that search the rows when filtering.
+        self.filterWorkersActionGroup = QtWidgets.QActionGroup(self)
+        for workers in self.FILTER_WORKER_CHOICES:
+            action = self.filterWorkersActionGroup.addAction(
+                "{} Thread{}".format(workers, "" if workers == 1 else "s"))
+            action.setCheckable(True)
+            action.setData(workers)
+            action.setChecked(workers == 1)
+        self.filterWorkersActionGroup.triggered.connect(
+            lambda action: self.setFilterWorkers(action.data()))
+
+        self.lowMemoryAction = QtWidgets.QAction("&Low Memory Mode", self)
+        self.lowMemoryAction.setCheckable(True)
+        self.lowMemoryAction.setChecked(False)
+        self.lowMemoryAction.setToolTip("Stores the callers of the functions in compact arrays "
+                                        "and frees the pstats data after loading. Applies to "
+                                        "files that are opened or reloaded next.")
+        # Only changes of the user are stored, setChecked does not emit triggered.
+        self.lowMemoryAction.triggered.connect(
+            lambda checked: self._storedSettings.update(lowMemory=checked))
                   
                               
     def __setupMenu(self):
@@ -122,9 +216,29 @@ class MainWindow(QtWidgets.QMainWindow):
         fileMenu = self.menuBar().addMenu("&File")
         openAction = fileMenu.addAction("&Open...", self.openStatsFile)
         openAction.setShortcut("Ctrl+O")
+        self.newWindowAction = fileMenu.addAction("&New Window", self.newWindow)
+        self.newWindowAction.setShortcut("Ctrl+N")
+        self.newWindowAction.setToolTip("Opens a new window that shares the data of this window")
+        fileMenu.addAction("Open Snapshot &Series...", self.openSnapshotSeries)
+        self.addSnapshotAction = fileMenu.addAction("&Add Snapshot...", self.addSnapshot)
+        self.addSnapshotAction.setEnabled(False)
         self.reloadAction = fileMenu.addAction("&Reload", self.reloadStatsFile)
         self.reloadAction.setShortcut("Ctrl+R")
         self.reloadAction.setEnabled(False)
+        fileMenu.addAction(self.lowMemoryAction)
+        compactAction = fileMenu.addAction("Co&mpact Small Functions...", self.editCompactTime)
+        compactAction.setToolTip("Collapses the functions with a small Σ time into an 'other' "
+                                 "row per file when loading")
+        normalizeAction = fileMenu.addAction("&Path Normalization...",
+                                             self.editPathNormalization)
+        normalizeAction.setToolTip("Maps the file paths when loading, so that the same code "
+                                   "under different directories is merged into one row")
+
+        self.exportMenu = fileMenu.addMenu("&Export")
+        self.exportMenu.setEnabled(False)
+        for formatName, (description, _extension, _writer) in EXPORT_FORMATS.items():
+            self.exportMenu.addAction("{}...".format(description),
+                                      lambda formatName=formatName: self.exportStats(formatName))
         fileMenu.addSeparator()
         fileMenu.addAction("C&lose", self.closeWindow, "Ctrl+W")
         fileMenu.addAction("E&xit", self.quitApplication, "Ctrl+Q")
@@ -132,6 +246,28 @@ class MainWindow(QtWidgets.QMainWindow):
             fileMenu.addSeparator()
             fileMenu.addAction("&Test", self.myTest, "Ctrl+T")
         
+        goMenu = self.menuBar().addMenu("&Go")
+        self.goToFunctionAction = goMenu.addAction("Go to &Function...", self.showQuickOpen)
+        self.goToFunctionAction.setShortcut("Ctrl+P")
+        self.goToFunctionAction.setToolTip("Finds a function by (a part of) its function or "
+                                           "file name")
+
+        debugMenu = self.menuBar().addMenu("&Debug")
+        debugMenu.addAction(self.recordTimingAction)
+        debugMenu.addAction(self.fastPaintAction)
+        filterWorkersMenu = debugMenu.addMenu("&Filter Threads")
+        filterWorkersMenu.setToolTipsVisible(True)
+        filterWorkersMenu.addActions(self.filterWorkersActionGroup.actions())
+        for action in filterWorkersMenu.actions():
+            action.setToolTip("Number of threads that search the rows when filtering. Only "
+                              "faster on a free-threaded Python build")
+        # With the GIL enabled the threads can't search in parallel, so only one is used.
+        filterWorkersMenu.setEnabled(not isGilEnabled())
+        if isGilEnabled():
+            filterWorkersMenu.setToolTip("Only available on a free-threaded Python build")
+        debugMenu.addAction("&Save Timing Spans...", self.saveTimingSpans)
+        debugMenu.addAction("&Clear Timing Spans", TIMING.clear)
+
         self.menuBar().addSeparator()
         help_menu = self.menuBar().addMenu("&Help")
         help_menu.addAction('&About', self.about)
@@ -155,20 +291,54 @@ class MainWindow(QtWidgets.QMainWindow):
         self.filterLineEdit = QtWidgets.QLineEdit()
         self.filterLineEdit.setFixedWidth(400)
         self.filterLineEdit.setPlaceholderText("Filter on path or function name...")
+        self.filterLineEdit.setToolTip(
+            "Shows the functions of which the path or name contains the text.\n"
+            "Words such as 'recursive>50' or 'total>=1' are conditions on a column.\n"
+            "Columns: {}. Operators: <, <=, >, >=, =, !=.".format(", ".join(FILTER_ATTRIBUTES)))
         self.filterLayout = QtWidgets.QHBoxLayout()
         self.filterLayout.addWidget(self.filterLineEdit)
 
         self.occursLabel = QtWidgets.QLabel("")
         self.filterLayout.addWidget(self.occursLabel)
         self.filterLayout.addStretch()
+
+        # Metric of the trend columns. Only visible when a snapshot series is open.
+        self.seriesLabel = QtWidgets.QLabel("")
+        self.filterLayout.addWidget(self.seriesLabel)
+        self.seriesMetricComboBox = QtWidgets.QComboBox()
+        self.seriesMetricComboBox.addItems(
+            [self._statsTableModel.HEADER_LABELS[col] for col in (
+                StatsTableModel.COL_NUM_CALLS, StatsTableModel.COL_TIME,
+                StatsTableModel.COL_CUM_TIME)]) # Same order as snapshots.METRICS
+        self.seriesMetricComboBox.setCurrentIndex(METRIC_CUM_TIME)
+        self.seriesMetricComboBox.setToolTip("Metric of the trend, growth and variance columns")
+        self.seriesMetricComboBox.currentIndexChanged.connect(
+            self._statsTableModel.setSeriesMetric)
+        self.filterLayout.addWidget(self.seriesMetricComboBox)
+        self.seriesLabel.setVisible(False)
+        self.seriesMetricComboBox.setVisible(False)
         self.mainLayout.addLayout(self.filterLayout)
 
         # Table view
         self.tableView = StatsTableView(self._statsTableModel)
         self.mainLayout.addWidget(self.tableView)
 
-        self.label = QtWidgets.QLabel("Hi there")
-        self.mainSplitter.addWidget(self.label)
+        # Source code and call graph of the selected function
+        self.detailTabWidget = QtWidgets.QTabWidget()
+        self.mainSplitter.addWidget(self.detailTabWidget)
+        self.sourcePane = SourcePane()
+        self.detailTabWidget.addTab(self.sourcePane, "Source")
+        self.callGraphPane = CallGraphPane()
+        self.detailTabWidget.addTab(self.callGraphPane, "Call Graph")
+        self.tableView.selectionModel().currentRowChanged.connect(self._onCurrentRowChanged)
+        self.callGraphPane.sigFunctionActivated.connect(self.goToFunction)
+
+        # Status bar readout of the last timed operation
+        self.timingLabel = QtWidgets.QLabel("")
+        self.statusBar().addWidget(self.timingLabel)
+        self.timingLabel.setVisible(TIMING.enabled)
+        # Queued, so that the label is only changed in the GUI thread. Spans can finish in others.
+        self.sigTimingBreakdown.connect(self.timingLabel.setText, Qt.QueuedConnection)
 
 
     # End of setup_methods
@@ -178,7 +348,6 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         if self._fileName is not None:
             self.loadStatsFile(self._fileName)
-            self._statsTableModel._sortAndFilter()
         else:
             logger.warning("No current file to be reloaded.")
 
@@ -190,14 +359,307 @@ class MainWindow(QtWidgets.QMainWindow):
         assert fileName is not None, "fileName undefined"
         logger.debug("Loading file: {}".format(fileName))
 
-        self._fileName = fileName
-        self.setWindowTitle("{} -- {}".format(os.path.basename(fileName), PROGRAM_NAME))
-        pStats = pstats.Stats(fileName)
-        self._statsTableModel.setStats(statsObject=pStats)
-        #pStats.strip_dirs()
-        #pStats.calc_callees()
+        self._saveSession()
+
+        with TIMING.span('loadStatsFile', fileName=fileName):
+            self._fileName = fileName
+            self.setWindowTitle("{} -- {}".format(os.path.basename(fileName), PROGRAM_NAME))
+
+            # The store is only loaded if no other window has the same file open.
+            store = STORE_REGISTRY.acquire(fileName,
+                                           lowMemory=self.lowMemoryAction.isChecked(),
+                                           compactTime=self._compactTime,
+                                           pathNormalizer=self._pathNormalizer)
+
+            with TIMING.span('readSession'):
+                session = self._sessionStore.readSession(store.contentHash)
+                rowOrderState = None
+                if session is not None:
+                    rowOrderState = self._sessionStore.readRowOrder(store.contentHash)
+                    self._statsTableModel.setSortAndFilterOptions(
+                        session['sortColumn'], Qt.SortOrder(session['sortOrder']),
+                        session['filterText'], secondarySortColumns=[
+                            (col, Qt.SortOrder(order))
+                            for col, order in session.get('secondarySortColumns', [])])
+
+            oldStore = self._statsTableModel.store
+            self._statsTableModel.setStore(store, rowOrderState=rowOrderState)
+            self.callGraphPane.setStore(store)
+            self._releaseQuickOpenStore()
+            STORE_REGISTRY.release(oldStore)
+
+            self._restoreSession(session)
+            self.reloadAction.setEnabled(True)
+            self.exportMenu.setEnabled(True)
+
+        messages = []
+        if store.nMerged:
+            messages.append("{} functions merged by the path normalization".format(
+                store.nMerged))
+        if store.nCompacted:
+            messages.append("{} functions below {:g} µs collapsed into 'other' rows".format(
+                store.nCompacted, store.compactTime * 1e6))
+        if store.lowMemory:
+            saved = store.memorySaved
+            messages.append("Low memory mode: {} saved by compacting the callers".format(
+                "{:.1f} MB".format(saved / 2**20) if saved >= 2**20
+                else "{} KB".format(saved // 2**10)))
+        if messages:
+            self.statusBar().showMessage(". ".join(messages))
+
+
+    def editCompactTime(self):
+        """ Lets the user set the Σ time below which functions are collapsed into an "other"
+            row per file. Reloads the current file if it's changed.
+        """
+        microseconds, ok = QtWidgets.QInputDialog.getDouble(
+            self, "Compact Small Functions",
+            "Collapse the functions with a Σ time below (µs, 0 to disable):",
+            self._compactTime * 1e6, 0.0, 1e9, 3)
+        if ok and microseconds * 1e-6 != self._compactTime:
+            self._compactTime = microseconds * 1e-6
+            self._storedSettings['compactTime'] = self._compactTime
+            if self._fileName is not None:
+                self.loadStatsFile(self._fileName)
+
+
+    def editPathNormalization(self):
+        """ Lets the user edit the normalization of the file paths. Reloads the current file and
+            snapshot series if it's changed.
+        """
+        dialog = PathNormalizationDialog(self._pathNormalizer, parent=self)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            pathNormalizer = dialog.pathNormalizer()
+            if pathNormalizer != self._pathNormalizer:
+                self._pathNormalizer = pathNormalizer
+                self._storedSettings['pathNormalizer'] = pathNormalizer
+                oldSeries = self._statsTableModel.series
+                if self._fileName is not None:
+                    self.loadStatsFile(self._fileName)
+                if oldSeries is not None:
+                    # The keys of the series must be normalized in the same way as the rows.
+                    series = SnapshotSeries(pathNormalizer=pathNormalizer)
+                    series.addFiles(oldSeries.fileNames)
+                    self._setSeries(series)
+
+
+    def exportStats(self, formatName):
+        """ Lets the user select a file and exports the current profile to it.
+
+            :param formatName: one of the keys of exporters.EXPORT_FORMATS
+        """
+        store = self._statsTableModel.store
+        if store is None:
+            logger.warning("No profile to export.")
+            return
+
+        description, extension, _writer = EXPORT_FORMATS[formatName]
+        fileName = QtWidgets.QFileDialog.getSaveFileName(self,
+            caption = "Export as {}".format(description),
+            directory = defaultExportFileName(self._fileName, formatName),
+            filter='{} (*{});;All files (*)'.format(description, extension))[0]
+
+        if fileName:
+            try:
+                exportStore(store, formatName, fileName)
+            except Exception as ex:
+                if DEBUGGING:
+                    raise
+                else:
+                    logger.error("Error exporting file: %s", ex)
+                    QtWidgets.QMessageBox.warning(self, "Error exporting file", str(ex))
+
+
+    def newWindow(self):
+        """ Opens a new window. If a file is open, the new window shows it as well.
+
+            The windows share the loaded data, only the sort order and filter result are
+            stored per window.
+        """
+        window = MainWindow(topK=self._statsTableModel.topK,
+                            lowMemory=self.lowMemoryAction.isChecked(),
+                            compactTime=self._compactTime,
+                            pathNormalizer=self._pathNormalizer)
+        window.show()
+        if self._fileName is not None:
+            window.openStatsFile(self._fileName)
+        if self._statsTableModel.series is not None:
+            window._setSeries(self._statsTableModel.series)
+        return window
+
+
+    def openSnapshotSeries(self, fileNames=None):
+        """ Lets the user select pstats files and opens them as a series of snapshots.
+
+            The files are ordered by name. The table shows the last snapshot, the trend, growth
+            and variance columns show the evolution over all snapshots.
+        """
+        if not fileNames:
+            fileNames = QtWidgets.QFileDialog.getOpenFileNames(self,
+                caption = "Choose the pstats files of the series", directory = '',
+                filter='All files (*);;Profile statistics (*.prof; *.pro)')[0]
+            fileNames = sorted(fileNames)
+
+        if fileNames:
+            logger.info("Loading snapshot series: {!r}".format(fileNames))
+            try:
+                series = SnapshotSeries(pathNormalizer=self._pathNormalizer)
+                series.addFiles(fileNames)
+                self.loadStatsFile(fileNames[-1])
+                self._setSeries(series)
+            except Exception as ex:
+                if DEBUGGING:
+                    raise
+                else:
+                    logger.error("Error opening series: %s", ex)
+                    QtWidgets.QMessageBox.warning(self, "Error opening series", str(ex))
+
+
+    def addSnapshot(self, fileName=None):
+        """ Lets the user select a pstats file and appends it to the current series.
+
+            Only the new file is read. The table then shows the new snapshot.
+        """
+        series = self._statsTableModel.series
+        if series is None:
+            logger.warning("No snapshot series is open.")
+            return
+
+        if not fileName:
+            fileName = QtWidgets.QFileDialog.getOpenFileName(self,
+                caption = "Choose a pstats file", directory = '',
+                filter='All files (*);;Profile statistics (*.prof; *.pro)')[0]
+
+        if fileName:
+            logger.info("Adding snapshot: {!r}".format(fileName))
+            try:
+                series.addFiles([fileName])
+                self.loadStatsFile(fileName) # Also updates the series columns.
+                self._updateSeriesLabel()
+            except Exception as ex:
+                if DEBUGGING:
+                    raise
+                else:
+                    logger.error("Error adding snapshot: %s", ex)
+                    QtWidgets.QMessageBox.warning(self, "Error adding snapshot", str(ex))
+
+
+    def _setSeries(self, series):
+        """ Sets the snapshot series of the model and shows or hides the series widgets.
+        """
+        isSeries = series is not None
+        self._statsTableModel.setSeries(series)
+        self.tableView.setSeriesColumnsVisible(isSeries)
+        self.seriesLabel.setVisible(isSeries)
+        self.seriesMetricComboBox.setVisible(isSeries)
+        self.addSnapshotAction.setEnabled(isSeries)
+        self._updateSeriesLabel()
+
+
+    def _updateSeriesLabel(self):
+        """ Shows the number of snapshots in the series.
+        """
+        series = self._statsTableModel.series
+        if series is not None:
+            self.seriesLabel.setText("{} snapshots, trend of:".format(series.nSnapshots))
+
+
+    def sortOnColumns(self, sortColumns):
+        """ Sorts the rows on several columns.
+
+            :param sortColumns: list of (column name, descending) tuples, the most significant
+                first. The names are those of StatsTableModel.SORT_NAMES.
+        """
+        model = self._statsTableModel
+        model.setSortColumns([(model.SORT_NAMES.index(name),
+                               Qt.DescendingOrder if descending else Qt.AscendingOrder)
+                              for name, descending in sortColumns])
+        self._updateSortIndicator()
+
 
-        self.reloadAction.setEnabled(True)
+    def setFilterWorkers(self, workers):
+        """ Sets the number of threads that search the rows when filtering.
+
+            Always one if the GIL is enabled, because the threads can't run in parallel then.
+        """
+        self._statsTableModel.setFilterWorkers(1 if isGilEnabled() else workers)
+        for action in self.filterWorkersActionGroup.actions():
+            action.setChecked(action.data() == self._statsTableModel.filterWorkers)
+
+
+    def _updateSortIndicator(self):
+        """ Shows the first sort column of the model in the table header.
+        """
+        model = self._statsTableModel
+        header = self.tableView.horizontalHeader()
+        header.blockSignals(True) # Prevents sorting again
+        try:
+            header.setSortIndicator(model.sortColumn, model.sortOrder)
+        finally:
+            header.blockSignals(False)
+
+
+    def _restoreSession(self, session):
+        """ Updates the widgets so that they reflect the sort order and filter of the model.
+            Restores the selection, scroll position and splitter state if session is not None.
+        """
+        model = self._statsTableModel
+        self._updateSortIndicator()
+
+        self.filterLineEdit.blockSignals(True) # Prevents filtering again
+        try:
+            self.filterLineEdit.setText(model.filterText)
+        finally:
+            self.filterLineEdit.blockSignals(False)
+        self.updateOccursLabel()
+
+        if session is None:
+            return
+
+        logger.debug("Restoring session: {}".format(session))
+        if session.get('splitterState'):
+            self.mainSplitter.restoreState(
+                QtCore.QByteArray.fromBase64(session['splitterState'].encode('ascii')))
+
+        if session.get('selectedFunction'):
+            statRow = model.findStatRow(tuple(session['selectedFunction']))
+            index = model.findIndexForItem(statRow) if statRow is not None else None
+            if index is not None and index.isValid():
+                self.tableView.setCurrentIndex(index)
+
+        # The scroll bar range is updated after the layout of the table is done.
+        scrollPosition = session.get('scrollPosition', 0)
+        QtCore.QTimer.singleShot(
+            0, lambda: self.tableView.verticalScrollBar().setValue(scrollPosition))
+
+
+    @TIMING.timed('saveSession')
+    def _saveSession(self):
+        """ Stores the session state of the current profile, keyed by its content hash.
+        """
+        model = self._statsTableModel
+        if model.store is None or model.store.contentHash is None:
+            return
+
+        statRow = model.itemAtIndex(self.tableView.currentIndex())
+        if statRow is None:
+            selectedFunction = None
+        else:
+            selectedFunction = [statRow.filePath, statRow.lineNr, statRow.functionName]
+
+        session = {
+            'fileName': self._fileName,
+            'sortColumn': model.sortColumn,
+            'sortOrder': int(model.sortOrder),
+            'secondarySortColumns': [[col, int(order)] for col, order in model.sortColumns[1:]],
+            'filterText': model.filterText,
+            'selectedFunction': selectedFunction,
+            'scrollPosition': self.tableView.verticalScrollBar().value(),
+            'splitterState': bytes(self.mainSplitter.saveState().toBase64()).decode('ascii'),
+        }
+        logger.debug("Saving session: {}".format(session))
+        self._sessionStore.writeSession(model.store.contentHash, session)
+        self._sessionStore.writeRowOrder(model.store.contentHash, model.rowOrderState())
         
 
     def openStatsFile(self, fileName=None):
@@ -212,6 +674,8 @@ class MainWindow(QtWidgets.QMainWindow):
         if fileName:
             logger.info("Loading data from: {!r}".format(fileName))
             try:
+                if self._statsTableModel.series is not None:
+                    self._setSeries(None)
                 self.loadStatsFile(fileName)
             except Exception as ex:
                 if DEBUGGING:
@@ -223,6 +687,42 @@ class MainWindow(QtWidgets.QMainWindow):
 
 
 
+    def setTimingEnabled(self, enabled):
+        """ Enables or disables the recording of timing spans.
+        """
+        TIMING.setEnabled(enabled)
+        self.timingLabel.setVisible(enabled)
+
+
+    def _onTimingSpanFinished(self, span, children):
+        """ Shows the latency breakdown of the last timed operation in the status bar.
+
+            Called by the thread that finished the span, which need not be the GUI thread.
+        """
+        self.sigTimingBreakdown.emit(formatSpanBreakdown(span, children))
+
+
+    def saveTimingSpans(self):
+        """ Lets the user select a file and saves the recorded timing spans to it.
+
+            The Chrome trace format is used unless the plain JSON filter is selected.
+        """
+        chromeTraceFilter = 'Chrome trace (*.json)'
+        fileName, selectedFilter = QtWidgets.QFileDialog.getSaveFileName(self,
+            caption = "Save timing spans", directory = 'pepeye_spans.json',
+            filter='{};;Plain JSON (*.json)'.format(chromeTraceFilter))
+
+        if fileName:
+            try:
+                TIMING.dump(fileName, chromeTrace=(selectedFilter == chromeTraceFilter))
+            except Exception as ex:
+                if DEBUGGING:
+                    raise
+                else:
+                    logger.error("Error saving timing spans: %s", ex)
+                    QtWidgets.QMessageBox.warning(self, "Error saving timing spans", str(ex))
+
+
     def _settingsGroupName(self, prefix):
         """ Creates a setting group name based on the prefix and instance number
         """
@@ -238,12 +738,31 @@ class MainWindow(QtWidgets.QMainWindow):
         """ 
         pos = QtCore.QPoint(20 * self._InstanceNr, 20 * self._InstanceNr)
         windowSize = QtCore.QSize(1024, 700)
+
+        settings = QtCore.QSettings()
+        self.lowMemoryAction.setChecked(
+            not reset and settings.value("low_memory", False, type=bool))
+        self.setFilterWorkers(1 if reset else settings.value("filter_workers", 1, type=int))
+        self._compactTime = 0.0 if reset else settings.value("compact_time", 0.0, type=float)
+        self._pathNormalizer = PathNormalizer()
+        if not reset:
+            try:
+                self._pathNormalizer = PathNormalizer(
+                    prefixMap=[parsePrefixRule(rule) for rule in settings.value(
+                        "path_normalization/prefix_map", "", type=str).splitlines()],
+                    stripSitePackages=settings.value(
+                        "path_normalization/strip_site_packages", False, type=bool),
+                    stripDirs=settings.value("path_normalization/strip_dirs", False, type=bool))
+            except ValueError as ex:
+                logger.warning("Ignoring path normalization settings: {}".format(ex))
+        self._storedSettings = dict(lowMemory=self.lowMemoryAction.isChecked(),
+                                    compactTime=self._compactTime,
+                                    pathNormalizer=self._pathNormalizer)
         
         if reset:
             logger.debug("Resetting persistent view settings")
         else:
             logger.debug("Reading view settings for window: {:d}".format(self._InstanceNr))
-            settings = QtCore.QSettings()
             settings.beginGroup(self._settingsGroupName('view'))
             pos = settings.value("main_window/pos", pos)
             windowSize = settings.value("main_window/size", windowSize)
@@ -270,6 +789,80 @@ class MainWindow(QtWidgets.QMainWindow):
         settings.setValue("main_window/pos", self.pos())
         settings.setValue("main_window/size", self.size())
         settings.endGroup()
+        settings.setValue("filter_workers", self._statsTableModel.filterWorkers)
+        settings.setValue("low_memory", self._storedSettings['lowMemory'])
+        settings.setValue("compact_time", self._storedSettings['compactTime'])
+        pathNormalizer = self._storedSettings['pathNormalizer']
+        settings.setValue("path_normalization/prefix_map", "\n".join(
+            "{}={}".format(old, new) for old, new in pathNormalizer.prefixMap))
+        settings.setValue("path_normalization/strip_site_packages",
+                          pathNormalizer.stripSitePackages)
+        settings.setValue("path_normalization/strip_dirs", pathNormalizer.stripDirs)
+
+
+    def _onCurrentRowChanged(self, current, _previous):
+        """ Shows the source code of the function in the current row and selects it in the
+            call graph.
+        """
+        statRow = self._statsTableModel.itemAtIndex(current)
+        if statRow is None:
+            self.sourcePane.showStatRow(None, [])
+        else:
+            self.sourcePane.showStatRow(
+                statRow, self._statsTableModel.statRowsForFile(statRow.filePath))
+        self.callGraphPane.setCurrentStatRow(statRow)
+
+
+    def showQuickOpen(self):
+        """ Shows the palette that finds a function by fuzzy matching its function or file name.
+        """
+        store = self._statsTableModel.store
+        if store is None:
+            return
+
+        if self._quickOpenDialog is None:
+            self._quickOpenDialog = QuickOpenDialog(parent=self)
+            self._quickOpenDialog.sigFunctionChosen.connect(
+                lambda pos: self.goToFunction(pos, clearFilter=True))
+
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            store.trigramIndex() # Created when first needed, which can take a while.
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        self._quickOpenDialog.setStore(store)
+        self._quickOpenDialog.popUp()
+
+
+    def _releaseQuickOpenStore(self):
+        """ Hides the quick-open palette and makes it release its store. The store of the
+            window is set again when the palette is shown.
+        """
+        if self._quickOpenDialog is not None:
+            self._quickOpenDialog.hide()
+            self._quickOpenDialog.setStore(None)
+
+
+    def goToFunction(self, pos, clearFilter=False):
+        """ Makes the function at position pos of the store the current row.
+
+            If only the top rows are sorted, rows are fetched until the function is found.
+
+            :param clearFilter: if True, the filter is cleared if the function doesn't pass it.
+        """
+        model = self._statsTableModel
+        statRow = model.store.rows[pos]
+        index = model.fetchUntilExposed(statRow)
+        if not index.isValid() and clearFilter and self.filterLineEdit.text():
+            self.filterLineEdit.clear()
+            index = model.fetchUntilExposed(statRow)
+
+        if index.isValid():
+            self.tableView.setCurrentIndex(index)
+            self.tableView.scrollTo(index)
+        else:
+            self.statusBar().showMessage(
+                "{} is not in the filtered rows".format(statRow.functionName), 5000)
 
 
     def updateOccursLabel(self):
@@ -277,7 +870,7 @@ class MainWindow(QtWidgets.QMainWindow):
         """
         if self.filterLineEdit.text():
             self.occursLabel.setText("occurs in {} of {} rows"
-                .format(self._statsTableModel.rowCount(),
+                .format(self._statsTableModel.filteredRowCount(),
                         self._statsTableModel.unfilteredRowCount()))
         else:
             self.occursLabel.setText('in {} rows'.format(
@@ -307,7 +900,18 @@ class MainWindow(QtWidgets.QMainWindow):
         """ Close all windows (e.g. the L0 window).
         """
         logger.debug("closeEvent")
+        TIMING.removeListener(self._onTimingSpanFinished)
+        self._saveSession()
         self._writeViewSettings()
+
+        store = self._statsTableModel.store
+        self._statsTableModel.setStore(None)
+        self.callGraphPane.setStore(None)
+        self._releaseQuickOpenStore()
+        STORE_REGISTRY.release(store)
+        if self in MainWindow._openWindows:
+            MainWindow._openWindows.remove(self)
+
         self.close()
         event.accept()
             
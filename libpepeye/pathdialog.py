@@ -0,0 +1,75 @@
+"""
+    Dialog to edit the path normalization settings.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+
+from .pathnormalizer import PathNormalizer, parsePrefixRule
+from .qt import QtWidgets
+from .utils import check_class
+
+logger = logging.getLogger(__name__)
+
+
+class PathNormalizationDialog(QtWidgets.QDialog):
+    """ Lets the user edit the settings of a PathNormalizer.
+    """
+    def __init__(self, pathNormalizer, parent=None):
+        """ Constructor
+
+            :param pathNormalizer: the PathNormalizer with the initial settings.
+        """
+        super(PathNormalizationDialog, self).__init__(parent=parent)
+        check_class(pathNormalizer, PathNormalizer)
+        self.setWindowTitle("Path Normalization")
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(QtWidgets.QLabel(
+            "Prefix rules, one OLD=NEW rule per line. The first matching rule is applied:"))
+        self.prefixMapEdit = QtWidgets.QPlainTextEdit()
+        self.prefixMapEdit.setPlaceholderText("/opt/venv1/lib=/home/user/.venv/lib")
+        self.prefixMapEdit.setPlainText(
+            "\n".join("{}={}".format(old, new) for old, new in pathNormalizer.prefixMap))
+        layout.addWidget(self.prefixMapEdit)
+
+        self.stripSitePackagesCheckBox = QtWidgets.QCheckBox(
+            "Strip the directories up to and including site-packages")
+        self.stripSitePackagesCheckBox.setChecked(pathNormalizer.stripSitePackages)
+        layout.addWidget(self.stripSitePackagesCheckBox)
+
+        self.stripDirsCheckBox = QtWidgets.QCheckBox(
+            "Strip all directories (only keep the file names)")
+        self.stripDirsCheckBox.setChecked(pathNormalizer.stripDirs)
+        layout.addWidget(self.stripDirsCheckBox)
+
+        buttonBox = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttonBox.accepted.connect(self.accept)
+        buttonBox.rejected.connect(self.reject)
+        layout.addWidget(buttonBox)
+
+
+    def pathNormalizer(self):
+        """ Returns a PathNormalizer with the settings of the dialog.
+
+            Raises a ValueError if a prefix rule is invalid.
+        """
+        lines = self.prefixMapEdit.toPlainText().splitlines()
+        return PathNormalizer(prefixMap=[parsePrefixRule(line.strip())
+                                         for line in lines if line.strip()],
+                              stripSitePackages=self.stripSitePackagesCheckBox.isChecked(),
+                              stripDirs=self.stripDirsCheckBox.isChecked())
+
+
+    def accept(self):
+        """ Closes the dialog if the prefix rules are valid.
+        """
+        try:
+            self.pathNormalizer()
+        except ValueError as ex:
+            QtWidgets.QMessageBox.warning(self, "Invalid prefix rule", str(ex))
+        else:
+            super(PathNormalizationDialog, self).accept()
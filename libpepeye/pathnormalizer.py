@@ -0,0 +1,108 @@
+"""
+    Normalization of the file paths of profiles.
+
+    Profiles that are made in containers, virtual environments or on different hosts refer to
+    the same code by different absolute paths. Normalizing the paths when a profile is loaded
+    makes these rows equal, so that they are merged (see statsstore.normalizeStats).
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import hashlib
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+
+# Matches the part of a path up to and including the site-packages (or dist-packages) directory.
+SITE_PACKAGES_REGEXP = re.compile(r'^.*[/\\](?:site|dist)-packages[/\\]')
+
+
+def parsePrefixRule(rule):
+    """ Parses a prefix mapping rule of the form 'OLD=NEW' into an (old, new) tuple.
+
+        Raises a ValueError if the rule doesn't contain a '=' or the old prefix is empty.
+    """
+    old, sep, new = rule.partition('=')
+    if not sep or not old:
+        raise ValueError("Invalid prefix rule {!r}, expected OLD=NEW".format(rule))
+    return old, new
+
+
+
+class PathNormalizer(object):
+    """ Maps file paths to normalized paths.
+
+        The steps are applied in order:
+            1. prefix mapping: the first rule of which the old prefix matches replaces it with
+               its new prefix.
+            2. site-packages stripping: the part up to and including site-packages/ (or
+               dist-packages/) is removed, e.g. 'numpy/core/numeric.py'.
+            3. directory stripping: only the base name is kept, like pstats.Stats.strip_dirs.
+
+        Paths of built-in functions ('~') and of code without a file (e.g. '<string>') are
+        left as they are. Normalizers with the same settings are equal, so they can be part of
+        a dictionary key.
+    """
+    def __init__(self, prefixMap=(), stripSitePackages=False, stripDirs=False):
+        """ Constructor
+
+            :param prefixMap: sequence of (old prefix, new prefix) tuples.
+            :param stripSitePackages: if True, the site-packages directories are removed.
+            :param stripDirs: if True, only the base names of the files are kept.
+        """
+        self.prefixMap = tuple((old, new) for old, new in prefixMap)
+        self.stripSitePackages = bool(stripSitePackages)
+        self.stripDirs = bool(stripDirs)
+
+
+    def _key(self):
+        return (self.prefixMap, self.stripSitePackages, self.stripDirs)
+
+    def __eq__(self, other):
+        return isinstance(other, PathNormalizer) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "PathNormalizer(prefixMap={!r}, stripSitePackages={!r}, stripDirs={!r})".format(
+            self.prefixMap, self.stripSitePackages, self.stripDirs)
+
+
+    @property
+    def isIdentity(self):
+        """ True if the normalizer doesn't change any path.
+        """
+        return not (self.prefixMap or self.stripSitePackages or self.stripDirs)
+
+
+    def digest(self):
+        """ Returns a short hexadecimal hash of the settings (e.g. to include in a file name).
+        """
+        return hashlib.sha1(repr(self._key()).encode('utf-8')).hexdigest()[:12]
+
+
+    def normalize(self, path):
+        """ Returns the normalized path.
+        """
+        if path == '~' or path.startswith('<'):
+            return path
+
+        for old, new in self.prefixMap:
+            if path.startswith(old):
+                path = new + path[len(old):]
+                break
+
+        if self.stripSitePackages:
+            path = SITE_PACKAGES_REGEXP.sub('', path, count=1)
+
+        if self.stripDirs:
+            path = os.path.basename(path)
+        return path
@@ -0,0 +1,317 @@
+"""
+    Sorting, filtering and comparing the rows of a StatsStore.
+
+    This is the Qt-free layer under the StatsTableModel. It's also used by the HTTP server,
+    so that both show the same rows in the same order.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import heapq
+import itertools
+import logging
+import operator
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .statsstore import SearchIndex, StatRow, makeRowFilter, parseFilterText
+
+logger = logging.getLogger(__name__)
+
+
+# Column name -> sort key function. The names are the StatRow attributes of the columns.
+SORT_KEYS = collections.OrderedDict([
+    ('filePath', StatRow.keyPathAndLine),
+    ('fileName', StatRow.keyFileAndLine),
+    ('functionName', StatRow.keyFunctionName),
+    ('numCalls', StatRow.keyNumCalls),
+    ('time', StatRow.keyTime),
+    ('timePerCall', StatRow.keyTimePerCall),
+    ('numPrimCalls', StatRow.keyNumPrimCalls),
+    ('cumTime', StatRow.keyCumTime),
+    ('cumTimePerCall', StatRow.keyCumTimePerCall),
+    ('recursionDepth', StatRow.keyRecursionDepth),
+    ('recursiveShare', StatRow.keyRecursiveShare),
+    ('parentShare', StatRow.keyParentShare),
+    ('totalPercent', StatRow.keyTotalPercent),
+])
+
+# Column name -> function that returns the value on which the column is ranked for multi-column
+# sorting. Unlike the sort keys these have no tie breakers, so that rows with equal values get
+# the same rank and are ordered by the next sort column.
+RANK_VALUES = collections.OrderedDict(
+    [('filePath', operator.attrgetter('lcFilePath')),
+     ('fileName', operator.attrgetter('lcFileName')),
+     ('functionName', operator.attrgetter('lcFunctionName'))] +
+    [(name, operator.attrgetter(name)) for name in (
+        'numCalls', 'time', 'timePerCall', 'numPrimCalls', 'cumTime', 'cumTimePerCall',
+        'recursionDepth', 'recursiveShare', 'parentShare', 'totalPercent')])
+
+# Name of the rank array that orders the rows that are equal in all sort columns.
+TIE_BREAKER = 'pathAndLine'
+
+# The StatRow attributes that are included in rowToDict.
+ROW_FIELDS = ('filePath', 'fileName', 'lineNr', 'functionName', 'numCalls', 'numPrimCalls',
+              'time', 'timePerCall', 'cumTime', 'cumTimePerCall', 'recursionDepth',
+              'recursiveShare', 'parentShare', 'totalPercent')
+
+# Names of the fields of a caller/callee edge.
+EDGE_FIELDS = ('numCalls', 'numPrimCalls', 'time', 'cumTime')
+
+
+def filterRows(rows, filterText):
+    """ Returns a new list with the rows that pass the filter text.
+
+        See statsstore.parseFilterText for the syntax of the filter text.
+    """
+    rowFilter = makeRowFilter(filterText)
+    if rowFilter is None:
+        return list(rows)
+    return list(filter(rowFilter, rows))
+
+
+_EXECUTORS = {} # number of workers -> ThreadPoolExecutor
+
+
+def isGilEnabled():
+    """ Returns True if the GIL is enabled, i.e. if the filter threads can't run in parallel.
+
+        The GIL is always enabled before Python 3.13. Free-threaded builds can disable it.
+    """
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def _executor(workers):
+    """ Returns the thread pool with the number of workers. Creates it when first needed.
+    """
+    executor = _EXECUTORS.get(workers)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='filter')
+        _EXECUTORS[workers] = executor
+    return executor
+
+
+def searchIndexPositions(index, searchText, workers=1):
+    """ Returns a sorted list with the positions of the rows of a SearchIndex that contain the
+        (lower case) search text. If workers > 1, the chunks are searched by a thread pool.
+    """
+    chunkIndices = range(index.nChunks)
+    if workers > 1 and index.nChunks > 1:
+        chunkResults = _executor(workers).map(
+            index.searchChunk, chunkIndices, itertools.repeat(searchText))
+    else:
+        chunkResults = map(index.searchChunk, chunkIndices, itertools.repeat(searchText))
+    return list(itertools.chain.from_iterable(chunkResults))
+
+
+def filterPositions(store, filterText, workers=1):
+    """ Returns a sorted list with the positions of the rows of the store that pass the
+        filter text. Returns None if the filter text is empty (i.e. all rows pass).
+
+        The search text is found with str.find in the chunks of the store's SearchIndex. If
+        workers > 1, the chunks are searched by a thread pool and the results are merged. Note
+        that str.find holds the GIL in CPython, so the threads only run in parallel on
+        free-threaded Python builds. Numeric conditions are tested on the column arrays of the
+        store.
+
+        See statsstore.parseFilterText for the syntax of the filter text.
+    """
+    searchText, conditions = parseFilterText(filterText)
+    if not searchText and not conditions:
+        return None
+
+    if not searchText:
+        positions = range(len(store))
+    elif any(separator in searchText for separator in SearchIndex.SEPARATORS):
+        rowFilter = makeRowFilter(searchText)
+        positions = [pos for pos, statRow in enumerate(store.rows) if rowFilter(statRow)]
+    else:
+        positions = searchIndexPositions(store.searchIndex(), searchText, workers=workers)
+
+    for attr, op, number in conditions:
+        column = store.column(attr)
+        values = column if isinstance(positions, range) else map(column.__getitem__, positions)
+        positions = list(itertools.compress(positions, map(op, values, itertools.repeat(number))))
+    return list(positions)
+
+
+def filterStoreRows(store, filterText, workers=1):
+    """ Returns a new list with the rows of the store that pass the filter text, in the order
+        of the store. See filterPositions.
+    """
+    positions = filterPositions(store, filterText, workers=workers)
+    if positions is None:
+        return list(store.rows)
+    return list(map(store.rows.__getitem__, positions))
+
+
+def sortedPrefix(rows, nRows, key, reverse=False):
+    """ Returns a list with the first nRows of the rows when sorted with the key function.
+
+        Uses a partial (heap) selection if nRows is small compared to the number of rows.
+        Otherwise the rows, which must be a list then, are sorted in-place and returned as a
+        whole (so the result can contain more than nRows rows).
+    """
+    if nRows * 4 < len(rows):
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(nRows, rows, key=key)
+    else:
+        rows.sort(key=key, reverse=reverse)
+        return rows
+
+
+def sortKey(columnName):
+    """ Returns the sort key function of a column. Raises a ValueError for unknown columns.
+    """
+    try:
+        return SORT_KEYS[columnName]
+    except KeyError:
+        raise ValueError("Unknown column {!r}. Must be one of: {}"
+                         .format(columnName, ", ".join(SORT_KEYS)))
+
+
+def parseSortSpec(sortSpec):
+    """ Parses a comma separated list of column names into a list of (name, descending)
+        tuples. A name that is prefixed with a minus sign is sorted in descending order.
+
+        E.g. 'fileName,-cumTime,numCalls'. Raises a ValueError for unknown columns.
+    """
+    result = []
+    for name in sortSpec.split(','):
+        name = name.strip()
+        descending = name.startswith('-')
+        name = name.lstrip('-+')
+        sortKey(name) # Raises ValueError for unknown columns
+        result.append((name, descending))
+    return result
+
+
+def rankArray(store, name):
+    """ Returns the rank array of a column (see RANK_VALUES) or of the TIE_BREAKER.
+    """
+    if name == TIE_BREAKER:
+        return store.rankArray(name, StatRow.keyPathAndLine)
+    return store.rankArray(name, RANK_VALUES[name])
+
+
+def lexSort(positions, rankArrays, reverseFlags):
+    """ Sorts a list of row positions in-place on several rank arrays, the first one being
+        the most significant.
+
+        Does a stable sort per rank array, from the least to the most significant one. The
+        keys are lookups in the arrays, so an extra sort column costs no Python code per row.
+    """
+    for ranks, reverse in reversed(list(zip(rankArrays, reverseFlags))):
+        positions.sort(key=ranks.__getitem__, reverse=reverse)
+
+
+def sortedPositions(positions, nRows, rankArrays, reverseFlags):
+    """ Returns a list with the first nRows of the row positions when sorted on several rank
+        arrays, the first one being the most significant. The list can contain more positions.
+
+        If nRows is small compared to the number of positions, a partial (heap) selection on
+        the first rank array finds the rank of row nRows. Only the positions up to that rank
+        are sorted then, with lexSort. Otherwise the positions, which must be a list then, are
+        sorted in-place and returned as a whole.
+    """
+    if nRows * 4 < len(positions) and nRows > 0:
+        ranks, reverse = rankArrays[0], reverseFlags[0]
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        lastRank = ranks[select(nRows, positions, key=ranks.__getitem__)[-1]]
+        withinRank = operator.ge if reverse else operator.le
+        positions = list(itertools.compress(positions, map(
+            withinRank, map(ranks.__getitem__, positions), itertools.repeat(lastRank))))
+
+    lexSort(positions, rankArrays, reverseFlags)
+    return positions
+
+
+def rowToDict(statRow):
+    """ Returns a dictionary with the ROW_FIELDS of the StatRow.
+    """
+    return {field: getattr(statRow, field) for field in ROW_FIELDS}
+
+
+def edgeToDict(edge):
+    """ Returns a dictionary with the EDGE_FIELDS of a (nc, cc, tt, ct) edge tuple.
+    """
+    return dict(zip(EDGE_FIELDS, edge))
+
+
+
+class RowDiff(object):
+    """ Difference of a function between a base profile and another profile.
+
+        The baseRow or row is None if the function only occurs in one of the profiles. The
+        deltas are the value in the other profile minus the value in the base profile.
+    """
+    __slots__ = ('key', 'baseRow', 'row')
+
+    def __init__(self, key, baseRow, row):
+        """ Constructor
+        """
+        self.key = key
+        self.baseRow = baseRow
+        self.row = row
+
+    def _delta(self, attr):
+        newValue = getattr(self.row, attr) if self.row is not None else 0
+        baseValue = getattr(self.baseRow, attr) if self.baseRow is not None else 0
+        return newValue - baseValue
+
+    @property
+    def deltaNumCalls(self):
+        return self._delta('numCalls')
+
+    @property
+    def deltaTime(self):
+        return self._delta('time')
+
+    @property
+    def deltaCumTime(self):
+        return self._delta('cumTime')
+
+    def toDict(self):
+        """ Returns the difference as a dictionary (e.g. for JSON).
+        """
+        return {'filePath': self.key[0], 'lineNr': self.key[1], 'functionName': self.key[2],
+                'base': None if self.baseRow is None else rowToDict(self.baseRow),
+                'other': None if self.row is None else rowToDict(self.row),
+                'deltaNumCalls': self.deltaNumCalls, 'deltaTime': self.deltaTime,
+                'deltaCumTime': self.deltaCumTime}
+
+
+# Delta name -> sort key function. Differences are sorted on their absolute value.
+DIFF_SORT_KEYS = collections.OrderedDict([
+    ('deltaCumTime', lambda rowDiff: abs(rowDiff.deltaCumTime)),
+    ('deltaTime', lambda rowDiff: abs(rowDiff.deltaTime)),
+    ('deltaNumCalls', lambda rowDiff: abs(rowDiff.deltaNumCalls)),
+])
+
+
+def diffRows(baseRows, rows):
+    """ Returns a list of RowDiffs with the differences between two sequences of StatRows.
+
+        Functions are matched on their (file, line_nr, function) key. Functions that are equal
+        in both sequences are left out.
+    """
+    baseRowOfKey = {baseRow.key: baseRow for baseRow in baseRows}
+    result = []
+    for statRow in rows:
+        baseRow = baseRowOfKey.pop(statRow.key, None)
+        if (baseRow is None or baseRow.numCalls != statRow.numCalls or
+                baseRow.time != statRow.time or baseRow.cumTime != statRow.cumTime):
+            result.append(RowDiff(statRow.key, baseRow, statRow))
+
+    for key, baseRow in baseRowOfKey.items(): # The remaining base rows are not in rows.
+        result.append(RowDiff(key, baseRow, None))
+    return result
+
+
+def diffStores(baseStore, store):
+    """ Returns a list of RowDiffs with the differences between two stores.
+    """
+    return diffRows(baseStore.rows, store.rows)
@@ -0,0 +1,165 @@
+"""
+    Quick-open palette that finds functions by fuzzy matching their function or file names.
+
+    The matching and ranking is done by fuzzy.py.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import logging
+import time
+
+from .fuzzy import FuzzySearch
+from .qt import Qt, QtCore, QtWidgets, QtSignal
+from .statsstore import StatsStore
+from .utils import check_class
+
+logger = logging.getLogger(__name__)
+
+
+class QuickOpenDialog(QtWidgets.QDialog):
+    """ Palette with a line edit and a list of the best matching functions.
+
+        The search runs in slices of at most TIME_BUDGET seconds per event loop iteration, so
+        that typing is never blocked. The list is refreshed while the search continues.
+    """
+    sigFunctionChosen = QtSignal(int) # Emitted with the row position of the chosen function
+
+    MAX_RESULTS = 50
+    TIME_BUDGET = 0.002     # seconds that are searched per event loop iteration
+    REFRESH_INTERVAL = 0.05 # seconds between refreshes of the list during a search
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(QuickOpenDialog, self).__init__(parent=parent)
+        self.setWindowTitle("Go to Function")
+        self.resize(600, 400)
+
+        self._store = None
+        self._search = None  # The FuzzySearch of the current text
+        self._lastRefresh = 0.0
+
+        layout = QtWidgets.QVBoxLayout(self)
+        self.lineEdit = QtWidgets.QLineEdit()
+        self.lineEdit.setPlaceholderText("Function or file name...")
+        self.lineEdit.installEventFilter(self)
+        layout.addWidget(self.lineEdit)
+
+        self.resultList = QtWidgets.QListWidget()
+        self.resultList.setUniformItemSizes(True)
+        self.resultList.setFocusPolicy(Qt.NoFocus)
+        layout.addWidget(self.resultList)
+
+        self.statusLabel = QtWidgets.QLabel("")
+        layout.addWidget(self.statusLabel)
+
+        self._searchTimer = QtCore.QTimer(self)
+        self._searchTimer.setInterval(0)
+        self._searchTimer.timeout.connect(self._continueSearch)
+
+        self.lineEdit.textChanged.connect(self._startSearch)
+        self.lineEdit.returnPressed.connect(self.accept)
+        self.resultList.itemActivated.connect(self.accept)
+
+
+    def setStore(self, store):
+        """ Sets the store of which the functions are searched. Its trigram index must exist
+            (see StatsStore.trigramIndex), because it can take a while to create.
+        """
+        check_class(store, StatsStore, allow_none=True)
+        if store is not self._store:
+            self._store = store
+            self._startSearch(self.lineEdit.text())
+
+
+    def popUp(self):
+        """ Shows the dialog with the previous text selected.
+        """
+        self.lineEdit.selectAll()
+        self.lineEdit.setFocus()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+
+    def eventFilter(self, watched, event):
+        """ Moves through the results with the arrow and page keys while typing.
+        """
+        if (watched is self.lineEdit and event.type() == QtCore.QEvent.KeyPress and
+                event.key() in (Qt.Key_Up, Qt.Key_Down, Qt.Key_PageUp, Qt.Key_PageDown)):
+            QtWidgets.QApplication.sendEvent(self.resultList, event)
+            return True
+        return super(QuickOpenDialog, self).eventFilter(watched, event)
+
+
+    def _startSearch(self, text):
+        """ Starts a new search for the text. The previous search is abandoned.
+        """
+        self._searchTimer.stop()
+        if self._store is None:
+            self._search = None
+            self._showResults()
+            return
+        self._search = FuzzySearch(self._store.trigramIndex(), text, maxResults=self.MAX_RESULTS)
+        self._lastRefresh = 0.0
+        self._continueSearch()
+
+
+    def _continueSearch(self):
+        """ Searches for at most TIME_BUDGET seconds. Refreshes the list when done, or at most
+            once per REFRESH_INTERVAL while searching.
+        """
+        done = self._search.advance(self.TIME_BUDGET)
+        if done:
+            self._searchTimer.stop()
+        else:
+            self._searchTimer.start()
+
+        now = time.perf_counter()
+        if done or now - self._lastRefresh >= self.REFRESH_INTERVAL:
+            self._lastRefresh = now
+            self._showResults()
+
+
+    def _showResults(self):
+        """ Fills the list with the results of the search so far. The current result stays
+            current if it's still in the list.
+        """
+        currentItem = self.resultList.currentItem()
+        currentPos = None if currentItem is None else currentItem.data(Qt.UserRole)
+        self.resultList.clear()
+        if self._search is None:
+            self.statusLabel.setText("No profile")
+            return
+
+        rows = self._store.rows
+        for _score, pos in self._search.results():
+            statRow = rows[pos]
+            item = QtWidgets.QListWidgetItem("{}    {}:{}    Σ {:.3f} s".format(
+                statRow.functionName, statRow.fileName, statRow.lineNr, statRow.cumTime))
+            item.setData(Qt.UserRole, pos)
+            item.setToolTip(statRow.filePath)
+            self.resultList.addItem(item)
+            if pos == currentPos:
+                self.resultList.setCurrentItem(item)
+
+        if self.resultList.currentItem() is None and self.resultList.count():
+            self.resultList.setCurrentRow(0)
+        if not self._search.done:
+            self.statusLabel.setText("Searching...")
+        elif self._search.query:
+            self.statusLabel.setText("{} results".format(self.resultList.count()))
+        else:
+            self.statusLabel.setText("Type a part of a function or file name")
+
+
+    def accept(self):
+        """ Emits sigFunctionChosen for the current result and closes the dialog.
+        """
+        item = self.resultList.currentItem()
+        if item is None:
+            return
+        self.sigFunctionChosen.emit(item.data(Qt.UserRole))
+        super(QuickOpenDialog, self).accept()
@@ -0,0 +1,230 @@
+"""
+    Statistical (sampling) profiler.
+
+    A background thread takes samples of the call stacks of the other threads at a fixed
+    frequency. The samples are folded into per-function self and total counts plus caller edges,
+    and are written in the pstats format, so that they can be browsed like cProfile output.
+
+    The overhead is bounded by the sampling frequency and the stack depth, and does not depend
+    on the number of function calls of the profiled program.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import logging
+import marshal
+import os
+import runpy
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FREQUENCY = 100 # samples per second
+
+
+class Sampler(object):
+    """ Takes samples of the call stacks of all threads from a background thread.
+
+        In the resulting statistics the number of calls of a function is the number of samples
+        in which it was on the stack. The time is the number of samples in which the function
+        was at the top of the stack, multiplied by the mean sampling interval. The cumulative
+        time is the number of calls multiplied by the mean sampling interval.
+    """
+    def __init__(self, frequency=DEFAULT_FREQUENCY, stopFrame=None, hiddenFiles=()):
+        """ Constructor
+
+            :param frequency: number of samples per second.
+            :param stopFrame: if given, this frame and its callers are not included in the
+                samples of its thread (e.g. the frame that starts the profiled code).
+            :param hiddenFiles: file names of code that is left out at the bottom of the stacks,
+                i.e. between the stop frame and the profiled code (e.g. the runpy module).
+        """
+        if frequency <= 0:
+            raise ValueError("frequency must be positive, got: {}".format(frequency))
+
+        self.frequency = frequency
+        self._stopFrame = stopFrame
+        self._hiddenFiles = frozenset(hiddenFiles)
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._startTime = None
+        self._stopTime = None
+
+        # Counts are indexed by code object, which is cheaper than creating key tuples.
+        self.nSamples = 0
+        self._selfCounts = collections.Counter()  # code -> samples at the top of the stack
+        self._totalCounts = collections.Counter() # code -> samples on the stack
+        self._edgeSelfCounts = collections.Counter()  # (caller, callee) -> samples
+        self._edgeTotalCounts = collections.Counter() # (caller, callee) -> samples
+
+
+    def start(self):
+        """ Starts sampling in a background thread.
+        """
+        if self._thread is not None:
+            raise RuntimeError("Sampler is already started.")
+        logger.debug("Starting sampler at {} Hz".format(self.frequency))
+        self._stopEvent.clear()
+        self._startTime = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='pepeye-sampler', daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """ Stops sampling and waits for the background thread to finish.
+        """
+        if self._thread is None:
+            return
+        self._stopEvent.set()
+        self._thread.join()
+        self._thread = None
+        self._stopTime = time.perf_counter()
+        logger.debug("Sampler stopped after {} samples".format(self.nSamples))
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+        return False
+
+
+    def _run(self):
+        """ Takes samples until stop is called.
+        """
+        interval = 1.0 / self.frequency
+        ownThreadId = threading.get_ident()
+        while not self._stopEvent.wait(interval):
+            self._takeSample(ownThreadId)
+
+
+    def _takeSample(self, ownThreadId):
+        """ Takes one sample of the stacks of all threads except the sampler thread.
+        """
+        stopFrame = self._stopFrame
+        hiddenFiles = self._hiddenFiles
+        selfCounts = self._selfCounts
+        totalCounts = self._totalCounts
+        edgeSelfCounts = self._edgeSelfCounts
+        edgeTotalCounts = self._edgeTotalCounts
+
+        for threadId, frame in sys._current_frames().items():
+            if threadId == ownThreadId:
+                continue
+
+            stack = []  # from the top of the stack (the running function) to the bottom
+            while frame is not None and frame is not stopFrame:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            while stack and stack[-1].co_filename in hiddenFiles:
+                stack.pop()
+            if not stack:
+                continue
+
+            # Recursive functions are counted once per sample, as cProfile does for cumtime.
+            selfCounts[stack[0]] += 1
+            totalCounts.update(set(stack))
+            edges = set(zip(stack[1:], stack[:-1]))
+            edgeTotalCounts.update(edges)
+            if len(stack) > 1:
+                edgeSelfCounts[(stack[1], stack[0])] += 1
+
+        self.nSamples += 1
+
+
+    @property
+    def meanInterval(self):
+        """ The mean time between two samples in seconds.
+
+            This is measured rather than derived from the frequency because sampling overhead and
+            timer granularity make the real interval somewhat longer.
+        """
+        stopTime = self._stopTime if self._stopTime is not None else time.perf_counter()
+        if not self.nSamples or self._startTime is None:
+            return 1.0 / self.frequency
+        return (stopTime - self._startTime) / self.nSamples
+
+
+    def statsDict(self):
+        """ Returns the samples as a dictionary in the pstats format.
+
+            The keys are (file, line_nr, function) tuples and the values consist of a
+            (primitive_calls, n_calls, time, cumulative_time, caller_dict) tuple.
+
+            Distinct code objects with the same key (e.g. a lambda that is created again by
+            exec or a module reload) are merged: their counts are summed.
+        """
+        interval = self.meanInterval
+
+        def codeKey(code):
+            return (code.co_filename, code.co_firstlineno, code.co_name)
+
+        # callee key -> caller key -> [total samples, self samples]
+        edgeCounts = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+        for (caller, callee), count in self._edgeTotalCounts.items():
+            counts = edgeCounts[codeKey(callee)][codeKey(caller)]
+            counts[0] += count
+            counts[1] += self._edgeSelfCounts.get((caller, callee), 0)
+
+        totalCounts = collections.Counter() # key -> samples on the stack
+        selfCounts = collections.Counter()  # key -> samples at the top of the stack
+        for code, count in self._totalCounts.items():
+            key = codeKey(code)
+            totalCounts[key] += count
+            selfCounts[key] += self._selfCounts.get(code, 0)
+
+        stats = {}
+        for key, count in totalCounts.items():
+            callers = {callerKey: (total, total, nSelf * interval, total * interval)
+                       for callerKey, (total, nSelf) in edgeCounts.get(key, {}).items()}
+            stats[key] = (count, count, selfCounts[key] * interval, count * interval, callers)
+        return stats
+
+
+    def dumpStats(self, fileName):
+        """ Writes the samples to a file in the pstats (marshal) format.
+        """
+        logger.info("Saving {} samples to: {}".format(self.nSamples, fileName))
+        with open(fileName, 'wb') as fileObj:
+            marshal.dump(self.statsDict(), fileObj)
+
+
+
+def recordScript(args, outFileName, frequency=DEFAULT_FREQUENCY, isModule=False):
+    """ Runs a Python script or module while sampling it, and writes the samples to a file.
+
+        :param args: list with the script path (or module name) followed by its arguments.
+        :param outFileName: name of the pstats file that is written.
+        :param frequency: number of samples per second.
+        :param isModule: if True, args[0] is the name of a module that is run as __main__.
+        :returns: the Sampler.
+    """
+    target = args[0]
+    savedArgv = sys.argv
+    savedPath = list(sys.path)
+    sys.argv = list(args)
+    if not isModule:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(target)))
+
+    # The runpy functions that start the script would otherwise be the roots of all stacks.
+    sampler = Sampler(frequency=frequency, stopFrame=sys._getframe(),
+                      hiddenFiles=[runpy.run_path.__code__.co_filename])
+    sampler.start()
+    try:
+        if isModule:
+            runpy.run_module(target, run_name='__main__', alter_sys=True)
+        else:
+            runpy.run_path(target, run_name='__main__')
+    finally:
+        sampler.stop()
+        sys.argv = savedArgv
+        sys.path[:] = savedPath
+        sampler.dumpStats(outFileName)
+
+    return sampler
@@ -0,0 +1,420 @@
+"""
+    Local HTTP server that serves profiles as JSON.
+
+    Serves the sorted and filtered rows, the callers and callees, the pruned call graph and the
+    differences between profiles. Only uses the standard library (asyncio) and doesn't depend
+    on Qt. The profiles are loaded once when the server starts.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import urllib.parse
+
+from .callgraph import CallGraph, DEFAULT_THRESHOLD, MAX_NODES
+from .query import (DIFF_SORT_KEYS, SORT_KEYS, TIE_BREAKER, diffStores, edgeToDict,
+                    filterPositions, rankArray, rowToDict, sortedPositions, sortedPrefix)
+from .statsstore import STORE_REGISTRY
+from .version import PROGRAM_NAME, PROGRAM_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8017
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 10000
+
+HTTP_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 500: "Internal Server Error"}
+
+ENDPOINTS = collections.OrderedDict([
+    ('/api/profiles', "The served profiles"),
+    ('/api/rows', "Rows. Parameters: profile, filter, sort, order (asc/desc), offset, limit"),
+    ('/api/rows/ID', "One row. Parameters: profile"),
+    ('/api/rows/ID/callers', "Callers of a row with the call statistics. Parameters: profile"),
+    ('/api/rows/ID/callees', "Callees of a row with the call statistics. Parameters: profile"),
+    ('/api/callgraph', "Pruned call graph. Parameters: profile, threshold (percent), maxNodes"),
+    ('/api/diff', "Differences between two profiles. Parameters: base, profile, sort, offset, "
+                  "limit"),
+])
+
+
+class HttpError(Exception):
+    """ Error that is returned to the client with an HTTP status code.
+    """
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+
+class ProfileServer(object):
+    """ Serves one or more profiles as JSON.
+
+        The data never changes while the server runs. Therefore the responses are cached and
+        identified by an ETag, which is derived from the content hashes of the profiles and
+        the request. Requests are handled one at a time by the event loop, so that concurrent
+        requests for the same data compute it only once.
+    """
+    MAX_CACHED_RESPONSES = 256
+    MAX_CACHED_ORDERS = 16
+
+    def __init__(self, fileNames, pathNormalizer=None):
+        """ Constructor. Loads the profiles.
+
+            :param fileNames: the pstats files. They are referred to by their index in this list.
+            :param pathNormalizer: if not None, a PathNormalizer for the file paths of all
+                profiles. Useful to compare profiles of the same code in different directories.
+        """
+        if not fileNames:
+            raise ValueError("At least one profile is required.")
+        self.fileNames = list(fileNames)
+        self._stores = [STORE_REGISTRY.acquire(fileName, pathNormalizer=pathNormalizer)
+                        for fileName in self.fileNames]
+        self._storesHash = hashlib.blake2b(
+            "".join(store.contentHash for store in self._stores).encode('ascii'),
+            digest_size=16).hexdigest()
+
+        self._callGraphs = {}                       # profile index -> CallGraph
+        self._diffs = {}                            # (base, profile) -> list of RowDiffs
+        self._filtered = collections.OrderedDict()  # (profile, filter) -> list of positions
+        self._orders = collections.OrderedDict()    # (profile, filter, sort, desc) -> rows
+        self._responses = collections.OrderedDict() # ETag -> response body
+
+
+    def close(self):
+        """ Releases the profiles.
+        """
+        for store in self._stores:
+            STORE_REGISTRY.release(store)
+        self._stores = []
+
+
+    def run(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """ Runs the server until it's interrupted.
+        """
+        try:
+            asyncio.run(self.serve(host, port))
+        finally:
+            self.close()
+
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """ Coroutine that serves requests until it's cancelled.
+        """
+        server = await asyncio.start_server(self._handleConnection, host, port)
+        logger.info("Serving {} profiles on {}:{}".format(len(self._stores), host, port))
+        async with server:
+            await server.serve_forever()
+
+
+    async def _handleConnection(self, reader, writer):
+        """ Reads one request from the connection and writes the response.
+        """
+        try:
+            requestLine = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if len(requestLine) != 3:
+                status, etag, body = 400, None, self._errorBody("Invalid request line")
+                method = 'GET'
+            else:
+                method, target, _version = requestLine
+                status, etag, body = self.handleRequest(method, target,
+                                                        headers.get('if-none-match'))
+                logger.debug("{} {} -> {}".format(method, target, status))
+
+            responseHeaders = ["HTTP/1.1 {} {}".format(status, HTTP_REASONS.get(status, "")),
+                               "Server: {}/{}".format(PROGRAM_NAME, PROGRAM_VERSION),
+                               "Content-Type: application/json; charset=utf-8",
+                               "Content-Length: {}".format(len(body)),
+                               "Cache-Control: no-cache",
+                               "Connection: close"]
+            if etag is not None:
+                responseHeaders.append("ETag: {}".format(etag))
+            writer.write(("\r\n".join(responseHeaders) + "\r\n\r\n").encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except ConnectionError as ex:
+            logger.debug("Connection error: {}".format(ex))
+        finally:
+            writer.close()
+
+
+    @staticmethod
+    def _errorBody(message):
+        return json.dumps({'error': message}).encode('utf-8')
+
+
+    def handleRequest(self, method, target, ifNoneMatch=None):
+        """ Handles a request and returns a (status, ETag, body) tuple.
+
+            :param method: HTTP method. Only GET and HEAD are supported.
+            :param target: the path and query of the request.
+            :param ifNoneMatch: value of the If-None-Match header (if any).
+        """
+        if method not in ('GET', 'HEAD'):
+            return 405, None, self._errorBody("Method not allowed: {}".format(method))
+
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.rstrip('/') or '/'
+        etag = '"{}"'.format(hashlib.blake2b(
+            json.dumps([self._storesHash, path, sorted(params.items())]).encode('utf-8'),
+            digest_size=16).hexdigest())
+
+        if ifNoneMatch is not None and etag in [tag.strip() for tag in ifNoneMatch.split(',')]:
+            return 304, etag, b''
+
+        body = self._responses.get(etag)
+        if body is not None:
+            self._responses.move_to_end(etag)
+            return 200, etag, body
+
+        try:
+            result = self._route(path, params)
+        except HttpError as ex:
+            return ex.status, None, self._errorBody(str(ex))
+        except Exception as ex:
+            logger.exception("Error handling request: {}".format(target))
+            return 500, None, self._errorBody(str(ex))
+
+        body = json.dumps(result).encode('utf-8')
+        self._responses[etag] = body
+        if len(self._responses) > self.MAX_CACHED_RESPONSES:
+            self._responses.popitem(last=False)
+        return 200, etag, body
+
+
+    def _route(self, path, params):
+        """ Returns the result of a request as a JSON serializable object.
+        """
+        parts = path.strip('/').split('/')
+        if parts in ([''], ['api']):
+            return {'name': PROGRAM_NAME, 'version': PROGRAM_VERSION, 'endpoints': ENDPOINTS}
+        if parts[0] != 'api':
+            raise HttpError(404, "Not found: {}".format(path))
+
+        if parts[1:] == ['profiles']:
+            return [{'profile': idx, 'fileName': store.fileName, 'contentHash': store.contentHash,
+                     'nRows': len(store), 'totalTime': store.totalTime}
+                    for idx, store in enumerate(self._stores)]
+        elif parts[1:] == ['rows']:
+            return self._rows(params)
+        elif len(parts) == 3 and parts[1] == 'rows':
+            store = self._store(params, 'profile')
+            return self._rowResult(store, self._rowPosition(store, parts[2]))
+        elif len(parts) == 4 and parts[1] == 'rows' and parts[3] in ('callers', 'callees'):
+            return self._edges(params, parts[2], parts[3])
+        elif parts[1:] == ['callgraph']:
+            return self._callGraph(params)
+        elif parts[1:] == ['diff']:
+            return self._diff(params)
+        else:
+            raise HttpError(404, "Not found: {}".format(path))
+
+
+    def _profileIndex(self, params, name, default=0):
+        """ Returns the index of the profile given by a parameter.
+        """
+        idx = _intParameter(params, name, default)
+        if not 0 <= idx < len(self._stores):
+            raise HttpError(404, "No profile {}".format(idx))
+        return idx
+
+
+    def _store(self, params, name, default=0):
+        """ Returns the store of the profile given by a parameter.
+        """
+        return self._stores[self._profileIndex(params, name, default)]
+
+
+    @staticmethod
+    def _rowPosition(store, rowId):
+        """ Returns the position of the row with an ID (as string) in the store.
+        """
+        try:
+            pos = int(rowId)
+        except ValueError:
+            raise HttpError(400, "Invalid row ID: {!r}".format(rowId))
+        if not 0 <= pos < len(store):
+            raise HttpError(404, "No row {}".format(pos))
+        return pos
+
+
+    @staticmethod
+    def _rowResult(store, pos):
+        """ Returns the row at a position as a dictionary that includes its ID.
+        """
+        result = rowToDict(store.rows[pos])
+        result['id'] = pos
+        return result
+
+
+    def _sortedRows(self, idx, filterText, sortName, descending, nRows):
+        """ Returns the first nRows (or more) filtered rows of a profile in the sort order.
+
+            Sorted rows are cached. The positions of the rows are sorted on the rank arrays of
+            the store (see query.sortedPositions), so a prefix that is small compared to the
+            number of filtered rows is selected with a heap instead of sorting all rows.
+        """
+        store = self._stores[idx]
+        filterKey = (idx, filterText)
+        filtered = self._filtered.get(filterKey)
+        if filtered is None:
+            filtered = filterPositions(store, filterText)
+            if filtered is None:
+                filtered = range(len(store))
+            self._filtered[filterKey] = filtered
+            if len(self._filtered) > self.MAX_CACHED_ORDERS:
+                self._filtered.popitem(last=False)
+
+        orderKey = (idx, filterText, sortName, descending)
+        ordered = self._orders.get(orderKey)
+        if ordered is not None:
+            self._orders.move_to_end(orderKey)
+            return filtered, ordered
+
+        # Rows with equal values are ordered by path and line number, also when descending.
+        rankArrays = [rankArray(store, sortName), rankArray(store, TIE_BREAKER)]
+        if nRows * 4 < len(filtered):
+            positions = sortedPositions(list(filtered), nRows, rankArrays, [descending, False])
+            return filtered, list(map(store.rows.__getitem__, positions))
+
+        positions = sortedPositions(list(filtered), len(filtered), rankArrays, [descending, False])
+        ordered = list(map(store.rows.__getitem__, positions))
+        self._orders[orderKey] = ordered
+        if len(self._orders) > self.MAX_CACHED_ORDERS:
+            self._orders.popitem(last=False)
+        return filtered, ordered
+
+
+    def _rows(self, params):
+        """ Returns a page of the sorted and filtered rows.
+        """
+        idx = self._profileIndex(params, 'profile')
+        store = self._stores[idx]
+        filterText = params.get('filter', '')
+        sortName = params.get('sort', 'cumTime')
+        if sortName not in SORT_KEYS:
+            raise HttpError(400, "Unknown sort column {!r}. Must be one of: {}"
+                            .format(sortName, ", ".join(SORT_KEYS)))
+        descending = _orderParameter(params)
+        offset, limit = _pageParameters(params)
+
+        filtered, ordered = self._sortedRows(idx, filterText, sortName, descending, offset + limit)
+        position = store.position
+        rows = []
+        for statRow in ordered[offset:offset + limit]:
+            row = rowToDict(statRow)
+            row['id'] = position(statRow.key)
+            rows.append(row)
+
+        return {'profile': idx, 'filter': filterText, 'sort': sortName,
+                'order': 'desc' if descending else 'asc', 'total': len(filtered),
+                'offset': offset, 'limit': limit, 'rows': rows}
+
+
+    def _edges(self, params, rowId, direction):
+        """ Returns the callers or callees of a row, ordered by the cumulative time of the call.
+        """
+        store = self._store(params, 'profile')
+        pos = self._rowPosition(store, rowId)
+        edges = store.callers(pos) if direction == 'callers' else store.callees(pos)
+        edges = sorted(edges, key=lambda posAndEdge: posAndEdge[1][3], reverse=True)
+        return {'row': self._rowResult(store, pos),
+                direction: [{'row': self._rowResult(store, otherPos), 'edge': edgeToDict(edge)}
+                            for otherPos, edge in edges]}
+
+
+    def _callGraph(self, params):
+        """ Returns the nodes and edges of the call graph that survive the threshold.
+        """
+        idx = self._profileIndex(params, 'profile')
+        threshold = _floatParameter(params, 'threshold', 100 * DEFAULT_THRESHOLD) / 100
+        maxNodes = min(_intParameter(params, 'maxNodes', MAX_NODES), MAX_LIMIT)
+        if maxNodes < 1:
+            raise HttpError(400, "Parameter maxNodes must be >= 1")
+
+        if idx not in self._callGraphs:
+            self._callGraphs[idx] = CallGraph(self._stores[idx])
+        graph = self._callGraphs[idx]
+        nodes, edges = graph.prune(threshold, maxNodes)
+
+        return {'profile': idx, 'threshold': 100 * threshold, 'totalTime': graph.totalTime,
+                'nodes': [self._rowResult(graph.store, pos) for pos in nodes],
+                'edges': [{'caller': callerPos, 'callee': calleePos, 'edge': edgeToDict(edge)}
+                          for callerPos, calleePos, edge in edges]}
+
+
+    def _diff(self, params):
+        """ Returns a page of the differences between two profiles, largest first.
+        """
+        baseIdx = self._profileIndex(params, 'base', 0)
+        idx = self._profileIndex(params, 'profile', min(1, len(self._stores) - 1))
+        sortName = params.get('sort', 'deltaCumTime')
+        if sortName not in DIFF_SORT_KEYS:
+            raise HttpError(400, "Unknown sort {!r}. Must be one of: {}"
+                            .format(sortName, ", ".join(DIFF_SORT_KEYS)))
+        offset, limit = _pageParameters(params)
+
+        diffs = self._diffs.get((baseIdx, idx))
+        if diffs is None:
+            diffs = diffStores(self._stores[baseIdx], self._stores[idx])
+            self._diffs[(baseIdx, idx)] = diffs
+
+        ordered = sortedPrefix(list(diffs), offset + limit, DIFF_SORT_KEYS[sortName], True)
+        return {'base': baseIdx, 'profile': idx, 'sort': sortName, 'total': len(diffs),
+                'offset': offset, 'limit': limit,
+                'rows': [rowDiff.toDict() for rowDiff in ordered[offset:offset + limit]]}
+
+
+
+def _intParameter(params, name, default):
+    """ Returns a parameter as an integer
+    """
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise HttpError(400, "Parameter {} must be an integer".format(name))
+
+
+def _floatParameter(params, name, default):
+    """ Returns a parameter as a float
+    """
+    try:
+        return float(params.get(name, default))
+    except ValueError:
+        raise HttpError(400, "Parameter {} must be a number".format(name))
+
+
+def _orderParameter(params):
+    """ Returns True if the order parameter is 'desc' (the default), False if it's 'asc'.
+    """
+    order = params.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise HttpError(400, "Parameter order must be 'asc' or 'desc'")
+    return order == 'desc'
+
+
+def _pageParameters(params):
+    """ Returns the (offset, limit) of a page.
+    """
+    offset = _intParameter(params, 'offset', 0)
+    limit = _intParameter(params, 'limit', DEFAULT_LIMIT)
+    if offset < 0 or not 0 < limit <= MAX_LIMIT:
+        raise HttpError(400, "Offset must be >= 0 and limit between 1 and {}".format(MAX_LIMIT))
+    return offset, limit
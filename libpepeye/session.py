@@ -0,0 +1,162 @@
+"""
+    Persistent per-profile session state.
+
+    The session of a profile (sort order, filter text, selected function, etc.) is stored in the
+    settings, keyed by the hash of the profile contents. The sort permutation and filter result
+    are stored in a binary file in the cache directory, so that they don't have to be recomputed
+    when the profile is opened again.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import glob
+import json
+import logging
+import os
+import time
+
+from array import array
+
+from .qt import QtCore
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(object):
+    """ Reads and writes the session state of profiles.
+    """
+    MAX_SESSIONS = 100    # maximum number of sessions that are kept in the settings
+    MAX_ROW_ORDERS = 20   # maximum number of row order files that are kept in the cache
+
+    ROW_ORDER_VERSION = 1
+    INDEX_TYPE_CODE = 'i'
+
+    def __init__(self, settingsGroup='sessions', cacheDir=None):
+        """ Constructor
+
+            :param settingsGroup: the settings group under which the sessions are stored.
+            :param cacheDir: directory of the row order files. If None, a sessions
+                subdirectory of the application's cache location is used.
+        """
+        self._settingsGroup = settingsGroup
+        if cacheDir is None:
+            cacheDir = os.path.join(QtCore.QStandardPaths.writableLocation(
+                QtCore.QStandardPaths.CacheLocation), 'sessions')
+        self._cacheDir = cacheDir
+
+
+    def readSession(self, contentHash):
+        """ Returns the session of the profile as a dictionary, or None if it wasn't stored.
+        """
+        settings = QtCore.QSettings()
+        settings.beginGroup(self._settingsGroup)
+        try:
+            value = settings.value(contentHash)
+        finally:
+            settings.endGroup()
+
+        if not value:
+            logger.debug("No stored session for: {}".format(contentHash))
+            return None
+        try:
+            return json.loads(value)
+        except ValueError as ex:
+            logger.warning("Ignoring invalid session for {}: {}".format(contentHash, ex))
+            return None
+
+
+    def writeSession(self, contentHash, session):
+        """ Stores the session dictionary of a profile. Removes the oldest sessions if there
+            are more than MAX_SESSIONS.
+
+            The session must be JSON serializable.
+        """
+        session = dict(session, lastUsed=time.time())
+        settings = QtCore.QSettings()
+        settings.beginGroup(self._settingsGroup)
+        try:
+            settings.setValue(contentHash, json.dumps(session))
+
+            keys = settings.childKeys()
+            if len(keys) > self.MAX_SESSIONS:
+                def lastUsed(key):
+                    try:
+                        return json.loads(settings.value(key)).get('lastUsed', 0)
+                    except (TypeError, ValueError):
+                        return 0
+                for key in sorted(keys, key=lastUsed)[:len(keys) - self.MAX_SESSIONS]:
+                    settings.remove(key)
+        finally:
+            settings.endGroup()
+
+
+    def _rowOrderFileName(self, contentHash):
+        """ Returns the path of the file with the cached row order of a profile.
+        """
+        return os.path.join(self._cacheDir, "{}.order".format(contentHash))
+
+
+    def readRowOrder(self, contentHash):
+        """ Reads the row order state of a profile from the cache.
+
+            Returns the state as a dictionary (see StatsTableModel.rowOrderState) or None if
+            there is no (valid) cached state.
+        """
+        fileName = self._rowOrderFileName(contentHash)
+        if not os.path.exists(fileName):
+            return None
+
+        try:
+            with open(fileName, 'rb') as fileObj:
+                header = json.loads(fileObj.readline().decode('utf-8'))
+                if header.get('version') != self.ROW_ORDER_VERSION:
+                    logger.debug("Ignoring row order of version: {}".format(header.get('version')))
+                    return None
+
+                state = header['state']
+                for name, length in sorted(header['arrays'].items()):
+                    indices = array(self.INDEX_TYPE_CODE)
+                    indices.fromfile(fileObj, length)
+                    state[name] = indices
+                for name in header['nullArrays']:
+                    state[name] = None
+        except (OSError, EOFError, ValueError, KeyError) as ex:
+            logger.warning("Ignoring invalid row order file {}: {}".format(fileName, ex))
+            return None
+
+        logger.debug("Read row order from: {}".format(fileName))
+        return state
+
+
+    def writeRowOrder(self, contentHash, state):
+        """ Writes the row order state of a profile to the cache.
+
+            Removes the least recently written files if there are more than MAX_ROW_ORDERS.
+        """
+        arrays = {name: value for name, value in state.items() if isinstance(value, array)}
+        nullArrays = [name for name, value in state.items() if value is None]
+        header = {'version': self.ROW_ORDER_VERSION,
+                  'state': {name: value for name, value in state.items()
+                            if name not in arrays and name not in nullArrays},
+                  'arrays': {name: len(value) for name, value in arrays.items()},
+                  'nullArrays': nullArrays}
+
+        fileName = self._rowOrderFileName(contentHash)
+        try:
+            os.makedirs(self._cacheDir, exist_ok=True)
+            with open(fileName, 'wb') as fileObj:
+                fileObj.write(json.dumps(header).encode('utf-8') + b'\n')
+                for name, indices in sorted(arrays.items()):
+                    if indices.typecode != self.INDEX_TYPE_CODE:
+                        indices = array(self.INDEX_TYPE_CODE, indices)
+                    indices.tofile(fileObj)
+
+            fileNames = sorted(glob.glob(os.path.join(self._cacheDir, '*.order')),
+                               key=os.path.getmtime)
+            for oldFileName in fileNames[:-self.MAX_ROW_ORDERS]:
+                os.remove(oldFileName)
+        except OSError as ex:
+            logger.warning("Unable to write row order file {}: {}".format(fileName, ex))
+        else:
+            logger.debug("Wrote row order to: {}".format(fileName))
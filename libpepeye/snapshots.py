@@ -0,0 +1,201 @@
+"""
+    Series of profile snapshots.
+
+    Stores the metrics of an ordered series of pstats files in a (snapshot x function x metric)
+    array store, so that the evolution of each function can be shown and sorted on.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import concurrent.futures
+import functools
+import logging
+import operator
+import pstats
+
+from array import array
+
+from .statsstore import normalizeStats
+from .timing import TIMING
+from .utils import file_version_key
+
+logger = logging.getLogger(__name__)
+
+
+# The metrics that are stored per snapshot and function.
+METRICS = ('numCalls', 'time', 'cumTime')
+METRIC_NUM_CALLS, METRIC_TIME, METRIC_CUM_TIME = range(len(METRICS))
+
+
+def readSnapshot(fileName, pathNormalizer=None):
+    """ Reads a pstats file and returns its keys and metrics.
+
+        Returns a (keys, metrics) tuple. Keys is a list of (file, line_nr, function) tuples,
+        metrics is a list of arrays, one per metric, with the values per key. The caller
+        dictionaries are dropped so that little data has to be returned to the parent process.
+
+        :param pathNormalizer: if not None, a PathNormalizer of which the normalized paths
+            replace the file paths. Functions with equal normalized keys are merged, like the
+            StatsStore does (see statsstore.normalizeStats).
+    """
+    stats = pstats.Stats(fileName).stats
+    if pathNormalizer is not None:
+        stats = normalizeStats(stats, pathNormalizer.normalize)[0]
+    keys = list(stats.keys())
+    values = stats.values()
+    metrics = [array('d', (value[1] for value in values)),  # numCalls
+               array('d', (value[2] for value in values)),  # time
+               array('d', (value[3] for value in values))]  # cumTime
+    return keys, metrics
+
+
+
+class SnapshotSeries(object):
+    """ Metrics of an ordered series of profile snapshots.
+
+        Functions get an index the first time they occur in a snapshot. The arrays of a snapshot
+        only contain the functions that were known when it was added. The values of functions
+        that were added later (or don't occur in a snapshot) are zero.
+
+        The keys are normalized with the same PathNormalizer as the StatsStore of the profile
+        that is shown, so that the rows can be looked up in the series.
+    """
+    def __init__(self, pathNormalizer=None):
+        """ Constructor
+
+            :param pathNormalizer: if not None, a PathNormalizer for the file paths of the keys.
+        """
+        if pathNormalizer is not None and pathNormalizer.isIdentity:
+            pathNormalizer = None
+        self.pathNormalizer = pathNormalizer
+        self.fileNames = []
+        self._fileVersions = set() # file_version_key of the files, see addFiles
+        self.keys = []          # (file, line_nr, function) per function index
+        self._keyIndex = {}     # (file, line_nr, function) -> function index
+        self._snapshots = []    # per snapshot a list of arrays, one per metric
+        self._cache = {}        # (name, metric) -> array with a statistic per function
+
+
+    @property
+    def nSnapshots(self):
+        """ The number of snapshots in the series
+        """
+        return len(self._snapshots)
+
+
+    @TIMING.timed('addSnapshots')
+    def addFiles(self, fileNames, maxWorkers=None):
+        """ Adds the files to the end of the series. Files that are already in the series are
+            skipped, so only new snapshots are read. A file that was rewritten since it was
+            added (i.e. its modification time or size changed) is added again.
+
+            If there are several new files, they are read in parallel in separate processes.
+
+            :param fileNames: pstats files in the order of the series.
+            :param maxWorkers: maximum number of processes. If None, the number of CPUs is used.
+        """
+        newFileNames = []
+        newVersions = []
+        for fileName in fileNames:
+            version = file_version_key(fileName)
+            if version not in self._fileVersions and version not in newVersions:
+                newFileNames.append(fileName)
+                newVersions.append(version)
+        if not newFileNames:
+            return
+
+        logger.debug("Reading {} snapshots".format(len(newFileNames)))
+        read = functools.partial(readSnapshot, pathNormalizer=self.pathNormalizer)
+        if len(newFileNames) == 1:
+            snapshots = [read(newFileNames[0])]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+                snapshots = list(executor.map(read, newFileNames))
+
+        for fileName, (keys, metrics) in zip(newFileNames, snapshots):
+            self._addSnapshot(fileName, keys, metrics)
+        self._fileVersions.update(newVersions)
+        self._cache.clear()
+
+
+    def _addSnapshot(self, fileName, keys, metrics):
+        """ Appends a snapshot. Reorders the metrics so they are indexed by function index.
+        """
+        keyIndex = self._keyIndex
+        for key in keys:
+            if key not in keyIndex:
+                keyIndex[key] = len(self.keys)
+                self.keys.append(key)
+
+        positions = list(map(keyIndex.__getitem__, keys))
+        nKeys = len(self.keys)
+        snapshot = []
+        for values in metrics:
+            indexed = array('d', bytes(nKeys * 8))
+            for pos, value in zip(positions, values):
+                indexed[pos] = value
+            snapshot.append(indexed)
+
+        self.fileNames.append(fileName)
+        self._snapshots.append(snapshot)
+
+
+    def indexOfKey(self, key):
+        """ Returns the function index of a (file, line_nr, function) key. None if not found.
+        """
+        return self._keyIndex.get(key)
+
+
+    def values(self, index, metric):
+        """ Returns a list with the values of a function over all snapshots.
+
+            :param index: function index
+            :param metric: one of METRIC_NUM_CALLS, METRIC_TIME, METRIC_CUM_TIME
+        """
+        return [snapshot[metric][index] if index < len(snapshot[metric]) else 0.0
+                for snapshot in self._snapshots]
+
+
+    def _paddedColumn(self, snapshotNr, metric):
+        """ Returns the values of a metric in a snapshot, padded with zeros to all functions.
+        """
+        column = self._snapshots[snapshotNr][metric]
+        nMissing = len(self.keys) - len(column)
+        if nMissing:
+            column = column + array('d', bytes(nMissing * 8))
+        return column
+
+
+    def growth(self, metric):
+        """ Returns an array with the change between the first and last snapshot per function.
+        """
+        cacheKey = ('growth', metric)
+        if cacheKey not in self._cache:
+            if not self._snapshots:
+                result = array('d')
+            else:
+                result = array('d', map(operator.sub, self._paddedColumn(-1, metric),
+                                        self._paddedColumn(0, metric)))
+            self._cache[cacheKey] = result
+        return self._cache[cacheKey]
+
+
+    def variance(self, metric):
+        """ Returns an array with the (population) variance over the snapshots per function.
+        """
+        cacheKey = ('variance', metric)
+        if cacheKey not in self._cache:
+            nKeys = len(self.keys)
+            sums = array('d', bytes(nKeys * 8))
+            sumSquares = array('d', bytes(nKeys * 8))
+            for snapshotNr in range(self.nSnapshots):
+                column = self._paddedColumn(snapshotNr, metric)
+                sums = array('d', map(operator.add, sums, column))
+                sumSquares = array('d', map(operator.add, sumSquares,
+                                            map(operator.mul, column, column)))
+            n = max(1, self.nSnapshots)
+            result = array('d', (max(0.0, sq / n - (s / n) ** 2)
+                                 for s, sq in zip(sums, sumSquares)))
+            self._cache[cacheKey] = result
+        return self._cache[cacheKey]
@@ -0,0 +1,452 @@
+"""
+    Source pane that shows the code around the selected function.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import keyword
+import logging
+import mmap
+import os
+import re
+
+from array import array
+
+from .qt import Qt, QtCore, QtGui, QtWidgets
+from .timing import TIMING
+
+logger = logging.getLogger(__name__)
+
+
+class SourceFile(object):
+    """ A read-only source file that is memory mapped and indexed by line lazily.
+
+        Only the part of the file up to the last requested line is scanned for line endings.
+    """
+    def __init__(self, filePath):
+        """ Constructor
+
+            :param filePath: path of the file. Raises an OSError if it can't be opened.
+        """
+        self.filePath = filePath
+        self.mtime = os.path.getmtime(filePath)
+
+        with open(filePath, 'rb') as fileObj:
+            if os.fstat(fileObj.fileno()).st_size > 0:
+                self._buffer = mmap.mmap(fileObj.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = b''
+
+        self._lineStarts = array('Q', [0]) # byte offsets of the lines that are indexed so far.
+        self._complete = False             # True if the complete file has been indexed.
+
+
+    def close(self):
+        """ Closes the memory map.
+        """
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b''
+        self._lineStarts = array('Q', [0])
+        self._complete = False
+
+
+    def _indexUntil(self, lineNr):
+        """ Scans for line endings until the start of line lineNr (1-based) is known.
+        """
+        lineStarts = self._lineStarts
+        find = self._buffer.find
+        while not self._complete and len(lineStarts) < lineNr:
+            pos = find(b'\n', lineStarts[-1])
+            if pos < 0:
+                self._complete = True
+            else:
+                lineStarts.append(pos + 1)
+
+
+    def lines(self, firstLine, lastLine):
+        """ Returns the lines from firstLine to lastLine (1-based, inclusive) as a list of strings.
+
+            The list is shorter if the file has less than lastLine lines.
+        """
+        firstLine = max(1, firstLine)
+        self._indexUntil(lastLine + 1)
+        lineStarts = self._lineStarts
+        if firstLine > len(lineStarts):
+            return []
+
+        begin = lineStarts[firstLine - 1]
+        end = lineStarts[lastLine] if lastLine < len(lineStarts) else len(self._buffer)
+        text = self._buffer[begin:end].decode('utf-8', errors='replace')
+        result = text.splitlines()
+        if lastLine >= len(lineStarts) and text.endswith('\n'):
+            result.append('')  # the empty last line after the final line ending.
+        return result[:lastLine - firstLine + 1]
+
+
+
+class SourceFileCache(object):
+    """ Least recently used cache of opened source files.
+    """
+    def __init__(self, maxFiles=32):
+        """ Constructor
+
+            :param maxFiles: maximum number of files that are kept open.
+        """
+        self.maxFiles = maxFiles
+        self._files = collections.OrderedDict()
+
+
+    def get(self, filePath):
+        """ Returns the SourceFile for filePath. Opens it if not in the cache or if it has
+            been modified since it was opened. Raises an OSError if the file can't be opened.
+        """
+        sourceFile = self._files.pop(filePath, None)
+        if sourceFile is not None and sourceFile.mtime != os.path.getmtime(filePath):
+            logger.debug("Source file modified: {}".format(filePath))
+            sourceFile.close()
+            sourceFile = None
+
+        if sourceFile is None:
+            logger.debug("Opening source file: {}".format(filePath))
+            sourceFile = SourceFile(filePath)
+
+        self._files[filePath] = sourceFile
+        while len(self._files) > self.maxFiles:
+            _oldPath, oldFile = self._files.popitem(last=False)
+            oldFile.close()
+
+        return sourceFile
+
+
+    def clear(self):
+        """ Closes all files in the cache.
+        """
+        for sourceFile in self._files.values():
+            sourceFile.close()
+        self._files.clear()
+
+
+
+class PythonHighlighter(QtGui.QSyntaxHighlighter):
+    """ Syntax highlighter for Python code that only highlights blocks that have been enabled.
+
+        The SourceEditor enables the blocks that become visible, so that only the visible region
+        is highlighted. Multi-line strings are not recognized.
+    """
+    def __init__(self, document):
+        """ Constructor
+        """
+        super(PythonHighlighter, self).__init__(document)
+        self._enabledBlocks = set()
+
+        def makeFormat(color, bold=False, italic=False):
+            fmt = QtGui.QTextCharFormat()
+            fmt.setForeground(QtGui.QColor(color))
+            if bold:
+                fmt.setFontWeight(QtGui.QFont.Bold)
+            fmt.setFontItalic(italic)
+            return fmt
+
+        # Rules are applied in order. Later rules override earlier ones.
+        self._rules = [
+            (re.compile(r"\b(?:{})\b".format("|".join(keyword.kwlist))),
+             makeFormat('#000080', bold=True)),
+            (re.compile(r"\b[0-9]+(?:\.[0-9]*)?(?:[eE][+-]?[0-9]+)?\b"), makeFormat('#0000ff')),
+            (re.compile(r"@[\w.]+"), makeFormat('#808000')),
+            (re.compile(r"\b(?:def|class)\s+(\w+)"), makeFormat('#000000', bold=True)),
+            (re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'|\"[^\"\\]*(?:\\.[^\"\\]*)*\""),
+             makeFormat('#008000')),
+            (re.compile(r"#[^\n]*"), makeFormat('#808080', italic=True)),
+        ]
+
+
+    def clearEnabledBlocks(self):
+        """ Disables all blocks. Call this when a new text is set in the document.
+        """
+        self._enabledBlocks.clear()
+
+
+    def enableBlock(self, block):
+        """ Enables highlighting of the block and highlights it if it wasn't enabled before.
+        """
+        blockNr = block.blockNumber()
+        if blockNr not in self._enabledBlocks:
+            self._enabledBlocks.add(blockNr)
+            self.rehighlightBlock(block)
+
+
+    def highlightBlock(self, text):
+        """ Highlights a single line of text if its block has been enabled.
+        """
+        if self.currentBlock().blockNumber() not in self._enabledBlocks:
+            return
+
+        for regExp, fmt in self._rules:
+            for match in regExp.finditer(text):
+                group = 1 if regExp.groups else 0
+                self.setFormat(match.start(group), match.end(group) - match.start(group), fmt)
+
+
+
+class _GutterArea(QtWidgets.QWidget):
+    """ Area left of the source editor with the line numbers and timing annotations.
+    """
+    def __init__(self, editor):
+        super(_GutterArea, self).__init__(editor)
+        self._editor = editor
+
+    def sizeHint(self):
+        return QtCore.QSize(self._editor.gutterWidth(), 0)
+
+    def paintEvent(self, event):
+        self._editor.paintGutter(event)
+
+
+
+class SourceEditor(QtWidgets.QPlainTextEdit):
+    """ Read-only text editor that shows a window of lines of a source file.
+
+        The gutter shows the line numbers. The lines where a profiled function is defined are
+        annotated with the time and cumulative time of that function.
+    """
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SourceEditor, self).__init__(parent)
+        self.setReadOnly(True)
+        self.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+
+        self._firstLine = 1       # line number of the first line in the document
+        self._annotations = {}    # line number -> annotation string
+        self._isEnablingBlocks = False
+
+        self._highlighter = PythonHighlighter(self.document())
+        self._gutterArea = _GutterArea(self)
+
+        self.updateRequest.connect(self._onUpdateRequest)
+        self._updateGutterWidth()
+
+
+    def setSourceLines(self, lines, firstLine, annotations):
+        """ Sets the text of the editor.
+
+            :param lines: list of strings
+            :param firstLine: line number (1-based) of the first of the lines.
+            :param annotations: dictionary mapping line numbers to annotation strings.
+        """
+        self._firstLine = firstLine
+        self._annotations = annotations
+        self._highlighter.clearEnabledBlocks()
+        self.setPlainText("\n".join(lines))
+        self._updateGutterWidth()
+
+
+    def setAnnotations(self, annotations):
+        """ Replaces the annotations of the lines.
+
+            :param annotations: dictionary mapping line numbers to annotation strings.
+        """
+        self._annotations = annotations
+        self._updateGutterWidth()
+        self._gutterArea.update()
+
+
+    @property
+    def firstLine(self):
+        """ The line number of the first line that is shown.
+        """
+        return self._firstLine
+
+
+    @property
+    def lastLine(self):
+        """ The line number of the last line that is shown.
+        """
+        return self._firstLine + self.blockCount() - 1
+
+
+    def containsLine(self, lineNr):
+        """ Returns True if lineNr is in the window of lines that is currently shown.
+        """
+        return self._firstLine <= lineNr < self._firstLine + self.blockCount()
+
+
+    def goToLine(self, lineNr):
+        """ Selects lineNr and scrolls it to the center of the editor.
+        """
+        block = self.document().findBlockByNumber(lineNr - self._firstLine)
+        if not block.isValid():
+            return
+        cursor = QtGui.QTextCursor(block)
+        self.setTextCursor(cursor)
+        self.centerCursor()
+
+        selection = QtWidgets.QTextEdit.ExtraSelection()
+        selection.format.setBackground(QtGui.QColor('#fff3b0'))
+        selection.format.setProperty(QtGui.QTextFormat.FullWidthSelection, True)
+        selection.cursor = cursor
+        self.setExtraSelections([selection])
+
+
+    def gutterWidth(self):
+        """ Returns the width needed for the line numbers and annotations.
+        """
+        lastLine = self._firstLine + self.blockCount()
+        nChars = len(str(lastLine)) + 2
+        if self._annotations:
+            nChars += max(len(text) for text in self._annotations.values()) + 2
+        return 6 + self.fontMetrics().horizontalAdvance('9') * nChars
+
+
+    def _updateGutterWidth(self):
+        """ Makes room for the gutter.
+        """
+        self.setViewportMargins(self.gutterWidth(), 0, 0, 0)
+        self._updateGutterGeometry()
+
+
+    def resizeEvent(self, event):
+        """ Resizes the gutter together with the editor.
+        """
+        super(SourceEditor, self).resizeEvent(event)
+        self._updateGutterGeometry()
+
+
+    def _updateGutterGeometry(self):
+        """ Places the gutter left of the viewport.
+        """
+        rect = self.contentsRect()
+        self._gutterArea.setGeometry(QtCore.QRect(rect.left(), rect.top(),
+                                                  self.gutterWidth(), rect.height()))
+
+
+    def _visibleBlocks(self):
+        """ Generator that yields the visible blocks and their top and bottom y coordinates.
+        """
+        block = self.firstVisibleBlock()
+        top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
+        viewportHeight = self.viewport().rect().height()
+        while block.isValid() and top <= viewportHeight:
+            bottom = top + self.blockBoundingRect(block).height()
+            if block.isVisible():
+                yield block, top, bottom
+            block = block.next()
+            top = bottom
+
+
+    def _onUpdateRequest(self, rect, dy):
+        """ Highlights the blocks that became visible and updates the gutter.
+        """
+        if not self._isEnablingBlocks:
+            self._isEnablingBlocks = True
+            try:
+                for block, _top, _bottom in self._visibleBlocks():
+                    self._highlighter.enableBlock(block)
+            finally:
+                self._isEnablingBlocks = False
+
+        if dy:
+            self._gutterArea.scroll(0, dy)
+        else:
+            self._gutterArea.update(0, rect.y(), self._gutterArea.width(), rect.height())
+
+
+    def paintGutter(self, event):
+        """ Paints the line numbers and annotations of the visible lines.
+        """
+        painter = QtGui.QPainter(self._gutterArea)
+        palette = self.palette()
+        painter.fillRect(event.rect(), palette.color(QtGui.QPalette.Window))
+        width = self._gutterArea.width() - 3
+        height = self.fontMetrics().height()
+
+        for block, top, bottom in self._visibleBlocks():
+            if bottom < event.rect().top():
+                continue
+            lineNr = self._firstLine + block.blockNumber()
+            annotation = self._annotations.get(lineNr)
+            if annotation:
+                painter.setPen(QtGui.QColor('#a00000'))
+                text = "{}  {}".format(annotation, lineNr)
+            else:
+                painter.setPen(palette.color(QtGui.QPalette.Mid))
+                text = str(lineNr)
+            painter.drawText(0, int(top), width, height, Qt.AlignRight, text)
+
+
+
+class SourcePane(QtWidgets.QWidget):
+    """ Shows the source code around the selected function.
+
+        Only a window of lines around the function is read. Selecting another function in
+        the same window only scrolls the editor.
+    """
+    WINDOW_LINES = 500 # number of lines shown before and after the function definition
+
+    def __init__(self, parent=None):
+        """ Constructor
+        """
+        super(SourcePane, self).__init__(parent)
+        self._fileCache = SourceFileCache()
+        self._filePath = None
+
+        self.pathLabel = QtWidgets.QLabel("")
+        self.pathLabel.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.editor = SourceEditor()
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.pathLabel)
+        layout.addWidget(self.editor)
+        self.setLayout(layout)
+
+
+    def clear(self, message=""):
+        """ Clears the editor and shows a message in the path label.
+        """
+        self._filePath = None
+        self.pathLabel.setText(message)
+        self.editor.setSourceLines([], 1, {})
+
+
+    @TIMING.timed('showSource')
+    def showStatRow(self, statRow, fileRows):
+        """ Shows the source code around the function of statRow.
+
+            :param statRow: StatRow of the selected function. Use None to clear.
+            :param fileRows: list of StatRows of all functions in the same file.
+                These are used to annotate the function definitions. The annotations are
+                always updated, because the rows can be of another profile of the same file.
+        """
+        if statRow is None:
+            self.clear()
+            return
+
+        filePath = statRow.rawFilePath # The normalized path may not exist on this machine.
+        lineNr = statRow.lineNr
+        if filePath != self._filePath or not self.editor.containsLine(lineNr):
+            try:
+                sourceFile = self._fileCache.get(filePath)
+            except (OSError, ValueError) as ex:
+                logger.debug("No source for {!r}: {}".format(filePath, ex))
+                self.clear("No source available for: {}".format(filePath))
+                return
+
+            firstLine = max(1, lineNr - self.WINDOW_LINES)
+            lines = sourceFile.lines(firstLine, lineNr + self.WINDOW_LINES)
+
+            self._filePath = filePath
+            self.pathLabel.setText(filePath)
+            self.editor.setSourceLines(lines, firstLine, {})
+
+        firstLine, lastLine = self.editor.firstLine, self.editor.lastLine
+        annotations = {}
+        for row in fileRows:
+            if row.rawFilePath == filePath and firstLine <= row.lineNr <= lastLine:
+                annotations[row.lineNr] = "{:.3f}  Σ {:.3f}".format(row.time, row.cumTime)
+        self.editor.setAnnotations(annotations)
+        self.editor.goToLine(lineNr)
@@ -0,0 +1,815 @@
+""" 
+    Stats store functionality.
+
+    Contains the data that is loaded from a pstats file. The store is immutable so that it can
+    be shared by all models (and windows) that show the same file. It doesn't depend on Qt.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import copy
+import itertools
+import logging
+import operator
+import os
+import pstats
+import re
+import sys
+
+from array import array
+
+from .fuzzy import TrigramIndex
+from .timing import TIMING
+from .utils import check_class, file_content_hash, file_version_key
+
+logger = logging.getLogger(__name__)
+
+
+class StatRow(object):
+    """ Class that contains the data for one profile statistic
+
+        The derived metrics (recursionDepth, recursiveShare, parentShare and totalPercent) are
+        set by the StatsStore because they depend on the other rows.
+    """
+    def __init__(self, statsKey, statsValue):
+        """ Constructor which is initialized from a key, value pair of a pstats.stats
+            dictionary.
+            
+            :param stats_key: (file, line_nr, function) tuple
+            :param stats_value: (prim_calls, n_calls, time, cum_time, caller_dict) tuple
+        """
+        (self.filePath, self.lineNr, self.functionName) = statsKey
+        (self.numPrimCalls, self.numCalls, self.time, self.cumTime, self.callers) = statsValue
+
+        self.rawFilePath = self.filePath # The path before normalization, set by the StatsStore.
+        self.fileName = os.path.basename(self.filePath)
+        
+        self.timePerCall = self.time / self.numCalls
+        self.cumTimePerCall = self.cumTime / self.numPrimCalls
+
+        self.lcFileName = self.fileName.lower()
+        self.lcFilePath = self.filePath.lower()
+        self.lcFunctionName = self.functionName.lower()
+
+        self.recursionDepth = 1.0 # mean number of calls per primitive (non recursive) call
+        self.recursiveShare = 0.0 # percentage of the calls that are recursive
+        self.parentShare = 0.0    # self time as percentage of the cumTime of the main caller
+        self.totalPercent = 0.0   # cumTime as percentage of the total time
+
+    @property
+    def key(self):
+        """ The (file, line_nr, function) tuple that identifies the function in pstats.
+        """
+        return (self.filePath, self.lineNr, self.functionName)
+
+    # Sorting keys. Use (path, line, function name) as tie breaker. Note that path can be '~' for
+    # built in methods, that's why function name is included in the tie breaker.
+
+
+    @classmethod
+    def keyPathAndLine(cls, statRow):
+        return (statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyFileAndLine(cls, statRow):
+        return (statRow.lcFileName, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyFunctionName(cls, statRow):
+        return (statRow.lcFunctionName, statRow.lcFilePath, statRow.lineNr)
+
+    @classmethod
+    def keyNumCalls(cls, statRow):
+        return (statRow.numCalls, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyTime(cls, statRow):
+        return (statRow.time, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyTimePerCall(cls, statRow):
+        return (statRow.timePerCall, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyNumPrimCalls(cls, statRow):
+        return (statRow.numPrimCalls, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyCumTime(cls, statRow):
+        return (statRow.cumTime, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyCumTimePerCall(cls, statRow):
+        return (statRow.cumTimePerCall, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyRecursionDepth(cls, statRow):
+        return (statRow.recursionDepth, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyRecursiveShare(cls, statRow):
+        return (statRow.recursiveShare, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyParentShare(cls, statRow):
+        return (statRow.parentShare, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+    @classmethod
+    def keyTotalPercent(cls, statRow):
+        return (statRow.totalPercent, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
+
+
+
+# The numeric attributes of a StatRow
+NUMERIC_ATTRIBUTES = ('lineNr', 'numCalls', 'numPrimCalls', 'time', 'timePerCall', 'cumTime',
+                      'cumTimePerCall', 'recursionDepth', 'recursiveShare', 'parentShare',
+                      'totalPercent')
+
+# Names that can be used in the conditions of a filter text -> StatRow attribute
+FILTER_ATTRIBUTES = collections.OrderedDict([
+    ('calls', 'numCalls'),
+    ('primcalls', 'numPrimCalls'),
+    ('time', 'time'),
+    ('cumtime', 'cumTime'),
+    ('depth', 'recursionDepth'),
+    ('recursive', 'recursiveShare'),
+    ('parent', 'parentShare'),
+    ('total', 'totalPercent'),
+])
+
+_FILTER_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+                     '=': operator.eq, '==': operator.eq, '!=': operator.ne}
+
+_CONDITION_REGEXP = re.compile(r'^({})(<=|>=|==|!=|<|>|=)([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)$'
+                               .format('|'.join(FILTER_ATTRIBUTES)), re.IGNORECASE)
+
+
+def parseFilterText(filterText):
+    """ Splits a filter text in a search text and a list of numeric conditions.
+
+        Words of the form <name><operator><number>, e.g. 'recursive>50' or 'total>=1', are
+        conditions on the column of the name (see FILTER_ATTRIBUTES). The operator can be
+        <, <=, >, >=, = or !=. The other words form the search text, which must occur in the
+        path or function name (case insensitive).
+
+        :returns: (searchText, conditions) tuple. The search text is in lower case. Conditions
+            is a list of (attribute name, operator function, number) tuples.
+    """
+    words = []
+    conditions = []
+    for word in filterText.split():
+        match = _CONDITION_REGEXP.match(word)
+        if match:
+            name, op, number = match.groups()
+            conditions.append((FILTER_ATTRIBUTES[name.lower()], _FILTER_OPERATORS[op],
+                               float(number)))
+        else:
+            words.append(word)
+
+    if not conditions:
+        return filterText.lower(), [] # Spaces are kept if there are no conditions.
+    return " ".join(words).lower(), conditions
+
+
+def makeRowFilter(filterText):
+    """ Returns a function that returns True if a StatRow passes the filter text.
+
+        See parseFilterText for the syntax. Returns None if the filter text is empty.
+    """
+    searchText, conditions = parseFilterText(filterText)
+    if not searchText and not conditions:
+        return None
+
+    attributeGetters = [(operator.attrgetter(attr), op, number)
+                        for attr, op, number in conditions]
+
+    def rowFilter(statRow):
+        if searchText and not (searchText in statRow.lcFilePath or
+                               searchText in statRow.lcFunctionName):
+            return False
+        for getter, op, number in attributeGetters:
+            if not op(getter(statRow), number):
+                return False
+        return True
+
+    return rowFilter
+
+
+
+class StatsStore(object):
+    """ Immutable container with the StatRows of a pstats.Stats object.
+
+        Models hold a reference to a store together with their own sort order and filter, so that
+        several views of the same profile only need to store the data once.
+    """
+    def __init__(self, statsObject, fileName=None, contentHash=None, lowMemory=False,
+                 compactTime=0.0, pathNormalizer=None):
+        """ Constructor
+
+            :param statsObject: profiler statistics.
+            :type  statsObject: pstats.Stats
+            :param fileName: the file from which the statistics were loaded (if any).
+            :param contentHash: hash of the contents of that file (if any).
+            :param lowMemory: if True, the callers of the rows are converted to typed arrays
+                and the statsObject is dropped (see _compactCallers).
+            :param compactTime: if > 0, the functions with a cumulative time less than this
+                number of seconds are collapsed into an "other" row per file (see
+                compactStats). The statsObject itself is not changed.
+            :param pathNormalizer: if not None, a PathNormalizer of which the normalized paths
+                replace the file paths. Functions with equal normalized keys are merged (see
+                normalizeStats). This is done before the compaction.
+        """
+        check_class(statsObject, pstats.Stats)
+        if pathNormalizer is not None and pathNormalizer.isIdentity:
+            pathNormalizer = None
+        self.pathNormalizer = pathNormalizer
+        self.compactTime = compactTime
+        self.nMerged = 0    # Number of functions that are merged by the path normalization.
+        self.nCompacted = 0 # Number of functions that are collapsed into the "other" rows.
+
+        stats = statsObject.stats
+        hashSuffixes = [] # The sessions of normalized or compacted profiles are stored apart.
+        rawPaths = {}     # normalized path -> the first file path that was normalized to it
+        if pathNormalizer is not None:
+            with TIMING.span('normalizePaths', nRows=len(stats)):
+                stats, self.nMerged, newPaths = normalizeStats(stats, pathNormalizer.normalize)
+            for filePath, newPath in newPaths.items():
+                rawPaths.setdefault(newPath, filePath)
+            hashSuffixes.append("norm" + pathNormalizer.digest())
+        if compactTime > 0:
+            with TIMING.span('compactStats', nRows=len(stats)):
+                stats, self.nCompacted = compactStats(stats, compactTime)
+            if self.nCompacted:
+                hashSuffixes.append("compact{:g}".format(compactTime))
+
+        if stats is not statsObject.stats:
+            statsObject = copy.copy(statsObject)
+            statsObject.stats = stats
+        if contentHash is not None and hashSuffixes:
+            contentHash = "-".join([contentHash] + hashSuffixes)
+
+        self.fileName = fileName
+        self.contentHash = contentHash
+        self.statsObject = statsObject
+        self.lowMemory = lowMemory
+
+        # The rows are in the order of the statsObject.stats dictionary.
+        self.rows = tuple(StatRow(k, v) for (k, v) in statsObject.stats.items())
+        if rawPaths:
+            for statRow in self.rows:
+                statRow.rawFilePath = rawPaths.get(statRow.filePath, statRow.filePath)
+
+        self._rowsPerFile = None # file path -> list of StatRows. Created when first needed.
+        self._firstRowOfFunction = None # function name -> first StatRow. Idem.
+        self._otherRowsOfFunction = None # function name -> list of the next StatRows.
+        self._positions = None   # (file, line_nr, function) -> position in rows.
+        self._callees = None     # per position a list of (callee position, edge) tuples.
+        self._rowPositions = None # StatRow -> position in rows.
+        self._rankArrays = {}    # name -> array with the dense rank per row, see rankArray.
+        self._searchIndex = None # SearchIndex of the paths and function names.
+        self._trigramIndex = None # fuzzy.TrigramIndex of the function and file names.
+        self._callerStarts = None    # Compacted callers (low-memory mode), see _compactCallers.
+        self._callerPositions = None
+        self._callerEdges = None
+
+        self.totalTime = sum(statRow.time for statRow in self.rows)
+        with TIMING.span('derivedColumns'):
+            self.columns = self._derivedColumns()
+
+        self.memorySaved = 0 # Estimated number of bytes freed by the low-memory mode.
+        if lowMemory:
+            with TIMING.span('compactCallers'):
+                self.memorySaved = self._compactCallers()
+
+
+    def _derivedColumns(self):
+        """ Computes the derived metrics of all rows and sets them in the StatRows.
+
+            Returns a dictionary with per metric an array with the values per row.
+        """
+        rows = self.rows
+        numCalls = array('d', (statRow.numCalls for statRow in rows))
+        numPrimCalls = array('d', (statRow.numPrimCalls for statRow in rows))
+        cumTimes = array('d', (statRow.cumTime for statRow in rows))
+        times = array('d', (statRow.time for statRow in rows))
+        percentFactor = 100.0 / (self.totalTime or 1.0)
+
+        recursionDepth = array('d', map(operator.truediv, numCalls, numPrimCalls))
+        recursiveShare = array('d', (100.0 * (nCalls - nPrimCalls) / nCalls
+                                     for nCalls, nPrimCalls in zip(numCalls, numPrimCalls)))
+        parentShare = array('d', (100.0 * time / parentTime if parentTime > 0 else 0.0
+                                  for time, parentTime in zip(times, self._mainCallerTimes())))
+        totalPercent = array('d', map(percentFactor.__mul__, cumTimes))
+
+        for statRow, depth, recursive, parent, total in zip(
+                rows, recursionDepth, recursiveShare, parentShare, totalPercent):
+            statRow.recursionDepth = depth
+            statRow.recursiveShare = recursive
+            statRow.parentShare = parent
+            statRow.totalPercent = total
+
+        return {'recursionDepth': recursionDepth, 'recursiveShare': recursiveShare,
+                'parentShare': parentShare, 'totalPercent': totalPercent}
+
+
+    def _mainCallerTimes(self):
+        """ Returns an array with per row the cumulative time of its main caller.
+
+            The main caller is the (non recursive) caller that accounts for most of the
+            cumulative time of the function. The total time is used for functions without
+            callers.
+        """
+        result = array('d', [self.totalTime]) * len(self.rows)
+        cumTimeOfKey = {key: statRow.cumTime
+                        for key, statRow in zip(self.statsObject.stats.keys(), self.rows)}
+        for pos, (key, statRow) in enumerate(zip(self.statsObject.stats.keys(), self.rows)):
+            maxEdgeTime = -1.0
+            for callerKey, value in statRow.callers.items():
+                edgeTime = value[3] if isinstance(value, tuple) else 0.0
+                if edgeTime > maxEdgeTime and callerKey != key and callerKey in cumTimeOfKey:
+                    maxEdgeTime = edgeTime
+                    result[pos] = cumTimeOfKey[callerKey]
+        return result
+
+
+    def _compactCallers(self):
+        """ Converts the callers dictionaries of the rows to typed arrays and drops the
+            statsObject, which frees the dictionaries. Returns the estimated number of bytes
+            that are freed.
+
+            The callers of the row at position pos are at the indices from _callerStarts[pos]
+            up to _callerStarts[pos + 1] of the _callerPositions array (int32) and of the four
+            edge arrays in _callerEdges: numCalls and numPrimCalls (int64), time and cumTime
+            (float64, so that the times are the same as in the normal mode). Callers that are
+            not in the statistics are skipped, as they are in callers().
+        """
+        stats = self.statsObject.stats
+        self.position(None) # Creates the index from the keys of the stats, which it keeps.
+
+        getsizeof = sys.getsizeof
+        positionOfKey = self._positions.get
+        countedKeys = set(map(id, stats)) # Caller keys are usually the keys of the stats.
+        oldSize = getsizeof(stats)
+
+        starts = array('i', [0])
+        callerPositions = array('i')
+        edgeList = []
+        for statRow, value in zip(self.rows, stats.values()):
+            callers = statRow.callers
+            oldSize += getsizeof(value) + getsizeof(callers) + len(callers) * _EDGE_VALUE_SIZE
+            for callerKey, callerValue in callers.items():
+                if id(callerKey) not in countedKeys:
+                    countedKeys.add(id(callerKey))
+                    oldSize += getsizeof(callerKey)
+
+                callerPos = positionOfKey(callerKey)
+                if callerPos is not None:
+                    callerPositions.append(callerPos)
+                    edgeList.append(_edgeTuple(callerValue))
+            starts.append(len(callerPositions))
+            statRow.callers = None
+
+        edges = tuple(array(typeCode, map(operator.itemgetter(idx), edgeList))
+                      for idx, typeCode in enumerate('qqdd'))
+        self._callerStarts = starts
+        self._callerPositions = callerPositions
+        self._callerEdges = edges
+        self.statsObject = None
+
+        newSize = sum(_arraySize(arr) for arr in (starts, callerPositions) + edges)
+        logger.debug("Compacted {} caller edges: {} -> {} bytes"
+                     .format(len(callerPositions), oldSize, newSize))
+        return max(0, oldSize - newSize)
+
+
+    def __len__(self):
+        """ Returns the number of rows
+        """
+        return len(self.rows)
+
+
+    def column(self, name):
+        """ Returns an array('d') with the value of a numeric StatRow attribute per row.
+
+            The arrays are created when first needed and then cached. The derived columns
+            (see _derivedColumns) are always available.
+        """
+        values = self.columns.get(name)
+        if values is None:
+            if name not in NUMERIC_ATTRIBUTES:
+                raise ValueError("Not a numeric column: {!r}. Must be one of: {}"
+                                 .format(name, ", ".join(NUMERIC_ATTRIBUTES)))
+            values = array('d', map(operator.attrgetter(name), self.rows))
+            self.columns[name] = values
+        return values
+
+
+    def rowsForFile(self, filePath):
+        """ Returns a list with the StatRows of all functions that are defined in filePath.
+        """
+        if self._rowsPerFile is None:
+            rowsPerFile = collections.defaultdict(list)
+            for statRow in self.rows:
+                rowsPerFile[statRow.filePath].append(statRow)
+            self._rowsPerFile = dict(rowsPerFile)
+
+        return self._rowsPerFile.get(filePath, [])
+
+
+    def rowsForFunction(self, functionName):
+        """ Returns a list with the StatRows of all functions with the name (in any file).
+        """
+        if self._firstRowOfFunction is None:
+            # Most names are unique, so lists are only created for the names that are not.
+            firstRowOfFunction = {}
+            otherRowsOfFunction = collections.defaultdict(list)
+            for statRow in self.rows:
+                if firstRowOfFunction.setdefault(statRow.functionName, statRow) is not statRow:
+                    otherRowsOfFunction[statRow.functionName].append(statRow)
+            self._firstRowOfFunction = firstRowOfFunction
+            self._otherRowsOfFunction = dict(otherRowsOfFunction)
+
+        firstRow = self._firstRowOfFunction.get(functionName)
+        if firstRow is None:
+            return []
+        return [firstRow] + self._otherRowsOfFunction.get(functionName, [])
+
+
+    def findRow(self, statsKey):
+        """ Returns the StatRow with the (file, line_nr, function) key, or None if not found.
+        """
+        pos = self.position(statsKey)
+        return None if pos is None else self.rows[pos]
+
+
+    def position(self, statsKey):
+        """ Returns the position in rows of the (file, line_nr, function) key, or None.
+
+            The index is created from the statsObject when first needed. In low-memory mode
+            it's created before the statsObject is dropped.
+        """
+        if self._positions is None:
+            self._positions = {key: pos for pos, key in enumerate(self.statsObject.stats.keys())}
+        return self._positions.get(statsKey)
+
+
+    def positionsOfRows(self, statRows):
+        """ Returns a list with the positions in rows of the StatRows.
+        """
+        if self._rowPositions is None:
+            self._rowPositions = {statRow: pos for pos, statRow in enumerate(self.rows)}
+        return list(map(self._rowPositions.__getitem__, statRows))
+
+
+    def rankArray(self, name, valueOfRow):
+        """ Returns an array('i') with per row the dense rank of valueOfRow(statRow) among all
+            rows. Rows with equal values have the same rank.
+
+            The arrays are cached by name, so that they are computed only once for all models
+            that share the store.
+        """
+        ranks = self._rankArrays.get(name)
+        if ranks is None:
+            with TIMING.span('rankArray', column=name):
+                ranks = denseRanks(list(map(valueOfRow, self.rows)))
+            self._rankArrays[name] = ranks
+        return ranks
+
+
+    def searchIndex(self):
+        """ Returns the SearchIndex of the lower case paths and function names of the rows.
+
+            The index is created when first needed.
+        """
+        if self._searchIndex is None:
+            with TIMING.span('searchIndex', nRows=len(self.rows)):
+                self._searchIndex = SearchIndex(self.rows)
+        return self._searchIndex
+
+
+    def trigramIndex(self):
+        """ Returns the fuzzy.TrigramIndex of the function names and file names of the rows.
+
+            The index is created when first needed.
+        """
+        if self._trigramIndex is None:
+            with TIMING.span('trigramIndex', nRows=len(self.rows)):
+                self._trigramIndex = TrigramIndex(self.rows, self.column('cumTime'))
+        return self._trigramIndex
+
+
+    def callers(self, pos):
+        """ Returns a list of (caller position, edge) tuples of the row at position pos.
+
+            The edge is a (numCalls, numPrimCalls, time, cumTime) tuple with the statistics of the
+            calls from the caller. Callers that are not in the statistics are skipped.
+        """
+        if self._callerStarts is not None:
+            start, end = self._callerStarts[pos], self._callerStarts[pos + 1]
+            return list(zip(self._callerPositions[start:end],
+                            zip(*[edgeArray[start:end] for edgeArray in self._callerEdges])))
+        result = []
+        position = self.position
+        for callerKey, value in self.rows[pos].callers.items():
+            callerPos = position(callerKey)
+            if callerPos is not None:
+                result.append((callerPos, _edgeTuple(value)))
+        return result
+
+
+    def callees(self, pos):
+        """ Returns a list of (callee position, edge) tuples of the row at position pos.
+
+            The index of callees is created in one pass over all caller edges when first needed.
+        """
+        if self._callees is None:
+            with TIMING.span('indexCallees'):
+                callees = [[] for _ in range(len(self.rows))]
+                for callerPos, calleePos, edge in self.iterEdges():
+                    callees[callerPos].append((calleePos, edge))
+                self._callees = callees
+        return self._callees[pos]
+
+
+    def iterEdges(self):
+        """ Generator that yields a (caller position, callee position, edge) tuple per edge.
+        """
+        for calleePos in range(len(self.rows)):
+            for callerPos, edge in self.callers(calleePos):
+                yield callerPos, calleePos, edge
+
+
+    def rootWeights(self, minWeight=0.0):
+        """ Returns a list of (position, weight) tuples of the roots of the caller graph.
+
+            The weight of a function is the part of its cumulative time that is not accounted
+            for by the call edges from other functions. This is the complete cumulative time for
+            functions without callers (e.g. the main module), but also includes functions such
+            as exec that are called both from outside and from within the profiled code.
+            Functions with a weight less than or equal to minWeight are not returned.
+        """
+        roots = []
+        for pos, statRow in enumerate(self.rows):
+            calledTime = sum(edge[3] for callerPos, edge in self.callers(pos) if callerPos != pos)
+            weight = statRow.cumTime - calledTime
+            if weight > minWeight:
+                roots.append((pos, weight))
+        return roots
+
+
+
+class SearchIndex(object):
+    """ The lower case paths and function names of the rows, joined per row in one string and
+        grouped in chunks of rows.
+
+        A chunk is searched with a single itertools.compress over map(operator.contains, ...),
+        so that no Python code is executed per row. The path and function name are separated
+        by a null character, which filter texts don't contain, so that a search text can't
+        match across them.
+    """
+    SEPARATORS = ('\0', )
+
+    def __init__(self, rows, chunkSize=16384):
+        """ Constructor
+
+            :param rows: sequence of StatRows.
+            :param chunkSize: number of rows per chunk. The chunks can be searched in parallel.
+        """
+        self._chunks = [] # (position of first row, list with the text per row)
+        for firstPos in range(0, len(rows), chunkSize):
+            self._chunks.append((firstPos, [
+                "{}\0{}".format(statRow.lcFilePath, statRow.lcFunctionName)
+                for statRow in rows[firstPos:firstPos + chunkSize]]))
+
+
+    @property
+    def nChunks(self):
+        """ The number of chunks.
+        """
+        return len(self._chunks)
+
+
+    def searchChunk(self, chunkIdx, searchText):
+        """ Returns a sorted list with the positions of the rows of a chunk of which the path
+            or function name contains the (lower case) search text.
+        """
+        firstPos, texts = self._chunks[chunkIdx]
+        return list(itertools.compress(
+            range(firstPos, firstPos + len(texts)),
+            map(operator.contains, texts, itertools.repeat(searchText))))
+
+
+
+def compactStats(stats, minCumTime):
+    """ Collapses the functions with a cumulative time less than minCumTime into one row per
+        file. Files with only one such function are left as they are.
+
+        The "other" row of a file has line number 0 and function name '<other (N functions)>'.
+        Its calls and times are the sums of those of the collapsed functions (so its
+        cumulative time can include calls between them twice). Callers are rewired: calls
+        from collapsed functions become calls from the "other" row of their file, and the
+        edges that end up between the same rows are summed. Calls between collapsed functions
+        of the same file are dropped, so that they don't show up as recursion.
+
+        :param stats: pstats stats dictionary. It's not changed.
+        :returns: (new stats dictionary, number of collapsed functions) tuple.
+    """
+    collapsedFiles = {key: key[0] for key, value in stats.items() if value[3] < minCumTime}
+    otherKeyOfFile = {filePath: (filePath, 0, "<other ({} functions)>".format(nFunctions))
+                      for filePath, nFunctions
+                      in collections.Counter(collapsedFiles.values()).items() if nFunctions > 1}
+    keyMap = {key: otherKeyOfFile[filePath] for key, filePath in collapsedFiles.items()
+              if filePath in otherKeyOfFile}
+    if not keyMap:
+        return stats, 0
+    mapKey = keyMap.get
+
+    result = {}
+    otherRows = {} # other key -> [primitive calls, calls, time, cumulative time, callers]
+    for key, (nPrimCalls, nCalls, time, cumTime, callers) in stats.items():
+        newKey = mapKey(key, key)
+        isCollapsed = newKey is not key
+        if isCollapsed:
+            otherRow = otherRows.get(newKey)
+            if otherRow is None:
+                otherRow = otherRows[newKey] = [0, 0, 0.0, 0.0, {}]
+            otherRow[0] += nPrimCalls
+            otherRow[1] += nCalls
+            otherRow[2] += time
+            otherRow[3] += cumTime
+            newCallers = otherRow[4]
+        else:
+            newCallers = {}
+            result[key] = (nPrimCalls, nCalls, time, cumTime, newCallers)
+
+        _mergeCallers(newCallers, callers, mapKey, skipKey=newKey if isCollapsed else None)
+
+    for otherKey, otherRow in otherRows.items():
+        result[otherKey] = tuple(otherRow)
+    return result, len(keyMap)
+
+
+def normalizeStats(stats, normalizePath):
+    """ Replaces the file paths of the keys by their normalized paths.
+
+        The paths are normalized once per distinct path, not per row. Functions of which the
+        keys become equal are merged, like pstats does when adding profiles: their calls and
+        times are summed, as are the edges from the same callers.
+
+        :param stats: pstats stats dictionary. It's not changed.
+        :param normalizePath: function that returns the normalized path of a file path.
+        :returns: (new stats dictionary, number of merged functions, paths) tuple. Paths is a
+            dictionary with the normalized path of each file path that is changed, in the order
+            in which the paths first occur in stats.
+    """
+    newPaths = {}
+    for filePath in dict.fromkeys(key[0] for key in stats):
+        newPath = normalizePath(filePath)
+        if newPath != filePath:
+            newPaths[filePath] = newPath
+    if not newPaths:
+        return stats, 0, newPaths
+
+    keyMap = {key: (newPaths[key[0]], key[1], key[2]) for key in stats if key[0] in newPaths}
+    mapKey = keyMap.get
+
+    result = {}
+    for key, (nPrimCalls, nCalls, time, cumTime, callers) in stats.items():
+        newKey = mapKey(key, key)
+        existing = result.get(newKey)
+        if existing is None:
+            newCallers = {}
+            result[newKey] = (nPrimCalls, nCalls, time, cumTime, newCallers)
+        else:
+            newCallers = existing[4]
+            result[newKey] = (existing[0] + nPrimCalls, existing[1] + nCalls,
+                              existing[2] + time, existing[3] + cumTime, newCallers)
+        _mergeCallers(newCallers, callers, mapKey)
+
+    return result, len(stats) - len(result), newPaths
+
+
+def _mergeCallers(newCallers, callers, mapKey, skipKey=None):
+    """ Adds the edges of a callers dictionary to newCallers, with the caller keys replaced by
+        mapKey(key, key). Edges that end up from the same caller are summed. Edges from the
+        skipKey are left out.
+    """
+    for callerKey, value in callers.items():
+        newCallerKey = mapKey(callerKey, callerKey)
+        if newCallerKey == skipKey:
+            continue
+        existing = newCallers.get(newCallerKey)
+        if existing is None:
+            newCallers[newCallerKey] = value
+        else:
+            newCallers[newCallerKey] = tuple(
+                map(operator.add, _edgeTuple(existing), _edgeTuple(value)))
+
+
+def denseRanks(values):
+    """ Returns an array('i') with per value its rank in the sorted (distinct) values.
+    """
+    ranks = array('i', [0]) * len(values)
+    rank = -1
+    previous = None
+    for pos in sorted(range(len(values)), key=values.__getitem__):
+        value = values[pos]
+        if rank < 0 or value != previous:
+            rank += 1
+            previous = value
+        ranks[pos] = rank
+    return ranks
+
+
+def _edgeTuple(value):
+    """ Converts the value of a pstats callers dictionary to a (nc, cc, tt, ct) tuple.
+
+        Old profile files only contain the number of calls.
+    """
+    if isinstance(value, tuple):
+        return value
+    return (value, value, 0.0, 0.0)
+
+
+# Number of bytes of a value of a callers dictionary: a tuple with two ints and two floats.
+# The ints are usually small, and therefore shared, so they are not counted.
+_EDGE_VALUE_SIZE = sys.getsizeof((0, 0, 0.0, 0.0)) + 2 * sys.getsizeof(0.0)
+
+
+def _arraySize(arr):
+    """ Returns the number of bytes of the buffer of an array.
+    """
+    return arr.buffer_info()[1] * arr.itemsize
+
+
+
+class StatsStoreRegistry(object):
+    """ Keeps track of the loaded stores so that each file is only loaded once.
+
+        Stores are reference counted. A store is removed from the registry when the last user
+        releases it. A file that has been modified since it was loaded is loaded again.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        # (path, modification time, size, compact time, path normalizer, low memory)
+        #     -> [store, reference count]
+        self._entries = {}
+
+
+    def acquire(self, fileName, lowMemory=False, compactTime=0.0, pathNormalizer=None):
+        """ Returns the store of a file and increments its reference count.
+
+            The file is only loaded if it's not in the registry yet. Stores of the same file
+            with a different lowMemory, compactTime or pathNormalizer are not shared.
+        """
+        if pathNormalizer is not None and pathNormalizer.isIdentity:
+            pathNormalizer = None
+        key = file_version_key(fileName) + (compactTime, pathNormalizer, bool(lowMemory))
+        entry = self._entries.get(key)
+        if entry is None:
+            logger.debug("Loading store: {}".format(fileName))
+            with TIMING.span('hashFile'):
+                contentHash = file_content_hash(fileName)
+            with TIMING.span('readPstats'):
+                statsObject = pstats.Stats(fileName)
+            with TIMING.span('createStore'):
+                store = StatsStore(statsObject, fileName=fileName, contentHash=contentHash,
+                                   lowMemory=lowMemory, compactTime=compactTime,
+                                   pathNormalizer=pathNormalizer)
+            entry = [store, 0]
+            self._entries[key] = entry
+        else:
+            logger.debug("Sharing store: {}".format(fileName))
+
+        entry[1] += 1
+        return entry[0]
+
+
+    def release(self, store):
+        """ Decrements the reference count of the store. Removes it when it drops to zero.
+
+            Does nothing if store is None or not in the registry.
+        """
+        for key, entry in list(self._entries.items()):
+            if entry[0] is store:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    logger.debug("Removing store: {}".format(store.fileName))
+                    del self._entries[key]
+                return
+
+
+    def referenceCount(self, store):
+        """ Returns the number of users of the store (0 if it's not in the registry).
+        """
+        for entry in self._entries.values():
+            if entry[0] is store:
+                return entry[1]
+        return 0
+
+
+# The registry with the stores that are used by the main windows.
+STORE_REGISTRY = StatsStoreRegistry()
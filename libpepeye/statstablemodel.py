@@ -5,80 +5,22 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
+import itertools
 import logging
-import os
 import pstats
 
+from array import array
+
 from .qt import QtCore, QtWidgets, Qt
+from .snapshots import SnapshotSeries, METRIC_CUM_TIME
+from .query import TIE_BREAKER, filterStoreRows, rankArray, sortedPositions
+from .statsstore import StatsStore, denseRanks
+from .timing import TIMING
 from .utils import check_class
     
 logger = logging.getLogger(__name__)
 
 
-class StatRow(object):
-    """ Class that contains the data for one profile statistic
-    """
-    def __init__(self, statsKey, statsValue):
-        """ Constructor which is initialized from a key, value pair of a pstats.stats
-            dictionary.
-            
-            :param stats_key: (file, line_nr, function) tuple
-            :param stats_value: (prim_calls, n_calls, time, cum_time, caller_dict) tuple
-        """
-        (self.filePath, self.lineNr, self.functionName) = statsKey
-        (self.numPrimCalls, self.numCalls, self.time, self.cumTime, self.callers) = statsValue
-
-        self.fileName = os.path.basename(self.filePath)
-        
-        self.timePerCall = self.time / self.numCalls
-        self.cumTimePerCall = self.cumTime / self.numPrimCalls
-
-        self.lcFileName = self.fileName.lower()
-        self.lcFilePath = self.filePath.lower()
-        self.lcFunctionName = self.functionName.lower()
-
-    # Sorting keys. Use (path, line, function name) as tie breaker. Note that path can be '~' for
-    # built in methods, that's why function name is included in the tie breaker.
-
-
-    @classmethod
-    def keyPathAndLine(cls, statRow):
-        return (statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyFileAndLine(cls, statRow):
-        return (statRow.lcFileName, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyFunctionName(cls, statRow):
-        return (statRow.lcFunctionName, statRow.lcFilePath, statRow.lineNr)
-
-    @classmethod
-    def keyNumCalls(cls, statRow):
-        return (statRow.numCalls, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyTime(cls, statRow):
-        return (statRow.time, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyTimePerCall(cls, statRow):
-        return (statRow.timePerCall, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyNumPrimCalls(cls, statRow):
-        return (statRow.numPrimCalls, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyCumTime(cls, statRow):
-        return (statRow.cumTime, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-    @classmethod
-    def keyCumTimePerCall(cls, statRow):
-        return (statRow.cumTimePerCall, statRow.lcFilePath, statRow.lineNr, statRow.lcFunctionName)
-
-
-
 class StatsTableModel(QtCore.QAbstractTableModel):
     """ Model for a table view to access pstats from the Python profiles
     """
@@ -91,7 +33,19 @@ class StatsTableModel(QtCore.QAbstractTableModel):
     COL_NUM_PRIM_CALLS = 6
     COL_CUM_TIME = 7
     COL_CUM_TIME_PER_CALL = 8
+    COL_TREND = 9
+    COL_GROWTH = 10
+    COL_VARIANCE = 11
+    COL_RECURSION_DEPTH = 12
+    COL_RECURSIVE_SHARE = 13
+    COL_PARENT_SHARE = 14
+    COL_TOTAL_PERCENT = 15
 
+    # Columns that are only filled when a snapshot series is set.
+    SERIES_COLUMNS = (COL_TREND, COL_GROWTH, COL_VARIANCE)
+
+    # Role that returns the list of values over the snapshots (for the trend column).
+    SERIES_ROLE = Qt.UserRole + 1
 
     HEADER_LABELS = [
         'path:line',
@@ -102,40 +56,99 @@ class StatsTableModel(QtCore.QAbstractTableModel):
         'time per call',
         'primitive calls',
         'Σ time',           # cumulative time
-        'Σ time per call'
+        'Σ time per call',
+        'trend',
+        'growth',
+        'variance',
+        'recursion depth',
+        'recursive %',
+        'parent %',
+        'total %',
     ]
 
-    SORT_KEY_METHODS = [
-        StatRow.keyPathAndLine,
-        StatRow.keyFileAndLine,
-        StatRow.keyFunctionName,
-        StatRow.keyNumCalls,
-        StatRow.keyTime,
-        StatRow.keyTimePerCall,
-        StatRow.keyNumPrimCalls,
-        StatRow.keyCumTime,
-        StatRow.keyCumTimePerCall
+    # Per column the name of the column in query.SORT_KEYS (or the series column name).
+    SORT_NAMES = [
+        'filePath',
+        'fileName',
+        'functionName',
+        'numCalls',
+        'time',
+        'timePerCall',
+        'numPrimCalls',
+        'cumTime',
+        'cumTimePerCall',
+        'trend',
+        'growth',
+        'variance',
+        'recursionDepth',
+        'recursiveShare',
+        'parentShare',
+        'totalPercent',
     ]
 
-    def __init__(self, parent=None):
+    # Columns that are sorted in ascending order when they are added as sort column.
+    TEXT_COLUMNS = (COL_PATH_LINE, COL_FILE_LINE, COL_FUNCTION)
+
+    def __init__(self, parent=None, topK=None):
         """ Constructor
         
-            :param stats: profiler statistics object.
-            :type  stats: pstats.Stats
+            :param topK: If set, only the first topK rows are sorted and shown at first.
+                Further rows are sorted and fetched in pages of topK rows when the user
+                scrolls down. Use None to always sort all rows.
         """
         super(StatsTableModel, self).__init__(parent)
 
         self._nCols = len(self.HEADER_LABELS)
         self._sortColumn = 0
         self._sortOrder = Qt.AscendingOrder
+        self._secondarySortColumns = [] # (column, order) tuples, applied after the sort column
         self._filterText = ""
-
-
-        # These attributes will be set in setStats        
-        self._statsObject = None
-        self._statRows = []
-        self._orgRows = []
-        self._nRows = 0
+        self._filterWorkers = 1
+        self._topK = self._checkTopK(topK)
+
+        self._series = None           # SnapshotSeries or None
+        self._seriesMetric = METRIC_CUM_TIME
+        self._seriesIndex = {}        # StatRow -> function index in the series
+        self._seriesGrowth = {}       # StatRow -> growth of the series metric
+        self._seriesVariance = {}     # StatRow -> variance of the series metric
+        self._seriesRanks = {}        # series column -> array with the rank per row
+
+
+        # These attributes will be set in setStore
+        self._store = None       # shared by all models that show the same file.
+        self._statRows = []      # the sorted rows. In top-k mode only a prefix is sorted.
+        self._filteredRows = []  # the rows that pass the filter, in arbitrary order
+        self._orgRows = ()       # the rows of the store. Must not be changed.
+        self._nRows = 0          # the number of rows that are exposed to the views
+        self._rowOfItem = None   # StatRow -> row number. Created when needed, see indexForItem.
+
+        # The row index is invalid as soon as the exposed rows change.
+        for signal in (self.modelReset, self.layoutChanged, self.rowsInserted, self.rowsRemoved):
+            signal.connect(self._clearRowIndex)
+
+        # Number of data() calls. Only counted when timing spans are recorded.
+        self.nDataCalls = 0
+
+        # Per column a function that returns the text of a StatRow.
+        self._formatters = [
+            lambda stat: "{}:{}".format(stat.filePath, stat.lineNr),  # COL_PATH_LINE
+            lambda stat: "{}:{}".format(stat.fileName, stat.lineNr),  # COL_FILE_LINE
+            lambda stat: stat.functionName,                           # COL_FUNCTION
+            lambda stat: str(stat.numCalls),                          # COL_NUM_CALLS
+            lambda stat: "{:.3f}".format(stat.time),                  # COL_TIME
+            lambda stat: "{:.7f}".format(stat.timePerCall),           # COL_TIME_PER_CALL
+            lambda stat: str(stat.numPrimCalls),                      # COL_NUM_PRIM_CALLS
+            lambda stat: "{:.3f}".format(stat.cumTime),               # COL_CUM_TIME
+            lambda stat: "{:.7f}".format(stat.cumTimePerCall),        # COL_CUM_TIME_PER_CALL
+            lambda stat: "",                                          # COL_TREND
+            self._formatGrowth,                                       # COL_GROWTH
+            self._formatVariance,                                     # COL_VARIANCE
+            lambda stat: "{:.2f}".format(stat.recursionDepth),        # COL_RECURSION_DEPTH
+            lambda stat: "{:.1f}".format(stat.recursiveShare),        # COL_RECURSIVE_SHARE
+            lambda stat: "{:.1f}".format(stat.parentShare),           # COL_PARENT_SHARE
+            lambda stat: "{:.2f}".format(stat.totalPercent),          # COL_TOTAL_PERCENT
+        ]
+        assert len(self._formatters) == self._nCols, "BUG: formatter per column expected"
 
         self._toolTips = {
             self.COL_PATH_LINE: "Path to file plus line number",
@@ -151,6 +164,15 @@ class StatsTableModel(QtCore.QAbstractTableModel):
                                "recursive functions.",
             self.COL_CUM_TIME_PER_CALL: "Cumulative (Σ) time divided by the number of primitive "
                                         "calls",
+            self.COL_TREND: "The trend metric over the snapshots of the series",
+            self.COL_GROWTH: "Difference of the trend metric between the last and first snapshot",
+            self.COL_VARIANCE: "Variance of the trend metric over the snapshots",
+            self.COL_RECURSION_DEPTH: "Estimated recursion depth: the number of calls divided by "
+                                      "the number of primitive calls (1 if not recursive)",
+            self.COL_RECURSIVE_SHARE: "Percentage of the calls that are recursive",
+            self.COL_PARENT_SHARE: "Time as percentage of the Σ time of the main caller "
+                                   "(the caller that accounts for most of the Σ time)",
+            self.COL_TOTAL_PERCENT: "Σ time as percentage of the total time of the profile",
         }
 
     @property
@@ -159,7 +181,7 @@ class StatsTableModel(QtCore.QAbstractTableModel):
         return self.HEADER_LABELS
         
 
-    def setStats(self, statsObject):
+    def setStats(self, statsObject, rowOrderState=None):
         """ Sets the statistics
         
             The statsObject.stats attribute is a dictionary where the keys consist of a 
@@ -167,36 +189,336 @@ class StatsTableModel(QtCore.QAbstractTableModel):
             (primitive_calls, n_calls, time, cumulative_time, caller_dict) tuple
 
             Primitive calls are calls that where not induced via recursion
+
+            The statistics are put in a new store that is not shared with other models. Use
+            setStore to share a store.
         
             :param statsObject: profiler statistics. Use None to clear.
             :type  statsObject: pstats.Stats or None
+            :param rowOrderState: row order that was previously obtained with rowOrderState()
+                for the same statistics. If given, the sort order, filter and rows are restored
+                from it instead of being recomputed.
         """
         check_class(statsObject, pstats.Stats, allow_none=True)
+        store = None if statsObject is None else StatsStore(statsObject)
+        self.setStore(store, rowOrderState=rowOrderState)
+
+
+    @property
+    def store(self):
+        """ The StatsStore with the rows of this model. Can be None.
+        """
+        return self._store
+
+
+    @TIMING.timed('setStore')
+    def setStore(self, store, rowOrderState=None):
+        """ Sets the store with the statistics. The model only keeps its own sort order and
+            filter result, the rows themselves are shared with the other users of the store.
+
+            :param store: store with the statistics. Use None to clear.
+            :type  store: StatsStore or None
+            :param rowOrderState: row order that was previously obtained with rowOrderState()
+                for the same statistics. If given, the sort order, filter and rows are restored
+                from it instead of being recomputed.
+        """
+        check_class(store, StatsStore, allow_none=True)
         self.beginResetModel()
-        if statsObject is None:
-            self._statsObject = None
-            self._orgRows = []   # the unfiltered rows
-            self._statRows = []  # the filtered rows
+        self._store = store
+        self._orgRows = () if store is None else store.rows
+        self._statRows = list(self._orgRows)
+        self._filteredRows = self._statRows
+        self._nRows = len(self._statRows)
+        self._updateSeriesStats()
+
+        self.endResetModel()
+
+        if rowOrderState is None or not self._restoreRowOrder(rowOrderState):
+            self._sortAndFilter()
+
+
+    @property
+    def series(self):
+        """ The SnapshotSeries that is used for the series columns. Can be None.
+        """
+        return self._series
+
+
+    @property
+    def seriesMetric(self):
+        """ The metric of the series columns (one of the snapshots.METRIC_* constants).
+        """
+        return self._seriesMetric
+
+
+    def setSeries(self, series, metric=None):
+        """ Sets the series of snapshots that fills the trend, growth and variance columns.
+
+            Call this again after adding snapshots to the series. The rows are sorted again.
+
+            :param series: the snapshot series. Use None to clear.
+            :type  series: SnapshotSeries or None
+            :param metric: the metric of the series columns. If None, the metric is unchanged.
+        """
+        check_class(series, SnapshotSeries, allow_none=True)
+        self._series = series
+        if metric is not None:
+            self._seriesMetric = metric
+        self._updateSeriesStats()
+        self._sortAndFilter()
+
+
+    def setSeriesMetric(self, metric):
+        """ Sets the metric of the series columns (one of the snapshots.METRIC_* constants).
+        """
+        self.setSeries(self._series, metric=metric)
+
+
+    @TIMING.timed('updateSeriesStats')
+    def _updateSeriesStats(self):
+        """ Looks up the rows in the series and stores their growth and variance.
+        """
+        self._seriesIndex = {}
+        self._seriesGrowth = {}
+        self._seriesVariance = {}
+        self._seriesRanks = {}
+        if self._series is None:
+            return
+        storeNormalizer = None if self._store is None else self._store.pathNormalizer
+        if self._series.pathNormalizer != storeNormalizer:
+            # The keys can't be compared. The series must be read again (see MainWindow).
+            logger.debug("The series and the store have different path normalizers")
+            return
+
+        growth = self._series.growth(self._seriesMetric)
+        variance = self._series.variance(self._seriesMetric)
+        indexOfKey = self._series.indexOfKey
+        for statRow in self._orgRows:
+            idx = indexOfKey(statRow.key)
+            if idx is not None:
+                self._seriesIndex[statRow] = idx
+                self._seriesGrowth[statRow] = growth[idx]
+                self._seriesVariance[statRow] = variance[idx]
+
+
+    def rowOrderState(self):
+        """ Returns the sort order, filter and resulting row order as a dictionary.
+
+            The rows are stored as arrays of positions in the statsObject.stats dictionary. The
+            filteredRows array is None if all filtered rows are sorted.
+        """
+        positions = {statRow: pos for pos, statRow in enumerate(self._orgRows)}
+        sortedRows = array('i', map(positions.__getitem__, self._statRows))
+        if self._statRows is self._filteredRows:
+            filteredRows = None
         else:
-            self._statsObject = statsObject
-            self._orgRows = [StatRow(k, v) for (k, v) in statsObject.stats.items()]
-            self._statRows = self._orgRows
+            filteredRows = array('i', map(positions.__getitem__, self._filteredRows))
+
+        return {'nOrgRows': len(self._orgRows),
+                'sortColumn': self._sortColumn,
+                'sortOrder': int(self._sortOrder),
+                'secondarySortColumns': [[col, int(order)]
+                                         for col, order in self._secondarySortColumns],
+                'filterText': self._filterText,
+                'nRows': self._nRows,
+                'sortedRows': sortedRows,
+                'filteredRows': filteredRows}
+
+
+    @TIMING.timed('restoreRowOrder')
+    def _restoreRowOrder(self, state):
+        """ Restores the row order from a state that was obtained with rowOrderState.
 
+            Returns False if the state doesn't match the statistics (e.g. the number of rows
+            differs) or if it only contains a sorted prefix while top-k mode is off.
+        """
+        isPartial = state['filteredRows'] is not None
+        if state['nOrgRows'] != len(self._orgRows) or (isPartial and not self._topK):
+            logger.debug("Row order state doesn't match, sorting and filtering again.")
+            return False
+
+        self.beginResetModel()
+        getRow = self._orgRows.__getitem__
+        self._sortColumn = state['sortColumn']
+        self._sortOrder = Qt.SortOrder(state['sortOrder'])
+        self._secondarySortColumns = [(col, Qt.SortOrder(order))
+                                      for col, order in state.get('secondarySortColumns', [])]
+        self._filterText = state['filterText']
+        self._statRows = list(map(getRow, state['sortedRows']))
+        if isPartial:
+            self._filteredRows = list(map(getRow, state['filteredRows']))
+            self._nRows = min(state['nRows'], len(self._statRows))
+        else:
+            self._filteredRows = self._statRows
+            self._nRows = len(self._statRows)
         self.endResetModel()
+        return True
+
 
+    def setSortAndFilterOptions(self, sortColumn, sortOrder, filterText,
+                                secondarySortColumns=()):
+        """ Sets the sort column, sort order and filter text without applying them.
+
+            They will be applied when new statistics are set.
+
+            :param secondarySortColumns: (column, order) tuples of the columns that order the
+                rows that are equal in the sort column.
+        """
+        self._sortColumn = sortColumn
+        self._sortOrder = sortOrder
+        self._secondarySortColumns = list(secondarySortColumns)
+        self._filterText = filterText
+
+
+    @property
+    def sortColumn(self):
+        """ The column on which the rows are sorted.
+        """
+        return self._sortColumn
+
+
+    @property
+    def sortOrder(self):
+        """ The order (Qt.AscendingOrder or Qt.DescendingOrder) in which the rows are sorted.
+        """
+        return self._sortOrder
+
+
+    @property
+    def sortColumns(self):
+        """ List of (column, order) tuples of all sort columns, the most significant first.
+        """
+        return [(self._sortColumn, self._sortOrder)] + self._secondarySortColumns
+
+
+    def setSortColumns(self, sortColumns):
+        """ Sorts the model on several columns.
+
+            :param sortColumns: list of (column, order) tuples, the most significant first.
+        """
+        logger.debug("setSortColumns: {}".format(sortColumns))
+        self._sortColumn, self._sortOrder = sortColumns[0]
+        self._secondarySortColumns = list(sortColumns[1:])
+        self.headerDataChanged.emit(Qt.Horizontal, 0, self._nCols - 1)
         self._sortAndFilter()
 
 
+    def addSortColumn(self, column):
+        """ Adds a column as the least significant sort column. Reverses its order if the
+            column is already sorted on.
+
+            Text columns are added in ascending order, the other columns in descending order.
+        """
+        sortColumns = self.sortColumns
+        for idx, (col, order) in enumerate(sortColumns):
+            if col == column:
+                sortColumns[idx] = (col, Qt.AscendingOrder if order == Qt.DescendingOrder
+                                    else Qt.DescendingOrder)
+                break
+        else:
+            sortColumns.append((column, Qt.AscendingOrder if column in self.TEXT_COLUMNS
+                                else Qt.DescendingOrder))
+        self.setSortColumns(sortColumns)
+
+
+    @property
+    def filterText(self):
+        """ The text on which the rows are filtered.
+        """
+        return self._filterText
+
+
     def unfilteredRowCount(self, parent=None, *args, **kwargs):
         """ Returns the number of unfiltered rows in the model.
         """
         return len(self._orgRows)
 
 
+    def statRowsForFile(self, filePath):
+        """ Returns a list with the StatRows of all functions that are defined in filePath.
+        """
+        if self._store is None:
+            return []
+        return self._store.rowsForFile(filePath)
+
+
+    def filteredRowCount(self):
+        """ Returns the number of rows that pass the filter.
+
+            In top-k mode this can be larger than the rowCount because not all rows are fetched.
+        """
+        return len(self._filteredRows)
+
+
     def rowCount(self, parent=None, *args, **kwargs):
         """ Returns the number of rows in the model. (this depends on the filter)
         """
-        return len(self._statRows)
+        return self._nRows
+
+
+    @property
+    def topK(self):
+        """ The number of rows that is sorted and fetched at once. None if all rows are sorted.
+        """
+        return self._topK
+
+
+    @staticmethod
+    def _checkTopK(topK):
+        """ Returns topK if it is None or a positive number. Raises a ValueError otherwise.
+        """
+        if topK is not None and topK < 1:
+            raise ValueError("topK must be at least 1, got: {}".format(topK))
+        return topK
+
+
+    def setTopK(self, topK):
+        """ Sets the number of rows that is sorted and fetched at once. Use None to sort all.
+        """
+        logger.debug("setTopK: {}".format(topK))
+        self._topK = self._checkTopK(topK)
+        self._sortAndFilter()
+
+
+    @property
+    def filterWorkers(self):
+        """ The number of threads that search the chunks of rows when filtering.
+        """
+        return self._filterWorkers
+
+
+    def setFilterWorkers(self, workers):
+        """ Sets the number of threads that search the chunks of rows when filtering.
+
+            See query.filterPositions. Takes effect the next time the rows are filtered.
+        """
+        logger.debug("setFilterWorkers: {}".format(workers))
+        self._filterWorkers = max(1, workers)
+
+
+    def canFetchMore(self, parent):
+        """ Returns True if there are rows that pass the filter but are not yet fetched.
+        """
+        return self._nRows < len(self._filteredRows)
+
+
+    @TIMING.timed('fetchMore')
+    def fetchMore(self, parent):
+        """ Sorts and exposes the next page of topK rows.
+        """
+        nTotal = len(self._filteredRows)
+        nNew = min(self._nRows + (self._topK or nTotal), nTotal)
+        if nNew <= self._nRows:
+            return
+
+        if nNew > len(self._statRows):
+            # Sort at least twice as many rows as before to keep the amortized costs low.
+            self._statRows = self._sortedPrefix(max(nNew, 2 * len(self._statRows)))
+
+        logger.debug("fetchMore: rows {} to {} of {}".format(self._nRows, nNew, nTotal))
+        self.beginInsertRows(QtCore.QModelIndex(), self._nRows, nNew - 1)
+        self._nRows = nNew
+        self.endInsertRows()
 
 
     def columnCount(self, parent=None, *args, **kwargs):
@@ -210,6 +532,9 @@ class StatsTableModel(QtCore.QAbstractTableModel):
     def data(self, index, role=None):
         """ Returns the data stored under the given role for the item referred to by the index.
         """
+        if TIMING.enabled:
+            self.nDataCalls += 1
+
         if not index.isValid():
             return None
 
@@ -223,52 +548,80 @@ class StatsTableModel(QtCore.QAbstractTableModel):
             return None
         
         if role == Qt.TextAlignmentRole:
-            # The cast to int is necessary to avoid a bug in PySide, See:
-            # https://bugreports.qt-project.org/browse/PYSIDE-20
-            if col <= 2:
-                return int(Qt.AlignLeft | Qt.AlignVCenter)
-            else:
-                return int(Qt.AlignRight | Qt.AlignVCenter)
-                
+            return self.columnAlignment(col)
+
         elif role == Qt.DisplayRole:
-            
-            stat = self._statRows[row]
-            
-            if col == StatsTableModel.COL_PATH_LINE:
-                return "{}:{}".format(stat.filePath, stat.lineNr)
-            elif col == StatsTableModel.COL_FILE_LINE:
-                #return "0x:{:08x}".format(id(stat)) # for debugging
-                return "{}:{}".format(stat.fileName, stat.lineNr)
-            elif col == StatsTableModel.COL_FUNCTION:
-                return stat.functionName
-            elif col == StatsTableModel.COL_NUM_CALLS:
-                return str(stat.numCalls)
-            elif col == StatsTableModel.COL_TIME:
-                return "{:.3f}".format(stat.time)
-            elif col == StatsTableModel.COL_TIME_PER_CALL:
-                return "{:.7f}".format(stat.timePerCall)
-            elif col == StatsTableModel.COL_NUM_PRIM_CALLS:
-                return str(stat.numPrimCalls)
-            elif col == StatsTableModel.COL_CUM_TIME:
-                return "{:.3f}".format(stat.cumTime)
-            elif col == StatsTableModel.COL_CUM_TIME_PER_CALL:
-                return "{:.7f}".format(stat.cumTimePerCall)
-            else:
-                assert False, "BUG: column number = {}".format(col)
+            return self._formatters[col](self._statRows[row])
+
+        elif role == StatsTableModel.SERIES_ROLE:
+            if col != StatsTableModel.COL_TREND:
+                return None
+            return self.seriesValues(row)
 
         else: # other display roles
             return None
 
 
+    def _formatGrowth(self, stat):
+        """ Returns the text of the growth column
+        """
+        growth = self._seriesGrowth.get(stat)
+        return "" if growth is None else "{:+.3f}".format(growth)
+
+
+    def _formatVariance(self, stat):
+        """ Returns the text of the variance column
+        """
+        variance = self._seriesVariance.get(stat)
+        return "" if variance is None else "{:.3g}".format(variance)
+
+
+    @staticmethod
+    def columnAlignment(col):
+        """ Returns the alignment of the text in a column.
+        """
+        # The cast to int is necessary to avoid a bug in PySide, See:
+        # https://bugreports.qt-project.org/browse/PYSIDE-20
+        if col <= StatsTableModel.COL_FUNCTION:
+            return int(Qt.AlignLeft | Qt.AlignVCenter)
+        else:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+
+    def columnTexts(self, col, firstRow, lastRow):
+        """ Returns a list with the texts of a column for the rows from firstRow up to (but not
+            including) lastRow.
+
+            This lets the view paint the visible rows with one call per column instead of a
+            data() call per cell and role.
+        """
+        lastRow = min(lastRow, self._nRows)
+        return list(map(self._formatters[col], self._statRows[firstRow:lastRow]))
+
+
+    def seriesValues(self, row):
+        """ Returns the values of the series metric of a row over the snapshots.
+
+            Returns None if there is no series or the function doesn't occur in it.
+        """
+        idx = self._seriesIndex.get(self._statRows[row])
+        return None if idx is None else self._series.values(idx, self._seriesMetric)
+
+
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         """ Returns the data for the given role and section in the header with the
             specified orientation.
         """
         if orientation == Qt.Horizontal:
             if role == Qt.DisplayRole:
+                for idx, (col, order) in enumerate(self._secondarySortColumns, start=2):
+                    if col == section:
+                        return "{} {}{}".format(self.HEADER_LABELS[section], idx,
+                                                "▼" if order == Qt.DescendingOrder else "▲")
                 return self.HEADER_LABELS[section]
             elif role == Qt.ToolTipRole:
-                return self._toolTips.get(section, "")
+                return "{}\n\nShift-click to also sort on this column.".format(
+                    self._toolTips.get(section, ""))
         else:
             if role == Qt.DisplayRole:
                 return str(section + 1)
@@ -280,9 +633,7 @@ class StatsTableModel(QtCore.QAbstractTableModel):
         """ ﻿Sorts the model by column in the given order.
         """
         logger.debug("sort col: {}, order: {}".format(column, order))
-        self._sortColumn = column
-        self._sortOrder = order
-        self._sortAndFilter()
+        self.setSortColumns([(column, order)])
 
 
     def filterRows(self, filterText):
@@ -296,24 +647,78 @@ class StatsTableModel(QtCore.QAbstractTableModel):
     def _sortAndFilter(self):
         """ Applies current filter and sorting options.
         """
-        logger.debug("_sortAndFilter col: {}, order: {}, filter: {!r}"
-                     .format(self._sortColumn, self._sortOrder, self._filterText))
-
-        self.beginResetModel()
-
-        if self._filterText:
-            text = self._filterText.lower()
-            self._statRows = [sr for sr in self._orgRows
-                              if (text in sr.lcFilePath or text in sr.lcFunctionName)]
-        else:
-            self._statRows = self._orgRows
-
-        check_class(self._statRows, list)
+        logger.debug("_sortAndFilter columns: {}, filter: {!r}"
+                     .format(self.sortColumns, self._filterText))
+
+        with TIMING.span('sortAndFilter', nRows=len(self._orgRows)):
+            self.beginResetModel()
+
+            with TIMING.span('filter', workers=self._filterWorkers):
+                # Always a copy because the rows of the store are shared and must not be reordered.
+                if self._store is None:
+                    self._statRows = []
+                else:
+                    self._statRows = filterStoreRows(self._store, self._filterText,
+                                                     workers=self._filterWorkers)
+
+            check_class(self._statRows, list)
+            self._filteredRows = self._statRows
+
+            with TIMING.span('sort', nRows=len(self._statRows)):
+                if self._topK:
+                    self._statRows = self._sortedPrefix(self._topK)
+                    self._nRows = min(self._topK, len(self._statRows))
+                else:
+                    self._statRows = self._sortedPrefix(len(self._filteredRows))
+                    self._nRows = len(self._statRows)
+
+            with TIMING.span('reset'):
+                self.endResetModel()
+
+
+    def _sortedPrefix(self, nRows):
+        """ Returns a list with the first nRows of the filtered rows in the current sort order.
+
+            The positions of the rows are selected or sorted on the rank arrays of the sort
+            columns (see query.sortedPositions). Rows that are equal in all sort columns are
+            ordered by path, line number and function name, also for descending columns. If
+            nRows is not small compared to the number of filtered rows, all filtered rows are
+            sorted in-place and returned as a whole.
+        """
+        store = self._store
+        if store is None:
+            return self._filteredRows
+
+        positions = store.positionsOfRows(self._filteredRows)
+        sortColumns = self.sortColumns
+        with TIMING.span('lexSort', nColumns=len(sortColumns), nRows=nRows):
+            positions = sortedPositions(
+                positions, nRows,
+                [self._rankArray(col) for col, _ in sortColumns] +
+                [rankArray(store, TIE_BREAKER)],
+                [order == Qt.DescendingOrder for _, order in sortColumns] + [False])
+
+        if len(positions) < len(self._filteredRows):
+            return list(map(store.rows.__getitem__, positions))
+        self._filteredRows[:] = map(store.rows.__getitem__, positions)
+        return self._filteredRows
+
+
+    def _rankArray(self, col):
+        """ Returns the array with the rank per row of the store in a column.
+
+            The rank arrays of the series columns are computed per model (and cached until the
+            series changes), the others are shared by all models of the store.
+        """
+        if col not in self.SERIES_COLUMNS:
+            return rankArray(self._store, self.SORT_NAMES[col])
 
-        # Sort the list of row in-place
-        key = self.SORT_KEY_METHODS[self._sortColumn]
-        self._statRows.sort(key=key, reverse=bool(self._sortOrder))
-        self.endResetModel()
+        ranks = self._seriesRanks.get(col)
+        if ranks is None:
+            values = self._seriesVariance if col == self.COL_VARIANCE else self._seriesGrowth
+            ranks = denseRanks([values.get(statRow, 0.0) for statRow in self._orgRows])
+            self._seriesRanks[col] = ranks
+        return ranks
 
 
     def itemAtIndex(self, index):
@@ -330,13 +735,59 @@ class StatsTableModel(QtCore.QAbstractTableModel):
         return self._statRows[row]
 
 
+    def findStatRow(self, statsKey):
+        """ Returns the StatRow with the (file, line_nr, function) key, or None if not found.
+        """
+        if self._store is None:
+            return None
+        return self._store.findRow(statsKey)
+
+
+    def _clearRowIndex(self, *_args):
+        """ Clears the row index of indexForItem.
+        """
+        self._rowOfItem = None
+
+
+    def indexForItem(self, statRow):
+        """ Returns index(row, 0) of the statRow, or an invalid index if it's not exposed.
+
+            Looks the row up in an index that is created at the first call after the rows have
+            changed. Use this for repeated lookups, e.g. when jumping to functions. A single
+            lookup is faster with findIndexForItem.
+        """
+        if self._rowOfItem is None:
+            with TIMING.span('rowIndex', nRows=self._nRows):
+                self._rowOfItem = {item: row for row, item
+                                   in enumerate(itertools.islice(self._statRows, self._nRows))}
+        row = self._rowOfItem.get(statRow)
+        return QtCore.QModelIndex() if row is None else self.createIndex(row, 0)
+
+
+    def fetchUntilExposed(self, statRow):
+        """ Returns the index of the statRow like indexForItem. In top-k mode, pages of rows
+            are fetched until the statRow is exposed.
+
+            Returns an invalid index if the statRow doesn't pass the filter.
+        """
+        index = self.indexForItem(statRow)
+        while not index.isValid() and self.canFetchMore(QtCore.QModelIndex()):
+            nOldRows = self._nRows
+            self.fetchMore(QtCore.QModelIndex())
+            try: # Only the new rows are searched.
+                index = self.createIndex(self._statRows.index(statRow, nOldRows, self._nRows), 0)
+            except ValueError:
+                pass
+        return index
+
+
     def findIndexForItem(self, statsRow):
         """ Searches through the rows for the statsRow item.
 
             Returns index(row, 0) if it found it. Otherwise returns invalid index.
         """
         try:
-            pos = self._statRows.index(statsRow)
+            pos = self._statRows.index(statsRow, 0, self._nRows)
         except ValueError:
             logger.debug("StatsRow not found: {}".format(statsRow))
             return QtCore.QModelIndex()
@@ -8,8 +8,9 @@ from __future__ import division
 import logging
 import sys
 
-from .qt import Qt, QtGui, QtWidgets
+from .qt import Qt, QtCore, QtGui, QtWidgets
 
+from .timing import TIMING
 from .utils import check_class
 from .statstablemodel import StatsTableModel
 from .togglecolumn import ToggleColumnTableView
@@ -18,7 +19,60 @@ from .togglecolumn import ToggleColumnTableView
 logger = logging.getLogger(__name__)
 
 
+class SparklineDelegate(QtWidgets.QStyledItemDelegate):
+    """ Paints the values of the SERIES_ROLE as a small line graph.
+    """
+    MARGIN = 3
+    LINE_COLOR = QtGui.QColor('#2060c0')
+
+    def paint(self, painter, option, index):
+        """ Paints the background and the sparkline.
+        """
+        super(SparklineDelegate, self).paint(painter, option, index)
+
+        if option.state & QtWidgets.QStyle.State_Selected:
+            color = option.palette.color(QtGui.QPalette.HighlightedText)
+        else:
+            color = self.LINE_COLOR
+
+        self.drawSparkline(painter, option.rect, index.data(StatsTableModel.SERIES_ROLE), color)
+
+
+    @classmethod
+    def drawSparkline(cls, painter, cellRect, values, color):
+        """ Draws the values as a line graph in the cell rectangle.
+
+            Does nothing if there are less than two values.
+        """
+        if not values or len(values) < 2:
+            return
+
+        rect = QtCore.QRectF(cellRect).adjusted(cls.MARGIN, cls.MARGIN, -cls.MARGIN, -cls.MARGIN)
+        minValue = min(values)
+        valueRange = (max(values) - minValue) or 1.0
+        xStep = rect.width() / (len(values) - 1)
+        points = [QtCore.QPointF(rect.left() + i * xStep,
+                                 rect.bottom() - (value - minValue) / valueRange * rect.height())
+                  for i, value in enumerate(values)]
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtGui.QPen(color, 1.2))
+        painter.drawPolyline(QtGui.QPolygonF(points))
+        painter.restore()
+
+
+
 class StatsTableView(ToggleColumnTableView):
+    """ Table view of the StatsTableModel.
+
+        By default the visible rows are painted by _paintRows instead of QTableView.paintEvent.
+        QTableView calls data() for every role of every visible cell; _paintRows gets the texts
+        with one model call per visible column and caches the elided texts per column width.
+        This keeps the cost of painting independent of the number of rows and small at large
+        window sizes.
+    """
+    MAX_ELIDE_CACHE_SIZE = 10000 # maximum number of elided texts that are cached per column
 
     def __init__(self, model:StatsTableModel, parent=None):
         """ Constructor
@@ -27,6 +81,8 @@ class StatsTableView(ToggleColumnTableView):
         check_class(model, StatsTableModel)
 
         self._selectedItem = None # last selected item before a model reset.
+        self._fastPaintEnabled = True
+        self._elideCaches = {}    # column -> (width, dictionary of text -> elided text)
 
         self.setModel(model)
         self._model = model
@@ -39,7 +95,11 @@ class StatsTableView(ToggleColumnTableView):
         #self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers) # needed?
         self.setAlternatingRowColors(True)
         self.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
-        self.addHeaderContextMenu(enabled = {'function': False}, checked = {})
+        self.addHeaderContextMenu(enabled = {'function': False}, checked = {
+            StatsTableModel.HEADER_LABELS[col]: False for col in StatsTableModel.SERIES_COLUMNS})
+
+        self._sparklineDelegate = SparklineDelegate(self)
+        self.setItemDelegateForColumn(StatsTableModel.COL_TREND, self._sparklineDelegate)
 
         # Set font so that all table cells have the same font size (was not the case one Windows 10)
         font = QtGui.QFont()
@@ -59,6 +119,7 @@ class StatsTableView(ToggleColumnTableView):
         tableHorHeader.setSectionsMovable(True)
         tableHorHeader.setTextElideMode(Qt.ElideMiddle)
         tableHorHeader.setStretchLastSection(False)
+        tableHorHeader.viewport().installEventFilter(self)
 
         # Setting vertical table header resize mode to fixed. Setting it to ResizeToContents is
         # slow because it then will read all the data items when displaying or sorting.
@@ -71,6 +132,181 @@ class StatsTableView(ToggleColumnTableView):
         self._model.modelReset.connect(self.onModelReset)
 
 
+    def setSeriesColumnsVisible(self, visible):
+        """ Shows or hides the trend, growth and variance columns.
+        """
+        actions = self.getHeaderContextMenuActions()
+        for col in StatsTableModel.SERIES_COLUMNS:
+            actions[col].setChecked(visible) # Also shows or hides the column
+
+
+    @property
+    def fastPaintEnabled(self):
+        """ True if the rows are painted by _paintRows instead of QTableView.paintEvent.
+        """
+        return self._fastPaintEnabled
+
+
+    def setFastPaintEnabled(self, enabled):
+        """ Enables or disables painting the rows with _paintRows.
+        """
+        self._fastPaintEnabled = enabled
+        self.viewport().update()
+
+
+    def eventFilter(self, watched, event):
+        """ Adds the column as sort column when the user shift-clicks on a header section.
+
+            The press and release events are consumed so that the header doesn't sort the
+            model on the column alone.
+        """
+        header = self.horizontalHeader()
+        if (watched is header.viewport() and
+                event.type() in (QtCore.QEvent.MouseButtonPress, QtCore.QEvent.MouseButtonRelease,
+                                 QtCore.QEvent.MouseButtonDblClick) and
+                event.button() == Qt.LeftButton and event.modifiers() & Qt.ShiftModifier):
+            col = header.logicalIndexAt(event.pos())
+            if col >= 0:
+                if event.type() == QtCore.QEvent.MouseButtonRelease:
+                    self._model.addSortColumn(col)
+                    header.blockSignals(True) # The order of the first column may be reversed
+                    try:
+                        header.setSortIndicator(self._model.sortColumn, self._model.sortOrder)
+                    finally:
+                        header.blockSignals(False)
+                return True
+        return super().eventFilter(watched, event)
+
+
+    def changeEvent(self, event):
+        """ Clears the elided texts when the font changes.
+        """
+        if event.type() == QtCore.QEvent.FontChange:
+            self._elideCaches.clear()
+        super().changeEvent(event)
+
+
+    def paintEvent(self, event):
+        """ Paints the visible cells. Records a timing span with the number of data() calls.
+        """
+        fastPaint = self._fastPaintEnabled and self._model.rowCount() > 0
+        paint = self._paintRows if fastPaint else super().paintEvent
+        if not TIMING.enabled:
+            return paint(event)
+
+        nDataCallsBefore = self._model.nDataCalls
+        with TIMING.span('paint', fastPaint=fastPaint) as span:
+            paint(event)
+            span.args['dataCalls'] = self._model.nDataCalls - nDataCallsBefore
+
+
+    def _elidedTexts(self, col, width, texts):
+        """ Returns the texts elided to the width. Uses the cache of the column.
+        """
+        cacheWidth, cache = self._elideCaches.get(col, (None, None))
+        if cacheWidth != width or len(cache) > self.MAX_ELIDE_CACHE_SIZE:
+            cache = {}
+            self._elideCaches[col] = (width, cache)
+
+        fontMetrics = self.fontMetrics()
+        elideMode = self.textElideMode()
+        result = []
+        for text in texts:
+            elidedText = cache.get(text)
+            if elidedText is None:
+                elidedText = cache[text] = fontMetrics.elidedText(text, elideMode, width)
+            result.append(elidedText)
+        return result
+
+
+    def _paintRows(self, event):
+        """ Paints the rows in the exposed rectangle of the viewport.
+
+            Draws the row backgrounds (alternating, selected), the texts of the visible columns
+            and the focus rectangle, which is what QTableView.paintEvent draws for this view.
+        """
+        model = self._model
+        exposedRect = event.rect()
+        firstRow = self.rowAt(exposedRect.top())
+        if firstRow < 0:
+            return # Below the last row
+        lastRow = self.rowAt(exposedRect.bottom())
+        if lastRow < 0:
+            lastRow = model.rowCount() - 1
+
+        header = self.horizontalHeader()
+        columns = [] # (column, x, width) tuples of the visible columns
+        for visualIdx in range(header.count()):
+            col = header.logicalIndex(visualIdx)
+            if header.isSectionHidden(col):
+                continue
+            x = self.columnViewportPosition(col)
+            width = self.columnWidth(col)
+            if x + width > exposedRect.left() and x <= exposedRect.right():
+                columns.append((col, x, width))
+
+        palette = self.palette()
+        colorGroup = QtGui.QPalette.Active if self.isActiveWindow() else QtGui.QPalette.Inactive
+        backgroundBrushes = (palette.brush(colorGroup, QtGui.QPalette.Base),
+                             palette.brush(colorGroup, QtGui.QPalette.AlternateBase))
+        highlightBrush = palette.brush(colorGroup, QtGui.QPalette.Highlight)
+        textColors = (palette.color(colorGroup, QtGui.QPalette.Text),
+                      palette.color(colorGroup, QtGui.QPalette.HighlightedText))
+        alternating = self.alternatingRowColors()
+        margin = self.style().pixelMetric(QtWidgets.QStyle.PM_FocusFrameHMargin, None, self) + 1
+
+        selectionModel = self.selectionModel()
+        rootIndex = self.rootIndex()
+        rows = range(firstRow, lastRow + 1)
+        rowTops = [self.rowViewportPosition(row) for row in rows]
+        rowHeights = [self.rowHeight(row) for row in rows]
+        selected = [selectionModel.isRowSelected(row, rootIndex) for row in rows]
+
+        painter = QtGui.QPainter(self.viewport())
+        try:
+            painter.setFont(self.font())
+
+            rowsRight = min(exposedRect.right(), header.length() - header.offset())
+            for row, top, height, isSelected in zip(rows, rowTops, rowHeights, selected):
+                if isSelected:
+                    brush = highlightBrush
+                else:
+                    brush = backgroundBrushes[alternating and row % 2]
+                painter.fillRect(QtCore.QRect(exposedRect.left(), top,
+                                              rowsRight - exposedRect.left() + 1, height), brush)
+
+            for col, x, width in columns:
+                if col == StatsTableModel.COL_TREND:
+                    for row, top, height, isSelected in zip(rows, rowTops, rowHeights, selected):
+                        color = textColors[1] if isSelected else SparklineDelegate.LINE_COLOR
+                        SparklineDelegate.drawSparkline(
+                            painter, QtCore.QRect(x, top, width, height),
+                            model.seriesValues(row), color)
+                    continue
+
+                texts = model.columnTexts(col, firstRow, lastRow + 1)
+                texts = self._elidedTexts(col, width - 2 * margin, texts)
+                alignment = model.columnAlignment(col)
+                penSelected = None
+                for text, top, height, isSelected in zip(texts, rowTops, rowHeights, selected):
+                    if isSelected is not penSelected:
+                        painter.setPen(textColors[isSelected])
+                        penSelected = isSelected
+                    painter.drawText(QtCore.QRect(x + margin, top, width - 2 * margin, height),
+                                     alignment, text)
+
+            currentIndex = self.currentIndex()
+            if self.hasFocus() and currentIndex.isValid() and currentIndex.row() in rows:
+                option = QtWidgets.QStyleOptionFocusRect()
+                option.initFrom(self)
+                option.rect = self.visualRect(currentIndex)
+                option.backgroundColor = palette.color(colorGroup, QtGui.QPalette.Highlight)
+                self.style().drawPrimitive(QtWidgets.QStyle.PE_FrameFocusRect, option,
+                                           painter, self)
+        finally:
+            painter.end()
+
+
     def onModelAboutToBeReset(self):
         """ ﻿This slot is called when a new item becomes the current item.
         """
@@ -82,6 +318,7 @@ class StatsTableView(ToggleColumnTableView):
             self._selectedItem = curItem
 
 
+    @TIMING.timed('viewReset')
     def onModelReset(self):
         """ Called when the statsTableModel is about to be reset.
 
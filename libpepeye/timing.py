@@ -0,0 +1,227 @@
+""" Lightweight timing spans to instrument pepeye itself.
+
+    Spans are kept in a fixed-size ring buffer. When recording is disabled, entering a span or
+    calling a timed function costs only a single attribute lookup.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import collections
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# A finished span. Start and duration are in seconds, depth is the nesting level (0 for the
+# outermost span) and args is a dictionary with extra information (e.g. the number of rows).
+Span = collections.namedtuple('Span', ['name', 'start', 'duration', 'depth', 'threadId', 'args'])
+
+
+class _NullSpan(object):
+    """ Context manager that does nothing. Returned when recording is disabled.
+    """
+    args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+
+class _ActiveSpan(object):
+    """ Context manager that records a span in the recorder when it exits.
+    """
+    __slots__ = ('recorder', 'name', 'args', 'start', 'depth')
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.start = None
+        self.depth = None
+
+    def __enter__(self):
+        local = self.recorder._local
+        self.depth = getattr(local, 'depth', 0)
+        local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        duration = time.perf_counter() - self.start
+        self.recorder._local.depth = self.depth
+        self.recorder._addSpan(Span(self.name, self.start, duration, self.depth,
+                                    threading.get_ident(), self.args))
+        return False
+
+
+
+class SpanRecorder(object):
+    """ Records timing spans in a ring buffer.
+
+        Use the span method as a context manager, or the timed method as a decorator.
+    """
+    def __init__(self, maxSpans=10000):
+        """ Constructor
+
+            :param maxSpans: the size of the ring buffer. Older spans are discarded.
+        """
+        self.enabled = False
+        self._spans = collections.deque(maxlen=maxSpans)
+        self._spansLock = threading.Lock() # Spans can finish in other threads, e.g. filtering.
+        self._local = threading.local()
+        self._listeners = []
+        self._epoch = time.perf_counter()
+
+
+    def setEnabled(self, enabled):
+        """ Enables or disables the recording of spans.
+        """
+        logger.debug("Timing spans enabled: {}".format(enabled))
+        self.enabled = bool(enabled)
+
+
+    def span(self, name, **args):
+        """ Returns a context manager that records the time spent in its body.
+
+            Keyword arguments are stored with the span. The args dictionary can also be updated
+            within the body, e.g. to store the number of processed rows.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _ActiveSpan(self, name, args)
+
+
+    def timed(self, name):
+        """ Decorator that records a span each time the decorated function is called.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _ActiveSpan(self, name, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+    def addListener(self, listener):
+        """ Adds a function that is called with (rootSpan, childSpans) each time an outermost
+            span finishes. The childSpans are the direct children of the root span.
+        """
+        self._listeners.append(listener)
+
+
+    def removeListener(self, listener):
+        """ Removes a listener that was added with addListener. Does nothing if it wasn't added.
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+
+    def _addSpan(self, span):
+        """ Stores the span in the ring buffer and notifies the listeners if it's a root span.
+        """
+        with self._spansLock:
+            self._spans.append(span)
+        if span.depth == 0 and self._listeners:
+            children = self.childSpans(span)
+            for listener in self._listeners:
+                listener(span, children)
+
+
+    def childSpans(self, span):
+        """ Returns the direct children of a span that is still in the ring buffer.
+
+            Children finish before their parents so they are searched backwards from the end.
+        """
+        children = []
+        for candidate in reversed(self.spans()):
+            if candidate.start < span.start:
+                break
+            if (candidate.depth == span.depth + 1 and candidate.threadId == span.threadId and
+                    candidate.start + candidate.duration <= span.start + span.duration):
+                children.append(candidate)
+        children.reverse()
+        return children
+
+
+    def spans(self):
+        """ Returns a list with the spans in the ring buffer, ordered by finishing time.
+
+            The list is a copy, so it can be iterated while other threads add spans.
+        """
+        with self._spansLock:
+            return list(self._spans)
+
+
+    def clear(self):
+        """ Removes all spans from the ring buffer.
+        """
+        with self._spansLock:
+            self._spans.clear()
+
+
+    def toJson(self):
+        """ Returns a JSON compatible list of dictionaries, one per span. Times are in ms.
+        """
+        return [{'name': span.name,
+                 'start': (span.start - self._epoch) * 1e3,
+                 'duration': span.duration * 1e3,
+                 'depth': span.depth,
+                 'thread': span.threadId,
+                 'args': span.args} for span in self.spans()]
+
+
+    def toChromeTrace(self):
+        """ Returns the spans as a dictionary in the Chrome trace event format.
+
+            The result can be loaded in chrome://tracing, Perfetto or speedscope.
+        """
+        pid = os.getpid()
+        events = [{'name': span.name,
+                   'ph': 'X',
+                   'ts': (span.start - self._epoch) * 1e6,
+                   'dur': span.duration * 1e6,
+                   'pid': pid,
+                   'tid': span.threadId,
+                   'args': span.args} for span in self.spans()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+    def dump(self, fileName, chromeTrace=False):
+        """ Writes the spans to a JSON file.
+
+            :param chromeTrace: if True, the Chrome trace event format is used.
+        """
+        contents = self.toChromeTrace() if chromeTrace else self.toJson()
+        logger.info("Saving {} timing spans to: {}".format(
+            len(contents['traceEvents'] if chromeTrace else contents), fileName))
+        with open(fileName, 'w') as fileObj:
+            json.dump(contents, fileObj)
+
+
+
+def formatSpanBreakdown(span, children):
+    """ Returns a one line string with the duration of a span and those of its children.
+    """
+    text = "{}: {:.1f} ms".format(span.name, span.duration * 1e3)
+    if children:
+        text += " ({})".format(", ".join("{} {:.1f} ms".format(child.name, child.duration * 1e3)
+                                         for child in children))
+    return text
+
+
+# The recorder that is used to instrument pepeye.
+TIMING = SpanRecorder()
@@ -1,6 +1,6 @@
 """ Routines that do type checking or create classes
 """
-import logging, numbers
+import hashlib, logging, numbers, os
 
 logger = logging.getLogger(__name__)
 
@@ -46,3 +46,23 @@ def environment_var_to_bool(env_var):
             return True
     else:
         return bool(env_var)
+
+
+def file_version_key(file_name):
+    """ Returns a (real path, modification time, size) tuple that changes when the file is
+        modified, without reading it.
+    """
+    file_stat = os.stat(file_name)
+    return (os.path.realpath(file_name), file_stat.st_mtime, file_stat.st_size)
+
+
+def file_content_hash(file_name, chunk_size=1024 * 1024):
+    """ Returns the hexadecimal BLAKE2 digest of the contents of a file.
+
+        The file is read in chunks so that large files don't have to fit into memory.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(file_name, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
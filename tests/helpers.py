@@ -0,0 +1,15 @@
+""" Helper functions for the tests
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import pstats
+
+
+def makeStatsObject(stats):
+    """ Returns a pstats.Stats object with a stats dictionary, e.g. as made by hand in a test.
+    """
+    statsObject = pstats.Stats()
+    statsObject.stats = stats
+    return statsObject
@@ -0,0 +1,154 @@
+""" Tests of the performance budget rules (libpepeye.checker)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from libpepeye.checker import (ERROR, FAILED, PASSED, GrowthRule, NewFunctionRule, RuleError,
+                               ThresholdRule, checkRules, parseRule, parseRules,
+                               writeJUnitReport)
+from libpepeye.statsstore import StatsStore
+from tests.helpers import makeStatsObject
+
+MAIN = ('/src/pkg/app.py', 1, 'main')
+PARSE = ('/src/pkg/parser.py', 10, 'parse')
+PARSE_OTHER = ('/src/other.py', 5, 'parse')
+HELPER = ('/src/pkg/helper.py', 3, 'helper')
+SORTED = ('~', 0, '<built-in method builtins.sorted>')
+
+
+def makeStore(parseCalls=10, parseCumTime=0.4, withHelper=False):
+    """ Returns a StatsStore of a small profile.
+    """
+    stats = {
+        MAIN: (1, 1, 0.1, 1.0, {}),
+        PARSE: (parseCalls, parseCalls, parseCumTime, parseCumTime,
+                {MAIN: (parseCalls, parseCalls, parseCumTime, parseCumTime)}),
+        PARSE_OTHER: (2, 2, 0.05, 0.05, {MAIN: (2, 2, 0.05, 0.05)}),
+        SORTED: (3, 3, 0.02, 0.02, {MAIN: (3, 3, 0.02, 0.02)}),
+    }
+    if withHelper:
+        stats[HELPER] = (1, 1, 0.3, 0.3, {MAIN: (1, 1, 0.3, 0.3)})
+    return StatsStore(makeStatsObject(stats))
+
+
+class TestParseRules(unittest.TestCase):
+
+    def testRuleTypes(self):
+        rule = parseRule("cumTime of pkg.parser:parse <= 500ms")
+        self.assertIsInstance(rule, ThresholdRule)
+        self.assertEqual(rule.attr, 'cumTime')
+        self.assertAlmostEqual(rule.value, 0.5)
+
+        rule = parseRule("ncalls of parse grew < 10%")
+        self.assertIsInstance(rule, GrowthRule)
+        self.assertEqual((rule.attr, rule.value), ('numCalls', 10.0))
+
+        rule = parseRule("no new function above 2% of total")
+        self.assertIsInstance(rule, NewFunctionRule)
+        self.assertEqual(rule.percentage, 2.0)
+
+    def testCommentsAndLineNumbers(self):
+        rules = parseRules(["# budget", "", "cumtime of main <= 1  # seconds",
+                            "total of main >= 50%"])
+        self.assertEqual([rule.lineNr for rule in rules], [3, 4])
+
+    def testInvalidRules(self):
+        for text in ["cumTime of main",                     # no limit
+                     "speed of main <= 1",                  # unknown metric
+                     "numCalls of main <= 1ms",             # time unit for a count
+                     "cumTime of main <= 5%",               # percentage for a time
+                     "cumTime of pkg.mod: <= 1",            # no function name
+                     "no new function above 2 of total"]:   # no percent sign
+            self.assertRaises(RuleError, parseRule, text)
+
+    def testFunctionNamesWithSpaces(self):
+        for text in ['cumTime of "<built-in method builtins.sorted>" <= 0.1s',
+                     'cumTime of <built-in method builtins.sorted> <= 0.1s']:
+            rule = parseRule(text)
+            self.assertEqual(rule.functionSpec.functionName, '<built-in method builtins.sorted>')
+            self.assertEqual(rule.functionSpec.pathSuffixes, ())
+            self.assertAlmostEqual(rule.value, 0.1)
+
+        rule = parseRule("ncalls of <method 'sort' of 'list' objects> grew < 10%")
+        self.assertIsInstance(rule, GrowthRule)
+        self.assertEqual(rule.functionSpec.functionName, "<method 'sort' of 'list' objects>")
+
+        # A quoted name can contain a colon and have a location.
+        rule = parseRule('time of pkg.mod:"a:b" >= 2ms')
+        self.assertEqual(rule.functionSpec.functionName, 'a:b')
+        self.assertEqual(rule.functionSpec.pathSuffixes, ('pkg/mod.py', 'pkg/mod/__init__.py'))
+
+    def testLineNumberInError(self):
+        with self.assertRaises(RuleError) as context:
+            parseRules(["cumTime of main <= 1", "bogus"])
+        self.assertIn("Line 2", str(context.exception))
+
+
+class TestCheckRules(unittest.TestCase):
+
+    def check(self, text, store, baselineStore=None):
+        [result] = checkRules([parseRule(text)], store, baselineStore=baselineStore)
+        return result.status
+
+    def testThreshold(self):
+        store = makeStore()
+        self.assertEqual(self.check("cumTime of pkg.parser:parse <= 0.5s", store), PASSED)
+        self.assertEqual(self.check("cumTime of pkg/parser.py:parse < 0.3", store), FAILED)
+        self.assertEqual(self.check("cumTime of parse <= 0.1", store), FAILED) # both functions
+        self.assertEqual(self.check("cumTime of missing <= 1", store), ERROR)
+        self.assertEqual(self.check('ncalls of "<built-in method builtins.sorted>" <= 3',
+                                    store), PASSED)
+        self.assertEqual(self.check("ncalls of <built-in method builtins.sorted> < 3",
+                                    store), FAILED)
+
+    def testGrowth(self):
+        baseline = makeStore(parseCalls=10)
+        self.assertEqual(self.check("ncalls of pkg.parser:parse grew <= 10%",
+                                    makeStore(parseCalls=11), baseline), PASSED)
+        self.assertEqual(self.check("ncalls of pkg.parser:parse grew <= 10%",
+                                    makeStore(parseCalls=12), baseline), FAILED)
+        # Without a baseline the rule can't be evaluated.
+        self.assertEqual(self.check("ncalls of parse grew <= 10%", baseline), ERROR)
+
+    def testNewFunction(self):
+        baseline = makeStore()
+        self.assertEqual(self.check("no new function above 2% of total",
+                                    makeStore(), baseline), PASSED)
+        self.assertEqual(self.check("no new function above 2% of total",
+                                    makeStore(withHelper=True), baseline), FAILED)
+
+
+class TestJUnitReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testReport(self):
+        rules = parseRules(["cumTime of main <= 2", "cumTime of main <= 0.5",
+                            "cumTime of missing <= 1"])
+        results = checkRules(rules, makeStore())
+        fileName = os.path.join(self.tempDir, 'report.xml')
+        writeJUnitReport(results, fileName)
+
+        suite = ET.parse(fileName).getroot().find('testsuite')
+        self.assertEqual((suite.get('tests'), suite.get('failures'), suite.get('errors')),
+                         ('3', '1', '1'))
+        testCases = suite.findall('testcase')
+        self.assertEqual([testCase.get('line') for testCase in testCases], ['1', '2', '3'])
+        self.assertIsNone(testCases[0].find('failure'))
+        self.assertIsNotNone(testCases[1].find('failure'))
+        self.assertIsNotNone(testCases[2].find('error'))
+
+
+if __name__ == '__main__':
+    unittest.main()
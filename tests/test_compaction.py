@@ -0,0 +1,89 @@
+""" Tests of the compaction of insignificant functions (statsstore.compactStats)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import copy
+import unittest
+
+from libpepeye.statsstore import StatsStore, compactStats
+from tests.helpers import makeStatsObject
+
+MAIN = ('a.py', 1, 'main')
+SMALL1 = ('a.py', 10, 'small1')
+SMALL2 = ('a.py', 20, 'small2')
+BIG = ('a.py', 30, 'big')
+TINY = ('b.py', 5, 'tiny')
+OTHER = ('a.py', 0, '<other (2 functions)>')
+
+
+def makeStats():
+    """ Returns a stats dictionary with two small functions in a.py and one in b.py.
+    """
+    return {
+        MAIN: (1, 1, 0.1, 1.0, {}),
+        SMALL1: (2, 2, 0.001, 0.001, {MAIN: (2, 2, 0.001, 0.001)}),
+        SMALL2: (1, 3, 0.002, 0.002, {MAIN: (1, 1, 0.001, 0.001),
+                                      SMALL1: (2, 2, 0.001, 0.001)}),
+        BIG: (3, 3, 0.8, 0.8, {MAIN: (1, 1, 0.3, 0.3), SMALL2: (2, 2, 0.5, 0.5)}),
+        TINY: (1, 1, 0.001, 0.001, {MAIN: (1, 1, 0.001, 0.001)}),
+    }
+
+
+class TestCompactStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = makeStats()
+        self.orgStats = copy.deepcopy(self.stats)
+        self.result, self.nCollapsed = compactStats(self.stats, 0.01)
+
+    def testInputUnchanged(self):
+        self.assertEqual(self.stats, self.orgStats)
+
+    def testCollapsedKeys(self):
+        self.assertEqual(self.nCollapsed, 2)
+        self.assertEqual(set(self.result), {MAIN, BIG, TINY, OTHER})
+
+    def testOtherRowTotals(self):
+        nPrimCalls, nCalls, time, cumTime, _callers = self.result[OTHER]
+        self.assertEqual(nPrimCalls, 3)
+        self.assertEqual(nCalls, 5)
+        self.assertAlmostEqual(time, 0.003)
+        self.assertAlmostEqual(cumTime, 0.003)
+
+    def testTotalTimePreserved(self):
+        orgTotal = sum(value[2] for value in self.stats.values())
+        self.assertAlmostEqual(sum(value[2] for value in self.result.values()), orgTotal)
+
+    def testCallersRewired(self):
+        # The edges from main are summed. The call from small1 to small2 is dropped.
+        self.assertEqual(self.result[OTHER][4], {MAIN: (3, 3, 0.002, 0.002)})
+        # Calls from a collapsed function become calls from the other row.
+        self.assertEqual(self.result[BIG][4], {MAIN: (1, 1, 0.3, 0.3),
+                                               OTHER: (2, 2, 0.5, 0.5)})
+
+    def testSingleFunctionNotCollapsed(self):
+        self.assertEqual(self.result[TINY], self.stats[TINY])
+
+    def testNothingToCollapse(self):
+        result, nCollapsed = compactStats(self.stats, 0.0)
+        self.assertIs(result, self.stats)
+        self.assertEqual(nCollapsed, 0)
+
+
+class TestCompactedStore(unittest.TestCase):
+
+    def testStore(self):
+        statsObject = makeStatsObject(makeStats())
+        store = StatsStore(statsObject, contentHash='hash', compactTime=0.01)
+        self.assertEqual(store.nCompacted, 2)
+        self.assertEqual(len(store), 4)
+        self.assertAlmostEqual(store.totalTime, 0.904)
+        self.assertEqual(store.contentHash, 'hash-compact0.01')
+        self.assertIsNotNone(store.findRow(OTHER))
+        self.assertEqual(len(statsObject.stats), 5) # The stats object is not changed.
+
+
+if __name__ == '__main__':
+    unittest.main()
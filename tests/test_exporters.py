@@ -0,0 +1,98 @@
+""" Tests of the exporters (libpepeye.exporters) on the example profile
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from libpepeye.exporters import (EXPORT_FORMATS, defaultExportFileName, exportStore, frameName,
+                                 writeCallgrind, writeCollapsedStacks, writeSpeedscope)
+from libpepeye.statsstore import STORE_REGISTRY
+
+SMALL_PROF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'examples', 'small.prof')
+
+
+class TestExporters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.store = STORE_REGISTRY.acquire(SMALL_PROF)
+
+    @classmethod
+    def tearDownClass(cls):
+        STORE_REGISTRY.release(cls.store)
+
+    def write(self, writer, **options):
+        fileObj = io.StringIO()
+        writer(self.store, fileObj, **options)
+        return fileObj.getvalue()
+
+    def testCollapsedStacks(self):
+        names = {frameName(statRow).replace(';', ':') for statRow in self.store.rows}
+        totalMicroSeconds = 0
+        for line in self.write(writeCollapsedStacks, minFraction=0).splitlines():
+            stack, microSeconds = line.rsplit(' ', 1)
+            self.assertTrue(set(stack.split(';')) <= names, stack)
+            totalMicroSeconds += int(microSeconds)
+
+        # Without pruning the self times of all stacks add up to the total time.
+        self.assertAlmostEqual(totalMicroSeconds * 1e-6, self.store.totalTime, delta=1e-3)
+
+    def testSpeedscope(self):
+        contents = json.loads(self.write(writeSpeedscope, name='small', minFraction=0))
+        frames = contents['shared']['frames']
+        self.assertEqual(len(frames), len(self.store))
+        self.assertEqual([frame['name'] for frame in frames],
+                         [statRow.functionName for statRow in self.store.rows])
+
+        [profile] = contents['profiles']
+        self.assertEqual(profile['name'], 'small')
+        self.assertEqual(len(profile['samples']), len(profile['weights']))
+        for stack in profile['samples']:
+            self.assertTrue(all(0 <= pos < len(frames) for pos in stack))
+        self.assertAlmostEqual(profile['endValue'], sum(profile['weights']))
+        self.assertAlmostEqual(profile['endValue'], self.store.totalTime, delta=1e-3)
+
+    def testCallgrind(self):
+        lines = self.write(writeCallgrind).splitlines()
+        self.assertEqual(lines[0], "# callgrind format")
+
+        # Each function is named once, the first time its id occurs.
+        names = {}
+        for line in lines:
+            match = re.match(r'^c?fn=\((\d+)\) (.*)$', line)
+            if match:
+                self.assertNotIn(match.group(1), names)
+                names[match.group(1)] = match.group(2)
+        self.assertEqual(sorted(names.values()),
+                         sorted(statRow.functionName for statRow in self.store.rows))
+
+        # The self costs directly follow the function blocks that are not calls.
+        selfCosts = [int(lines[idx + 1].split()[1]) for idx, line in enumerate(lines)
+                     if line.startswith('fn=') and not lines[idx + 1].startswith('cfi=')]
+        self.assertEqual(len(selfCosts), len(self.store))
+        self.assertAlmostEqual(sum(selfCosts) * 1e-6, self.store.totalTime, delta=1e-3)
+
+    def testExportStore(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            for formatName in EXPORT_FORMATS:
+                fileName = defaultExportFileName(os.path.join(tempDir, 'small.prof'), formatName)
+                exportStore(self.store, formatName, fileName)
+                self.assertGreater(os.path.getsize(fileName), 0, formatName)
+        finally:
+            shutil.rmtree(tempDir)
+
+        self.assertRaises(ValueError, exportStore, self.store, 'bogus', os.devnull)
+
+
+if __name__ == '__main__':
+    unittest.main()
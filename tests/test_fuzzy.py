@@ -0,0 +1,94 @@
+""" Tests of the fuzzy function finder (libpepeye.fuzzy)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import unittest
+
+from libpepeye.fuzzy import FuzzySearch, TrigramIndex, paddedText, trigrams
+from libpepeye.statsstore import StatsStore
+from tests.helpers import makeStatsObject
+
+KEYS = [('/src/loader.py', 1, 'load_file'),
+        ('/src/loader.py', 20, 'unload'),
+        ('/src/parser.py', 5, 'parse'),
+        ('/src/parser.py', 30, 'load_file'),
+        ('/src/aaaa.py', 1, 'aaaa')]
+
+
+def makeStore():
+    """ Returns a StatsStore with the KEYS. The cumulative time decreases per key.
+    """
+    stats = {key: (1, 1, 0.1, 1.0 - 0.1 * idx, {}) for idx, key in enumerate(KEYS)}
+    return StatsStore(makeStatsObject(stats))
+
+
+class TestTrigramIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.store = makeStore()
+        self.index = TrigramIndex(self.store.rows, self.store.column('cumTime'))
+
+    def nameId(self, name):
+        return self.index.names.index(name)
+
+    def testNames(self):
+        self.assertEqual(set(self.index.names), {'load_file', 'unload', 'parse', 'loader.py',
+                                                 'parser.py', 'aaaa', 'aaaa.py'})
+        self.assertTrue(self.index.isFileName(self.nameId('loader.py')))
+        self.assertFalse(self.index.isFileName(self.nameId('parse')))
+
+    def testRowPositions(self):
+        self.assertEqual(list(self.index.rowPositions(self.nameId('load_file'))), [0, 3])
+        self.assertEqual(list(self.index.rowPositions(self.nameId('parser.py'))), [2, 3])
+
+    def testExactScore(self):
+        """ A name that equals the query has a Jaccard similarity of one, plus all bonuses.
+        """
+        for name in ('parse', 'aaaa'): # aaaa has repeated trigrams
+            query = name
+            queryTrigrams = trigrams(paddedText(query))
+            score = self.index.nameScore(self.nameId(name), query, queryTrigrams, 1)
+            self.assertAlmostEqual(score, 1.0 + 1.0 + 0.5 + 1.0, msg=name)
+
+    def testNoSharedTrigrams(self):
+        self.assertIsNone(self.index.nameScore(self.nameId('parse'), 'xyz', {'xyz'}, 1))
+
+
+class TestFuzzySearch(unittest.TestCase):
+
+    def setUp(self):
+        self.store = makeStore()
+        self.index = TrigramIndex(self.store.rows, self.store.column('cumTime'))
+
+    def search(self, query, maxResults=50):
+        search = FuzzySearch(self.index, query, maxResults=maxResults)
+        while not search.advance(1.0):
+            pass
+        return [pos for _score, pos in search.results()]
+
+    def testRanking(self):
+        # Exact function name matches first, the hottest one before the other.
+        self.assertEqual(self.search('load_file')[:2], [0, 3])
+        self.assertEqual(self.search('parse')[0], 2)
+
+    def testCaseInsensitive(self):
+        self.assertEqual(self.search('LOAD_FILE'), self.search('load_file'))
+
+    def testFileNameMatch(self):
+        self.assertEqual(set(self.search('parser.py')[:2]), {2, 3})
+
+    def testUniqueResults(self):
+        positions = self.search('load')
+        self.assertEqual(len(positions), len(set(positions)))
+        self.assertEqual(len(self.search('load', maxResults=2)), 2)
+
+    def testEmptyQuery(self):
+        search = FuzzySearch(self.index, '  ')
+        self.assertTrue(search.done)
+        self.assertEqual(search.results(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+""" Tests of the path normalization (pathnormalizer.PathNormalizer and statsstore.normalizeStats)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+from libpepeye.pathnormalizer import PathNormalizer, parsePrefixRule
+from libpepeye.snapshots import METRIC_NUM_CALLS, SnapshotSeries
+from libpepeye.statsstore import StatsStore, normalizeStats
+from tests.helpers import makeStatsObject
+
+CALLER1 = ('/venv1/lib/site-packages/pkg/mod.py', 1, 'caller')
+CALLER2 = ('/venv2/lib/site-packages/pkg/mod.py', 1, 'caller')
+FUNC1 = ('/venv1/lib/site-packages/pkg/mod.py', 10, 'func')
+FUNC2 = ('/venv2/lib/site-packages/pkg/mod.py', 10, 'func')
+BUILTIN = ('~', 0, "<built-in method builtins.len>")
+
+NORM_CALLER = ('pkg/mod.py', 1, 'caller')
+NORM_FUNC = ('pkg/mod.py', 10, 'func')
+
+
+def makeStats():
+    """ Returns a stats dictionary of the same code in two virtual environments.
+    """
+    return {
+        CALLER1: (1, 1, 0.1, 0.5, {}),
+        CALLER2: (2, 2, 0.2, 1.0, {}),
+        FUNC1: (3, 3, 0.3, 0.4, {CALLER1: (3, 3, 0.3, 0.4)}),
+        FUNC2: (4, 5, 0.5, 0.8, {CALLER2: (4, 5, 0.5, 0.8)}),
+        BUILTIN: (6, 6, 0.01, 0.01, {FUNC1: (1, 1, 0.001, 0.001),
+                                     FUNC2: (5, 5, 0.009, 0.009)}),
+    }
+
+
+class TestPathNormalizer(unittest.TestCase):
+
+    def testSteps(self):
+        normalizer = PathNormalizer(prefixMap=[('/old/', '/new/')], stripSitePackages=True)
+        self.assertEqual(normalizer.normalize('/old/x.py'), '/new/x.py')
+        self.assertEqual(normalizer.normalize('/a/dist-packages/pkg/m.py'), 'pkg/m.py')
+        self.assertEqual(normalizer.normalize('~'), '~')
+        self.assertEqual(normalizer.normalize('<string>'), '<string>')
+        self.assertEqual(PathNormalizer(stripDirs=True).normalize('/a/b/c.py'), 'c.py')
+
+    def testEquality(self):
+        self.assertEqual(PathNormalizer(stripDirs=True), PathNormalizer(stripDirs=True))
+        self.assertNotEqual(PathNormalizer(stripDirs=True), PathNormalizer())
+        self.assertTrue(PathNormalizer().isIdentity)
+
+    def testParsePrefixRule(self):
+        self.assertEqual(parsePrefixRule('/a=/b'), ('/a', '/b'))
+        self.assertEqual(parsePrefixRule('/a='), ('/a', ''))
+        self.assertRaises(ValueError, parsePrefixRule, '/a')
+        self.assertRaises(ValueError, parsePrefixRule, '=/b')
+
+
+class TestNormalizeStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = makeStats()
+        normalizer = PathNormalizer(stripSitePackages=True)
+        self.result, self.nMerged, self.newPaths = normalizeStats(self.stats,
+                                                                  normalizer.normalize)
+
+    def testMergedKeys(self):
+        self.assertEqual(self.nMerged, 2)
+        self.assertEqual(set(self.result), {NORM_CALLER, NORM_FUNC, BUILTIN})
+        self.assertEqual(self.newPaths, {CALLER1[0]: NORM_CALLER[0], CALLER2[0]: NORM_CALLER[0]})
+
+    def testMergedTotals(self):
+        self.assertEqual(self.result[NORM_FUNC][:2], (7, 8))
+        self.assertAlmostEqual(self.result[NORM_FUNC][2], 0.8)
+        self.assertAlmostEqual(self.result[NORM_FUNC][3], 1.2)
+        totalTime = sum(value[2] for value in self.stats.values())
+        self.assertAlmostEqual(sum(value[2] for value in self.result.values()), totalTime)
+
+    def testMergedCallers(self):
+        edge = self.result[NORM_FUNC][4][NORM_CALLER]
+        self.assertEqual(edge[:2], (7, 8))
+        self.assertAlmostEqual(edge[3], 1.2)
+        self.assertEqual(list(self.result[BUILTIN][4]), [NORM_FUNC])
+        self.assertEqual(self.result[BUILTIN][4][NORM_FUNC][:2], (6, 6))
+
+    def testIdentity(self):
+        result, nMerged, newPaths = normalizeStats(self.stats, lambda path: path)
+        self.assertIs(result, self.stats)
+        self.assertEqual((nMerged, newPaths), (0, {}))
+
+
+class TestNormalizedStore(unittest.TestCase):
+
+    def testRawFilePath(self):
+        store = StatsStore(makeStatsObject(makeStats()), contentHash='hash',
+                           pathNormalizer=PathNormalizer(stripSitePackages=True))
+        self.assertEqual(store.nMerged, 2)
+        self.assertTrue(store.contentHash.startswith('hash-norm'))
+        statRow = store.findRow(NORM_FUNC)
+        self.assertEqual(statRow.filePath, 'pkg/mod.py')
+        self.assertEqual(statRow.rawFilePath, FUNC1[0]) # The first path of the merged rows
+        self.assertEqual(store.findRow(BUILTIN).rawFilePath, '~')
+
+    def testIdentityNormalizer(self):
+        store = StatsStore(makeStatsObject(makeStats()), contentHash='hash',
+                           pathNormalizer=PathNormalizer())
+        self.assertIsNone(store.pathNormalizer)
+        self.assertEqual(store.contentHash, 'hash')
+
+
+class TestNormalizedSeries(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testSeriesKeys(self):
+        fileName = os.path.join(self.tempDir, 'snapshot.prof')
+        with open(fileName, 'wb') as fileObj:
+            marshal.dump(makeStats(), fileObj)
+
+        normalizer = PathNormalizer(stripSitePackages=True)
+        series = SnapshotSeries(pathNormalizer=normalizer)
+        series.addFiles([fileName])
+        self.assertEqual(set(series.keys), {NORM_CALLER, NORM_FUNC, BUILTIN})
+        self.assertEqual(series.values(series.indexOfKey(NORM_FUNC), METRIC_NUM_CALLS), [8.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+""" Tests of the sorting and filter functions of libpepeye.query
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import random
+import unittest
+
+from array import array
+
+from libpepeye.query import filterPositions, filterStoreRows, lexSort, sortedPositions
+from libpepeye.statsstore import StatsStore
+from tests.helpers import makeStatsObject
+
+
+class TestLexSort(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(42)
+        self.nRows = 500
+        self.first = array('i', (rng.randrange(5) for _ in range(self.nRows)))
+        self.second = array('i', (rng.randrange(20) for _ in range(self.nRows)))
+
+    def expected(self, reverseFirst, reverseSecond):
+        """ The positions sorted with a tuple key, ties in the original order.
+        """
+        firstSign = -1 if reverseFirst else 1
+        secondSign = -1 if reverseSecond else 1
+        return sorted(range(self.nRows), key=lambda pos: (firstSign * self.first[pos],
+                                                          secondSign * self.second[pos]))
+
+    def testLexicographicOrder(self):
+        for reverseFlags in [(False, False), (True, False), (False, True), (True, True)]:
+            positions = list(range(self.nRows))
+            lexSort(positions, [self.first, self.second], reverseFlags)
+            self.assertEqual(positions, self.expected(*reverseFlags), reverseFlags)
+
+    def testStable(self):
+        """ Positions with equal ranks keep their original order, also in descending order.
+        """
+        ranks = array('i', [1, 0, 1, 0, 1, 0])
+        positions = [5, 4, 3, 2, 1, 0]
+        lexSort(positions, [ranks], [False])
+        self.assertEqual(positions, [5, 3, 1, 4, 2, 0])
+
+        positions = [5, 4, 3, 2, 1, 0]
+        lexSort(positions, [ranks], [True])
+        self.assertEqual(positions, [4, 2, 0, 5, 3, 1])
+
+    def testNoRankArrays(self):
+        positions = [2, 0, 1]
+        lexSort(positions, [], [])
+        self.assertEqual(positions, [2, 0, 1])
+
+
+class TestSortedPositions(unittest.TestCase):
+
+    def testPrefixOfFullSort(self):
+        rng = random.Random(7)
+        nRows = 1000
+        rankArrays = [array('i', (rng.randrange(nValues) for _ in range(nRows)))
+                      for nValues in (3, 50, nRows)]
+        for reverseFlags in [(False, False, False), (True, False, False), (False, True, True)]:
+            fullSort = list(range(nRows))
+            lexSort(fullSort, rankArrays, reverseFlags)
+            for nFirst in (0, 1, 10, 100, 999, 1000):
+                result = sortedPositions(list(range(nRows)), nFirst, rankArrays, reverseFlags)
+                self.assertGreaterEqual(len(result), nFirst)
+                self.assertEqual(result, fullSort[:len(result)], (reverseFlags, nFirst))
+
+
+class TestFilterPositions(unittest.TestCase):
+
+    def setUp(self):
+        main = ('/src/pkg/app.py', 1, 'main')
+        stats = {main: (1, 1, 0.1, 1.0, {})}
+        for idx in range(200):
+            key = ('/src/pkg/mod{}.py'.format(idx % 7), idx, 'func{}'.format(idx))
+            stats[key] = (idx + 1, idx + 1, 0.001, 0.002, {main: (idx + 1, idx + 1, 0.001, 0.002)})
+        self.store = StatsStore(makeStatsObject(stats))
+
+    def expected(self, predicate):
+        return [pos for pos, statRow in enumerate(self.store.rows) if predicate(statRow)]
+
+    def testEmptyFilter(self):
+        self.assertIsNone(filterPositions(self.store, ""))
+        self.assertEqual(filterStoreRows(self.store, ""), list(self.store.rows))
+
+    def testSearchText(self):
+        for workers in (1, 3):
+            self.assertEqual(filterPositions(self.store, "FUNC1", workers=workers),
+                             self.expected(lambda statRow: 'func1' in statRow.functionName))
+            self.assertEqual(filterPositions(self.store, "mod3.py", workers=workers),
+                             self.expected(lambda statRow: 'mod3.py' in statRow.filePath))
+
+    def testConditions(self):
+        self.assertEqual(filterPositions(self.store, "calls>150"),
+                         self.expected(lambda statRow: statRow.numCalls > 150))
+        self.assertEqual(filterPositions(self.store, "mod2 calls<=20 calls!=3"),
+                         self.expected(lambda statRow: 'mod2' in statRow.filePath and
+                                       statRow.numCalls <= 20 and statRow.numCalls != 3))
+
+    def testFilterStoreRows(self):
+        rows = filterStoreRows(self.store, "func12")
+        self.assertEqual(rows, [self.store.rows[pos]
+                                for pos in filterPositions(self.store, "func12")])
+
+
+if __name__ == '__main__':
+    unittest.main()
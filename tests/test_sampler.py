@@ -0,0 +1,72 @@
+""" Tests of the sampling profiler (libpepeye.sampler)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import pstats
+import runpy
+import shutil
+import tempfile
+import unittest
+
+from libpepeye.sampler import Sampler, recordScript
+from libpepeye.statsstore import StatsStore
+
+SCRIPT = """
+import time
+
+def busy(seconds):
+    endTime = time.perf_counter() + seconds
+    while time.perf_counter() < endTime:
+        pass
+
+def main():
+    busy(0.3)
+
+main()
+"""
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testInvalidFrequency(self):
+        self.assertRaises(ValueError, Sampler, frequency=0)
+
+    def testRecordScript(self):
+        scriptName = os.path.join(self.tempDir, 'script.py')
+        with open(scriptName, 'w') as fileObj:
+            fileObj.write(SCRIPT)
+        profName = os.path.join(self.tempDir, 'script.prof')
+
+        sampler = recordScript([scriptName], profName, frequency=200)
+        self.assertGreater(sampler.nSamples, 0)
+
+        # The file can be read by pstats and has the call stack of the script.
+        store = StatsStore(pstats.Stats(profName))
+        rowsOfName = {statRow.functionName: statRow for statRow in store.rows
+                      if statRow.filePath == scriptName}
+        self.assertEqual(set(rowsOfName), {'<module>', 'busy', 'main'})
+        busy, main = rowsOfName['busy'], rowsOfName['main']
+        self.assertGreater(busy.numCalls, 0)
+        self.assertGreater(busy.time, 0)
+        self.assertLessEqual(busy.time, busy.cumTime)
+        self.assertGreaterEqual(main.numCalls, busy.numCalls)
+        callerKeys = [store.rows[pos].key for pos, _edge in
+                      store.callers(store.position(busy.key))]
+        self.assertIn(main.key, callerKeys)
+
+        # The runpy functions that start the script are left out.
+        runpyFile = runpy.run_path.__code__.co_filename
+        self.assertFalse([statRow for statRow in store.rows if statRow.filePath == runpyFile])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+""" Tests of the requests of the profile server (libpepeye.server)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import json
+import os
+import unittest
+
+from libpepeye.server import MAX_LIMIT, ProfileServer
+
+SMALL_PROF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'examples', 'small.prof')
+
+
+class TestProfileServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ProfileServer([SMALL_PROF, SMALL_PROF])
+        cls.store = cls.server._stores[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def get(self, target, ifNoneMatch=None):
+        """ Returns the (status, ETag, decoded JSON or None) of a GET request.
+        """
+        status, etag, body = self.server.handleRequest('GET', target, ifNoneMatch=ifNoneMatch)
+        return status, etag, json.loads(body.decode('utf-8')) if body else None
+
+    def testIndexAndProfiles(self):
+        status, _etag, result = self.get('/')
+        self.assertEqual(status, 200)
+        self.assertIn('/api/rows', result['endpoints'])
+
+        status, _etag, result = self.get('/api/profiles')
+        self.assertEqual(status, 200)
+        self.assertEqual([profile['nRows'] for profile in result], [len(self.store)] * 2)
+
+    def testETag(self):
+        status, etag, result = self.get('/api/rows?limit=5')
+        self.assertEqual(status, 200)
+        self.assertIsNotNone(etag)
+
+        # The same request gives the same ETag, also from the response cache.
+        self.assertEqual(self.get('/api/rows?limit=5'), (200, etag, result))
+        self.assertEqual(self.get('/api/rows?limit=5', ifNoneMatch=etag), (304, etag, None))
+        self.assertEqual(self.get('/api/rows?limit=5', ifNoneMatch='"other", ' + etag)[0], 304)
+        self.assertEqual(self.get('/api/rows?limit=5', ifNoneMatch='"other"')[0], 200)
+
+        _status, otherEtag, _result = self.get('/api/rows?limit=6')
+        self.assertNotEqual(otherEtag, etag)
+
+    def testRows(self):
+        status, _etag, result = self.get('/api/rows?sort=time&order=desc&offset=2&limit=3')
+        self.assertEqual(status, 200)
+        self.assertEqual(result['total'], len(self.store))
+        expected = sorted(self.store.rows, key=lambda statRow: -statRow.time)[2:5]
+        self.assertEqual([row['time'] for row in result['rows']],
+                         [statRow.time for statRow in expected])
+
+        for row in result['rows']:
+            status, _etag, single = self.get('/api/rows/{}'.format(row['id']))
+            self.assertEqual((status, single), (200, row))
+
+    def testEdges(self):
+        status, _etag, result = self.get('/api/rows?sort=cumTime&limit=1')
+        rowId = result['rows'][0]['id']
+        status, _etag, result = self.get('/api/rows/{}/callees'.format(rowId))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(result['callees']), len(self.store.callees(rowId)))
+
+    def testBadRequests(self):
+        for target in ['/api/rows?limit=0',
+                       '/api/rows?limit={}'.format(MAX_LIMIT + 1),
+                       '/api/rows?offset=-1',
+                       '/api/rows?limit=x',
+                       '/api/rows?sort=bogus',
+                       '/api/rows?order=up',
+                       '/api/rows/x',
+                       '/api/callgraph?threshold=x',
+                       '/api/callgraph?maxNodes=0',
+                       '/api/diff?sort=bogus']:
+            status, etag, result = self.get(target)
+            self.assertEqual(status, 400, target)
+            self.assertIsNone(etag)
+            self.assertIn('error', result)
+
+    def testNotFound(self):
+        for target in ['/other', '/api/bogus', '/api/rows?profile=2',
+                       '/api/rows/{}'.format(len(self.store)), '/api/rows/0/bogus']:
+            self.assertEqual(self.get(target)[0], 404, target)
+
+    def testMethodNotAllowed(self):
+        status, _etag, _body = self.server.handleRequest('POST', '/api/rows')
+        self.assertEqual(status, 405)
+
+    def testCallGraphMaxNodes(self):
+        status, _etag, result = self.get('/api/callgraph?threshold=0&maxNodes=3')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(result['nodes']), 3)
+        nodeIds = {node['id'] for node in result['nodes']}
+        for edge in result['edges']:
+            self.assertIn(edge['caller'], nodeIds)
+            self.assertIn(edge['callee'], nodeIds)
+
+        _status, _etag, result = self.get('/api/callgraph?threshold=0&maxNodes=1000')
+        self.assertEqual(len(result['nodes']), len(self.store))
+
+    def testDiff(self):
+        # The profiles are the same, so there are no differences.
+        status, _etag, result = self.get('/api/diff?base=0&profile=1&limit=5')
+        self.assertEqual(status, 200)
+        self.assertEqual((result['total'], result['rows']), (0, []))
+        self.assertEqual(self.get('/api/diff?base=2')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()